@@ -1,55 +1,682 @@
-from time import sleep
+from time import sleep, monotonic
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
 import numpy as np
 from enum import IntEnum
 from struct import unpack
 from struct import pack
 
+from clock import SYSTEM_CLOCK
+
+
+class FeedbackTable:
+    """
+    Precomputed feedback decode tables for one (PMAX, VMAX, TMAX) set 反馈解码查找表
+    65536 entries for the 16-bit position, 4096 for the 12-bit velocity and torque.
+    The numpy arrays serve the vectorized path, the lists return plain Python floats.
+    """
+    __slots__ = ("limits", "q", "dq", "tau", "q_list", "dq_list", "tau_list")
+
+    def __init__(self, Q_MAX, DQ_MAX, TAU_MAX):
+        self.limits = (Q_MAX, DQ_MAX, TAU_MAX)
+        self.q = np.arange(1 << 16) / ((1 << 16) - 1) * (2 * Q_MAX) - Q_MAX
+        self.dq = np.arange(1 << 12) / ((1 << 12) - 1) * (2 * DQ_MAX) - DQ_MAX
+        self.tau = np.arange(1 << 12) / ((1 << 12) - 1) * (2 * TAU_MAX) - TAU_MAX
+        self.q_list = self.q.tolist()
+        self.dq_list = self.dq.tolist()
+        self.tau_list = self.tau.tolist()
+
+
+_feedback_tables = {}
+
+
+def get_feedback_table(Q_MAX, DQ_MAX, TAU_MAX):
+    """
+    get (or build once) the decode table for a set of limits 获取解码查找表，按限幅参数缓存
+    """
+    key = (float(Q_MAX), float(DQ_MAX), float(TAU_MAX))
+    table = _feedback_tables.get(key)
+    if table is None:
+        table = _feedback_tables[key] = FeedbackTable(*key)
+    return table
+
+
+class MotorBank:
+    """
+    Struct-of-arrays state storage for many motors 多电机状态的结构化数组存储
+    q/dq/tau/timestamps/enable flags live in contiguous numpy arrays indexed by slot,
+    and a precomputed CAN-ID -> slot table routes feedback frames without dict lookups.
+    """
+    MAX_CAN_ID = 0x800  # standard 11-bit CAN IDs
+    BATCH_MIN = 4  # below this many frames the per-frame path is cheaper than numpy
+    # alpha-beta state estimator, see estimate(); gains apply to every slot
+    EST_ALPHA = 0.5  # position correction per frame
+    EST_BETA = 0.15  # velocity correction from the position residual
+    EST_GAMMA = 0.3  # weight of the drive's own (12-bit) velocity reading
+    EST_RESET_GAP = 0.5  # seconds without feedback after which the estimate restarts from the measurement
+
+    def __init__(self, capacity=16, clock=SYSTEM_CLOCK):
+        self.clock = clock  # time source of the stamps below and of the parameter cache ages
+        self.capacity = 0
+        self.count = 0
+        self.motors = []
+        self.q = np.zeros(0)
+        self.dq = np.zeros(0)
+        self.tau = np.zeros(0)
+        self.stamp = np.zeros(0)  # clock.monotonic() of the last decoded feedback, 0 = never
+        self.rx_count = np.zeros(0, np.int64)  # feedback frames decoded per slot
+        self.enabled = np.zeros(0, bool)
+        self.est_q = np.zeros(0)  # filtered position at est_stamp
+        self.est_dq = np.zeros(0)  # filtered velocity
+        self.est_stamp = np.zeros(0)  # receive time the estimate refers to, 0 = no estimate yet
+        self.status = np.zeros(0, np.uint8)  # state nibble of data[0]: 0 disabled, 1 enabled, >=8 fault
+        self.temp_mos = np.zeros(0)  # data[6], deg C
+        self.temp_rotor = np.zeros(0)  # data[7], deg C
+        self.limits = np.zeros((0, 3))  # Q_MAX, DQ_MAX, TAU_MAX per slot
+        self.tables = []  # FeedbackTable per slot
+        self.slot_of_id = np.full(self.MAX_CAN_ID, -1, np.int32)
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        def resized(arr, shape):
+            new = np.zeros(shape, arr.dtype)
+            new[:len(arr)] = arr
+            return new
+        self.q = resized(self.q, capacity)
+        self.dq = resized(self.dq, capacity)
+        self.tau = resized(self.tau, capacity)
+        self.stamp = resized(self.stamp, capacity)
+        self.rx_count = resized(self.rx_count, capacity)
+        self.enabled = resized(self.enabled, capacity)
+        self.est_q = resized(self.est_q, capacity)
+        self.est_dq = resized(self.est_dq, capacity)
+        self.est_stamp = resized(self.est_stamp, capacity)
+        self.status = resized(self.status, capacity)
+        self.temp_mos = resized(self.temp_mos, capacity)
+        self.temp_rotor = resized(self.temp_rotor, capacity)
+        self.limits = resized(self.limits, (capacity, 3))
+        self.capacity = capacity
+
+    def add(self, motor, limit_param=None):
+        """
+        Move a motor into this bank, keeping its current state 把电机的状态迁移到本存储中
+        :return: slot index
+        """
+        if motor._bank is self:
+            return motor._slot
+        if self.count == self.capacity:
+            self._grow(max(1, self.capacity * 2))
+        slot = self.count
+        self.count += 1
+        old_bank, old_slot = motor._bank, motor._slot
+        if old_bank is not None:
+            self.q[slot] = old_bank.q[old_slot]
+            self.dq[slot] = old_bank.dq[old_slot]
+            self.tau[slot] = old_bank.tau[old_slot]
+            self.stamp[slot] = old_bank.stamp[old_slot]
+            self.rx_count[slot] = old_bank.rx_count[old_slot]
+            self.enabled[slot] = old_bank.enabled[old_slot]
+            self.est_q[slot] = old_bank.est_q[old_slot]
+            self.est_dq[slot] = old_bank.est_dq[old_slot]
+            self.est_stamp[slot] = old_bank.est_stamp[old_slot]
+            self.status[slot] = old_bank.status[old_slot]
+            self.temp_mos[slot] = old_bank.temp_mos[old_slot]
+            self.temp_rotor[slot] = old_bank.temp_rotor[old_slot]
+        self.motors.append(motor)
+        self.tables.append(None)
+        if limit_param is not None:
+            self._set_limits(slot, limit_param[motor.MotorType])
+        motor._bank = self
+        motor._slot = slot
+        self.slot_of_id[motor.SlaveID] = slot
+        if motor.MasterID != 0:
+            self.slot_of_id[motor.MasterID] = slot
+        return slot
+
+    def _set_limits(self, slot, limits):
+        self.limits[slot] = limits
+        self.tables[slot] = get_feedback_table(*limits)
+
+    def refresh_limits(self, limit_param):
+        """
+        re-read PMAX/VMAX/TMAX for every slot and switch to the matching decode tables
+        """
+        for slot, motor in enumerate(self.motors):
+            self._set_limits(slot, limit_param[motor.MotorType])
+
+    def decode(self, frames, now):
+        """
+        Decode a batch of received frames in one vectorized pass 批量解析反馈帧
+        :param frames: (N, 16) uint8 array of raw USB-CAN frames
+        :param now: receive timestamp
+        :return: array of the slots that were updated
+        """
+        frames = frames[frames[:, 1] == 0x11]
+        if not len(frames):
+            return np.zeros(0, np.int32)
+        data = frames[:, 7:15].astype(np.uint32)
+        raw_id = frames[:, 3:7].astype(np.uint32)
+        can_id = raw_id[:, 0] | (raw_id[:, 1] << 8) | (raw_id[:, 2] << 16) | (raw_id[:, 3] << 24)
+        # frames sent with CANID 0 carry the MasterID in the low nibble of data[0]
+        lookup_id = np.where(can_id != 0, can_id, data[:, 0] & 0x0f)
+        slots = np.full(len(frames), -1, np.int32)
+        in_range = lookup_id < self.MAX_CAN_ID
+        slots[in_range] = self.slot_of_id[lookup_id[in_range]]
+        known = slots >= 0
+        slots, data = slots[known], data[known]
+        if not len(slots):
+            return slots
+        q_uint = (data[:, 1] << 8) | data[:, 2]
+        dq_uint = (data[:, 3] << 4) | (data[:, 4] >> 4)
+        tau_uint = ((data[:, 4] & 0xf) << 8) | data[:, 5]
+        state = (data[:, 0] >> 4).astype(np.uint8)
+        # later frames for the same slot overwrite earlier ones, like sequential decoding
+        tables = {id(self.tables[slot]): self.tables[slot] for slot in np.unique(slots)}
+        if len(tables) == 1:
+            table = next(iter(tables.values()))
+            self.q[slots] = table.q[q_uint]
+            self.dq[slots] = table.dq[dq_uint]
+            self.tau[slots] = table.tau[tau_uint]
+        else:
+            for i, slot in enumerate(slots):
+                table = self.tables[slot]
+                self.q[slot] = table.q_list[q_uint[i]]
+                self.dq[slot] = table.dq_list[dq_uint[i]]
+                self.tau[slot] = table.tau_list[tau_uint[i]]
+        self.status[slots] = state
+        self.enabled[slots] = state == 1
+        self.temp_mos[slots] = data[:, 6]
+        self.temp_rotor[slots] = data[:, 7]
+        self.stamp[slots] = now
+        np.add.at(self.rx_count, slots, 1)
+        slots = np.unique(slots)
+        self.estimate(slots, now)
+        return slots
+
+    def estimate(self, slots, now):
+        """
+        Alpha-beta update of the filtered q/dq from the feedback just decoded into `slots`
+        (unique), timestamped with its receive time 用最新反馈更新状态估计
+        The position residual against the constant-velocity prediction corrects both
+        q and dq; the drive's quantized velocity reading is blended in with EST_GAMMA.
+        """
+        t0 = self.est_stamp[slots]
+        dt = now - t0
+        q_meas, dq_meas = self.q[slots], self.dq[slots]
+        q_pred = self.est_q[slots] + self.est_dq[slots] * dt
+        residual = q_meas - q_pred
+        dq = self.est_dq[slots] + np.where(dt > 0, self.EST_BETA * residual / np.maximum(dt, 1e-9), 0.0)
+        dq += self.EST_GAMMA * (dq_meas - dq)
+        restart = (t0 <= 0) | (dt > self.EST_RESET_GAP)
+        self.est_q[slots] = np.where(restart, q_meas, q_pred + self.EST_ALPHA * residual)
+        self.est_dq[slots] = np.where(restart, dq_meas, dq)
+        self.est_stamp[slots] = now
+
+    def estimate_slot(self, slot, now):
+        """
+        scalar estimate() for a single frame, cheaper than the numpy path 单帧状态估计
+        """
+        t0 = self.est_stamp[slot]
+        dt = now - t0
+        q_meas, dq_meas = float(self.q[slot]), float(self.dq[slot])
+        if t0 <= 0 or dt > self.EST_RESET_GAP:
+            q, dq = q_meas, dq_meas
+        else:
+            q_pred = float(self.est_q[slot]) + float(self.est_dq[slot]) * dt
+            residual = q_meas - q_pred
+            dq = float(self.est_dq[slot])
+            if dt > 0:
+                dq += self.EST_BETA * residual / dt
+            dq += self.EST_GAMMA * (dq_meas - dq)
+            q = q_pred + self.EST_ALPHA * residual
+        self.est_q[slot] = q
+        self.est_dq[slot] = dq
+        self.est_stamp[slot] = now
+
+
+class SerialWriter:
+    """
+    Background serial writer with two priority lanes 后台串口写线程，带两条优先级通道
+    - real-time lane: control frames, only the newest frame per CAN ID is kept, so
+      superseded setpoints are dropped when the writer falls behind
+    - config lane: enable/disable/parameter traffic, FIFO, never dropped
+    - urgent frames (e.g. bulk disable) jump ahead of both lanes and are never capped
+    Everything pending is coalesced into one serial write: urgent frames, real-time
+    frames, then up to max_config_per_write config frames in submission order.
+    """
+    def __init__(self, serial_device, on_write=None, max_config_per_write=8):
+        self.serial_ = serial_device
+        self.on_write = on_write  # optional callback(list of motor ids) after each write
+        self.max_config_per_write = max_config_per_write
+        self._cond = threading.Condition()
+        self._realtime = {}  # CAN ID -> frame bytes
+        self._config = deque()  # (CAN ID, frame bytes)
+        self._urgent = []  # (CAN ID, frame bytes)
+        self._hold = 0
+        self._busy = False
+        self._running = True
+        self.frames_written = 0
+        self.writes = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_write_time = 0.0
+        self._thread = threading.Thread(target=self._run, name="serial-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, motor_id, frame: bytes, realtime=False, urgent=False):
+        """
+        queue a frame without blocking 非阻塞地提交一帧
+        """
+        with self._cond:
+            if urgent:
+                self._urgent.append((motor_id, frame))
+            elif realtime:
+                if motor_id in self._realtime:
+                    self.dropped += 1
+                self._realtime[motor_id] = frame
+            else:
+                self._config.append((motor_id, frame))
+            if not self._hold:
+                self._cond.notify()
+
+    @contextmanager
+    def batch(self):
+        """
+        hold the writer while several frames are queued, then send them in one write
+        """
+        with self._cond:
+            self._hold += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._hold -= 1
+                if not self._hold:
+                    self._cond.notify()
+
+    def _pending(self):
+        return bool(self._urgent or self._realtime or self._config)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and (self._hold or not self._pending()):
+                    self._cond.wait()
+                if not self._running and not self._pending():
+                    return
+                frames = self._urgent + list(self._realtime.items())
+                self._urgent = []
+                self._realtime = {}
+                for _ in range(min(len(self._config), self.max_config_per_write)):
+                    frames.append(self._config.popleft())
+                self._busy = True
+            t0 = monotonic()
+            try:
+                self.serial_.write(b''.join(frame for _, frame in frames))
+            except Exception as e:
+                self.errors += 1
+                print(f"SerialWriter ERROR : {e}")
+            write_time = monotonic() - t0
+            self.writes += 1
+            self.frames_written += len(frames)
+            if write_time > self.max_write_time:
+                self.max_write_time = write_time
+            if self.on_write is not None:
+                self.on_write([motor_id for motor_id, _ in frames])
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def flush(self, timeout=1.0):
+        """
+        wait until everything queued so far has been written 等待队列写完
+        :return: True if the queue drained before the timeout
+        """
+        deadline = monotonic() + timeout
+        with self._cond:
+            while self._pending() or self._busy:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=1.0):
+        self.flush(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._urgent) + len(self._realtime) + len(self._config)
+        return {
+            "writes": self.writes,
+            "frames_written": self.frames_written,
+            "dropped_superseded": self.dropped,
+            "errors": self.errors,
+            "queued": queued,
+            "max_write_ms": self.max_write_time * 1000.0,
+        }
+
+
+class BusStats:
+    """
+    TX/RX frame and byte accounting for one USB-CAN adapter 总线带宽统计
+    Utilization is estimated from the frame formats: 30-byte USB frames out, 16-byte
+    USB frames back (10 bits per byte on the serial link), and 8-byte standard CAN
+    frames sharing one half-duplex bus in both directions.
+    """
+    USB_TX_FRAME_BYTES = 30
+    USB_RX_FRAME_BYTES = 16
+    CAN_FRAME_BITS = 135  # 8-byte standard frame incl. worst-case bit stuffing and inter-frame space
+
+    def __init__(self, serial_baud=921600, can_bitrate=1000000, clock=SYSTEM_CLOCK):
+        self.clock = clock
+        self.serial_baud = serial_baud
+        self.can_bitrate = can_bitrate
+        self.tx_frames = 0
+        self.rx_frames = 0
+        self.rx_bytes = 0
+        self.rx_discarded = 0  # bytes skipped while resynchronizing on 0xAA ... 0x55 frames
+        self._last_sample = (clock.monotonic(), 0, 0, 0)
+        self.last = None
+
+    @property
+    def tx_bytes(self):
+        return self.tx_frames * self.USB_TX_FRAME_BYTES
+
+    def on_tx(self, frames=1):
+        self.tx_frames += frames
+
+    def on_rx(self, frames, nbytes):
+        self.rx_frames += frames
+        self.rx_bytes += nbytes
+
+    def utilization(self, tx_fps, rx_fps, rx_bytes_ps=None):
+        """
+        estimated load for given frame rates, 1.0 = saturated 根据帧率估算负载率
+        """
+        if rx_bytes_ps is None:
+            rx_bytes_ps = rx_fps * self.USB_RX_FRAME_BYTES
+        serial_bytes_ps = self.serial_baud / 10.0
+        return {
+            "usb_tx": tx_fps * self.USB_TX_FRAME_BYTES / serial_bytes_ps,
+            "usb_rx": rx_bytes_ps / serial_bytes_ps,
+            "can": (tx_fps + rx_fps) * self.CAN_FRAME_BITS / self.can_bitrate,
+        }
+
+    def sample(self):
+        """
+        rates and utilization since the previous sample 计算自上次采样以来的速率与负载
+        """
+        now = self.clock.monotonic()
+        t0, tx0, rx0, rxb0 = self._last_sample
+        dt = max(now - t0, 1e-6)
+        tx_fps = (self.tx_frames - tx0) / dt
+        rx_fps = (self.rx_frames - rx0) / dt
+        util = self.utilization(tx_fps, rx_fps, (self.rx_bytes - rxb0) / dt)
+        self._last_sample = (now, self.tx_frames, self.rx_frames, self.rx_bytes)
+        self.last = {
+            "tx_fps": tx_fps,
+            "rx_fps": rx_fps,
+            # every command frame should be answered by one feedback frame
+            "reply_ratio": min(rx_fps / tx_fps, 1.0) if tx_fps > 0 else None,
+            "utilization": util,
+            "peak_utilization": max(util.values()),
+        }
+        return self.last
+
+    def plan(self, control_rate, motor_count, max_utilization=0.8):
+        """
+        check a control-rate x motor-count plan against the budget 检查控制频率与电机数量是否超出带宽
+        assumes one command and one reply frame per motor per cycle
+        :return: dict with the predicted utilization, the highest admissible rate and ok flag
+        """
+        fps = control_rate * motor_count
+        util = self.utilization(fps, fps)
+        peak = max(util.values())
+        per_cycle = max(self.utilization(motor_count, motor_count).values())
+        return {
+            "control_rate": control_rate,
+            "motor_count": motor_count,
+            "utilization": util,
+            "peak_utilization": peak,
+            "max_rate": max_utilization / per_cycle if per_cycle > 0 else None,
+            "ok": peak <= max_utilization,
+        }
+
+
+class StatusPoller:
+    """
+    Round-robin status refresh for motors that do not produce feedback on their own
+    (POS_VEL / VEL mode, idle or disabled motors) 轮询刷新电机状态
+    - each registered motor has its own refresh rate
+    - a motor that already produced feedback during its period is skipped
+    - requests are limited to budget_fps, so monitoring a rig costs a bounded amount of bus time
+    """
+    TICK = 0.002
+
+    def __init__(self, motor_control, budget_fps=200.0):
+        self.motor_control = motor_control
+        self.budget_fps = budget_fps
+        self._entries = []  # [motor, period, next_due]
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.requests = 0
+        self.skipped_fresh = 0
+        self.deferred = 0
+        self._thread = threading.Thread(target=self._run, name="status-poller", daemon=True)
+        self._thread.start()
+
+    def register(self, Motor, rate_hz):
+        """
+        poll Motor at rate_hz (re-registering changes the rate) 注册电机及其刷新频率
+        """
+        with self._lock:
+            for entry in self._entries:
+                if entry[0] is Motor:
+                    entry[1] = 1.0 / rate_hz
+                    return
+            self._entries.append([Motor, 1.0 / rate_hz, monotonic()])
+
+    def unregister(self, Motor):
+        with self._lock:
+            self._entries = [e for e in self._entries if e[0] is not Motor]
+            self._cursor = 0
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        tokens = 0.0
+        last = monotonic()
+        while not self._stop.is_set():
+            now = monotonic()
+            tokens = min(tokens + (now - last) * self.budget_fps, max(1.0, self.budget_fps * self.TICK))
+            last = now
+            sent = False
+            with self._lock:
+                entries = self._entries
+                n = len(entries)
+                for k in range(n):
+                    i = (self._cursor + k) % n
+                    entry = entries[i]
+                    motor, period, next_due = entry
+                    if next_due > now:
+                        continue
+                    last_recv = motor.last_recv_time
+                    if last_recv > 0 and now - last_recv < period:
+                        # fresh feedback already arrived this period (e.g. MIT control replies)
+                        entry[2] = last_recv + period
+                        self.skipped_fresh += 1
+                        continue
+                    if tokens < 1.0:
+                        self.deferred += 1
+                        self._cursor = i  # resume here once the budget refills
+                        break
+                    tokens -= 1.0
+                    entry[2] = now + period
+                    self.motor_control.request_motor_status(motor)
+                    self.requests += 1
+                    sent = True
+                else:
+                    if n:
+                        self._cursor = (self._cursor + 1) % n
+            self._stop.wait(self.TICK)
+            if sent:
+                self.motor_control.recv()  # collect the replies
+
+    def stats(self):
+        return {
+            "motors": len(self._entries),
+            "budget_fps": self.budget_fps,
+            "requests": self.requests,
+            "skipped_fresh": self.skipped_fresh,
+            "deferred": self.deferred,
+        }
+
 
 class Motor:
+    __slots__ = ("Pd", "Vd", "SlaveID", "MasterID", "MotorType", "NowControlMode", "temp_param_dict",
+                 "param_meta", "_bank", "_slot")
+
     def __init__(self, MotorType, SlaveID, MasterID):
         """
         define Motor object 定义电机对象
+        The state lives in a MotorBank; a Motor is a thin view onto one slot.
+        状态数据存放在 MotorBank 中，Motor 只是其中一个槽位的视图
         :param MotorType: Motor type 电机类型
         :param SlaveID: CANID 电机ID
         :param MasterID: MasterID 主机ID 建议不要设为0
         """
         self.Pd = float(0)
         self.Vd = float(0)
-        self.state_q = float(0)
-        self.state_dq = float(0)
-        self.state_tau = float(0)
         self.SlaveID = SlaveID
         self.MasterID = MasterID
         self.MotorType = MotorType
-        self.isEnable = False
         self.NowControlMode = Control_Type.MIT
         self.temp_param_dict = {}
+        self.param_meta = {}  # RID -> (monotonic timestamp, source) 参数缓存的时间戳与来源
+        self._bank = None
+        self._slot = None
+        MotorBank(capacity=1).add(self)  # private storage until added to a MotorControl
+
+    @property
+    def state_q(self):
+        return self._bank.q[self._slot]
+
+    @property
+    def state_dq(self):
+        return self._bank.dq[self._slot]
+
+    @property
+    def state_tau(self):
+        return self._bank.tau[self._slot]
+
+    @property
+    def isEnable(self):
+        return bool(self._bank.enabled[self._slot])
+
+    @isEnable.setter
+    def isEnable(self, value):
+        self._bank.enabled[self._slot] = value
+
+    @property
+    def last_recv_time(self):
+        """
+        clock.monotonic() of the last decoded feedback frame, 0 if none yet 最近一次反馈的时间戳
+        """
+        return self._bank.stamp[self._slot]
+
+    def getStatusCode(self):
+        """
+        state nibble of the last feedback frame: 0 disabled, 1 enabled, >=8 fault 电机状态码
+        """
+        return int(self._bank.status[self._slot])
+
+    def getStatusName(self):
+        """
+        name of the state nibble, see DM_STATUS 电机状态名称
+        """
+        code = int(self._bank.status[self._slot])
+        return DM_STATUS.get(code, f"unknown_0x{code:X}")
+
+    def isFault(self):
+        """
+        whether the drive reports an error state (code >= 8) 电机是否处于故障状态
+        """
+        return int(self._bank.status[self._slot]) >= 0x8
+
+    def getTemperatures(self):
+        """
+        (MOS, rotor) temperature in deg C from the last feedback, None if none yet 驱动板与转子温度
+        """
+        if self._bank.stamp[self._slot] <= 0:
+            return None
+        return float(self._bank.temp_mos[self._slot]), float(self._bank.temp_rotor[self._slot])
+
+    def getRxCount(self):
+        """
+        number of feedback frames decoded for this motor 已解析的反馈帧数
+        """
+        return int(self._bank.rx_count[self._slot])
+
+    def getDataAge(self):
+        """
+        seconds since the last decoded feedback frame, None if none yet 反馈数据的时长
+        """
+        stamp = self._bank.stamp[self._slot]
+        return self._bank.clock.monotonic() - stamp if stamp > 0 else None
+
+    def getEstimate(self):
+        """
+        filtered (position, velocity) at the receive time of the last feedback 滤波后的位置与速度
+        """
+        return float(self._bank.est_q[self._slot]), float(self._bank.est_dq[self._slot])
+
+    def predict(self, t):
+        """
+        filtered state extrapolated to clock time `t`, e.g. now + actuation delay 预测 t 时刻的状态
+        :return: (position, velocity), or None before the first feedback
+        """
+        bank, slot = self._bank, self._slot
+        stamp = bank.est_stamp[slot]
+        if stamp <= 0:
+            return None
+        dq = float(bank.est_dq[slot])
+        return float(bank.est_q[slot]) + dq * (t - stamp), dq
 
     def recv_data(self, q: float, dq: float, tau: float):
-        self.state_q = q
-        self.state_dq = dq
-        self.state_tau = tau
+        bank, slot = self._bank, self._slot
+        bank.q[slot] = q
+        bank.dq[slot] = dq
+        bank.tau[slot] = tau
 
     def getPosition(self):
         """
         get the position of the motor 获取电机位置
         :return: the position of the motor 电机位置
         """
-        return self.state_q
+        return self._bank.q[self._slot]
 
     def getVelocity(self):
         """
         get the velocity of the motor 获取电机速度
         :return: the velocity of the motor 电机速度
         """
-        return self.state_dq
+        return self._bank.dq[self._slot]
 
     def getTorque(self):
         """
         get the torque of the motor 获取电机力矩
         :return: the torque of the motor 电机力矩
         """
-        return self.state_tau
+        return self._bank.tau[self._slot]
 
     def getParam(self, RID):
         """
@@ -62,6 +689,57 @@ class Motor:
         else:
             return None
 
+    def store_param(self, RID, value, source):
+        """
+        record a parameter value in the cache 记录参数缓存
+        :param source: "read" (0x33 reply) or "write" (0x55 acknowledgement)
+        """
+        self.temp_param_dict[RID] = value
+        self.param_meta[RID] = (self._bank.clock.monotonic(), source)
+
+    def getParamAge(self, RID):
+        """
+        seconds since the cached value was received, None if not cached 参数缓存的时长
+        """
+        meta = self.param_meta.get(RID)
+        return self._bank.clock.monotonic() - meta[0] if meta is not None else None
+
+    def isParamFresh(self, RID, max_age=None):
+        """
+        whether the cached value is within its TTL 参数缓存是否未过期
+        :param max_age: override the register class TTL in seconds
+        """
+        age = self.getParamAge(RID)
+        if age is None:
+            return False
+        if max_age is None:
+            max_age = PARAM_TTL[param_class(RID)]
+        return max_age is None or age <= max_age
+
+    def getParamInfo(self, RID):
+        """
+        :return: dict of value / age / source / class / fresh for one cached register
+        """
+        meta = self.param_meta.get(RID)
+        return {
+            "value": self.temp_param_dict.get(RID),
+            "age": self._bank.clock.monotonic() - meta[0] if meta is not None else None,
+            "source": meta[1] if meta is not None else None,
+            "class": param_class(RID),
+            "fresh": self.isParamFresh(RID),
+        }
+
+    def invalidateParam(self, RID=None):
+        """
+        mark cached registers stale; the last known value stays readable via getParam 使参数缓存失效
+        :param RID: one RID, an iterable of RIDs, or None for all
+        """
+        if RID is None:
+            self.param_meta.clear()
+            return
+        for r in ([RID] if isinstance(RID, int) else RID):
+            self.param_meta.pop(r, None)
+
 
 class MotorControl:
     send_data_frame = np.array(
@@ -74,18 +752,31 @@ class MotorControl:
                    # H3510            DMG6215      DMH6220
                    [12.5 , 280 , 1],[12.5 , 45 , 10],[12.5 , 45 , 10]]
 
-    def __init__(self, serial_device):
+    def __init__(self, serial_device, async_write=False, clock=SYSTEM_CLOCK):
         """
         define MotorControl object 定义电机控制对象
         :param serial_device: serial object 串口对象
+        :param async_write: send frames through a background SerialWriter instead of
+                            writing on the calling thread 使用后台线程异步发送
+        :param clock: time source for feedback stamps, waits and retries, see clock.py 时钟
         """
         self.serial_ = serial_device
+        self.clock = clock
+        self.send_data_frame = self.send_data_frame.copy()  # per-instance frame buffer
+        self._frame_lock = threading.Lock()
+        self._recv_lock = threading.RLock()
         self.motors_map = dict()
+        self.bank = MotorBank(clock=clock)  # state of all added motors 所有电机的状态数组
         self.data_save = bytes()  # save data
+        self.on_send = None  # optional callback(motor_id) after each frame is written 每帧发送后的回调
+        self.on_feedback = None  # optional callback(Motor) after each feedback frame is decoded 每帧反馈解析后的回调
         if self.serial_.is_open:  # open the serial port
             print("Serial port is open")
             serial_device.close()
         self.serial_.open()
+        self.writer = SerialWriter(self.serial_, on_write=self.__frames_written) if async_write else None
+        self.bus = BusStats(serial_baud=getattr(self.serial_, "baudrate", None) or 921600, clock=clock)
+        self.poller = None  # StatusPoller, see start_status_poller
 
     def controlMIT(self, DM_Motor, kp: float, kd: float, q: float, dq: float, tau: float):
         """
@@ -119,7 +810,7 @@ class MotorControl:
         data_buf[5] = kd_uint >> 4
         data_buf[6] = ((kd_uint & 0xf) << 4) | ((tau_uint >> 8) & 0xf)
         data_buf[7] = tau_uint & 0xff
-        self.__send_data(DM_Motor.SlaveID, data_buf)
+        self.__send_data(DM_Motor.SlaveID, data_buf, realtime=True)
         self.recv()  # receive the data from serial port
 
     def control_delay(self, DM_Motor, kp: float, kd: float, q: float, dq: float, tau: float, delay: float):
@@ -134,7 +825,7 @@ class MotorControl:
         :param delay: delay time 延迟时间 单位秒
         """
         self.controlMIT(DM_Motor, kp, kd, q, dq, tau)
-        sleep(delay)
+        self.clock.sleep(delay)
 
     def control_Pos_Vel(self, Motor, P_desired: float, V_desired: float):
         """
@@ -153,7 +844,7 @@ class MotorControl:
         V_desired_uint8s = float_to_uint8s(V_desired)
         data_buf[0:4] = P_desired_uint8s
         data_buf[4:8] = V_desired_uint8s
-        self.__send_data(motorid, data_buf)
+        self.__send_data(motorid, data_buf, realtime=True)
         # time.sleep(0.001)
         self.recv()  # receive the data from serial port
 
@@ -170,7 +861,7 @@ class MotorControl:
         data_buf = np.array([0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00], np.uint8)
         Vel_desired_uint8s = float_to_uint8s(Vel_desired)
         data_buf[0:4] = Vel_desired_uint8s
-        self.__send_data(motorid, data_buf)
+        self.__send_data(motorid, data_buf, realtime=True)
         self.recv()  # receive the data from serial port
 
     def control_pos_force(self, Motor, Pos_des: float, Vel_des, i_des):
@@ -194,7 +885,7 @@ class MotorControl:
         data_buf[5] = Vel_uint >> 8
         data_buf[6] = ides_uint & 0xff
         data_buf[7] = ides_uint >> 8
-        self.__send_data(motorid, data_buf)
+        self.__send_data(motorid, data_buf, realtime=True)
         self.recv()  # receive the data from serial port
 
     def enable(self, Motor):
@@ -204,7 +895,7 @@ class MotorControl:
         :param Motor: Motor object 电机对象
         """
         self.__control_cmd(Motor, np.uint8(0xFC))
-        sleep(0.1)
+        self.clock.sleep(0.1)
         self.recv()  # receive the data from serial port
 
     def enable_old(self, Motor ,ControlMode):
@@ -217,7 +908,7 @@ class MotorControl:
         data_buf = np.array([0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xfc], np.uint8)
         enable_id = ((int(ControlMode)-1) << 2) + Motor.SlaveID
         self.__send_data(enable_id, data_buf)
-        sleep(0.1)
+        self.clock.sleep(0.1)
         self.recv()  # receive the data from serial port
 
     def disable(self, Motor):
@@ -226,7 +917,7 @@ class MotorControl:
         :param Motor: Motor object 电机对象
         """
         self.__control_cmd(Motor, np.uint8(0xFD))
-        sleep(0.01)
+        self.clock.sleep(0.01)
 
     def set_zero_position(self, Motor):
         """
@@ -234,58 +925,139 @@ class MotorControl:
         :param Motor: Motor object 电机对象
         """
         self.__control_cmd(Motor, np.uint8(0xFE))
-        sleep(0.1)
+        self.clock.sleep(0.1)
         self.recv()  # receive the data from serial port
 
+    def enable_all(self, motors=None, timeout=0.5):
+        """
+        enable every motor in one burst and wait for feedback confirming it 批量使能电机
+        :param motors: Motor list, default all added motors 默认全部电机
+        :param timeout: overall timeout in seconds 总超时时间
+        :return: per-motor report, see bulk_command
+        """
+        return self.bulk_command(0xFC, lambda m: m.isEnable, motors, timeout)
+
+    def disable_all(self, motors=None, timeout=0.1):
+        """
+        disable every motor in one urgent burst and wait for confirmation 批量失能电机
+        """
+        return self.bulk_command(0xFD, lambda m: m.getStatusCode() == 0, motors, timeout, urgent=True)
+
+    def zero_all(self, motors=None, timeout=0.5, tolerance=0.01):
+        """
+        set the zero position of every motor and wait until each reports q ~ 0 批量设置零点
+        """
+        return self.bulk_command(0xFE, lambda m: abs(m.getPosition()) < tolerance, motors, timeout)
+
+    def bulk_command(self, cmd, confirmed, motors=None, timeout=0.5, urgent=False):
+        """
+        send one command frame to many motors in a single write, then poll feedback concurrently
+        群发指令并等待所有电机的反馈确认
+        :param cmd: 0xFC enable / 0xFD disable / 0xFE set zero
+        :param confirmed: callback(Motor) -> bool, checked on feedback received after the burst
+        :return: {"ok", "elapsed", "motors": {SlaveID: {"confirmed", "latency", "status"}}}
+        """
+        motors = list(self.bank.motors if motors is None else motors)
+        since = self.clock.monotonic()
+        with self.batch():
+            for motor in motors:
+                self.__control_cmd(motor, np.uint8(cmd), urgent=urgent)
+        pending = {motor.SlaveID: motor for motor in motors}
+        latency = {}
+        deadline = since + timeout
+        while pending:
+            self.recv()
+            now = self.clock.monotonic()
+            for slave_id, motor in list(pending.items()):
+                if motor.last_recv_time >= since and confirmed(motor):
+                    latency[slave_id] = motor.last_recv_time - since
+                    del pending[slave_id]
+            if not pending or now >= deadline:
+                break
+            self.clock.sleep(0.0005)
+        report = {
+            slave_id: {
+                "confirmed": slave_id in latency,
+                "latency": latency.get(slave_id),
+                "status": motor.getStatusCode(),
+            } for slave_id, motor in ((m.SlaveID, m) for m in motors)
+        }
+        if pending:
+            print(f"bulk command 0x{cmd:02X} ERROR : no confirmation from motor(s) {sorted(pending)}")
+        return {"ok": not pending, "elapsed": self.clock.monotonic() - since, "motors": report}
+
     def recv(self):
-        # 把上次没有解析完的剩下的也放进来
-        data_recv = b''.join([self.data_save, self.serial_.read_all()])
-        packets = self.__extract_packets(data_recv)
-        for packet in packets:
-            data = packet[7:15]
-            CANID = (packet[6] << 24) | (packet[5] << 16) | (packet[4] << 8) | packet[3]
-            CMD = packet[1]
-            self.__process_packet(data, CANID, CMD)
+        """
+        read everything available from the serial port and dispatch it 读取并处理串口数据
+        feedback frames update the motor states, parameter replies update the parameter caches
+        """
+        with self._recv_lock:
+            # 把上次没有解析完的剩下的也放进来
+            data_recv = b''.join([self.data_save, self.serial_.read_all()])
+            packets = self.__extract_packets(data_recv)
+            if not packets:
+                return
+            self.bus.on_rx(len(packets), len(packets) * BusStats.USB_RX_FRAME_BYTES)
+            now = self.clock.monotonic()
+            feedback = []
+            for packet in packets:
+                if self.__is_param_reply(packet):
+                    CANID = (packet[6] << 24) | (packet[5] << 16) | (packet[4] << 8) | packet[3]
+                    self.__process_set_param_packet(packet[7:15], CANID, packet[1])
+                else:
+                    feedback.append(packet)
+            if len(feedback) >= MotorBank.BATCH_MIN:
+                # decode the whole batch into the bank arrays in one pass 批量解析
+                frames = np.frombuffer(b''.join(feedback), np.uint8).reshape(-1, 16)
+                slots = self.bank.decode(frames, now)
+                if self.on_feedback is not None:
+                    for slot in slots:
+                        self.on_feedback(self.bank.motors[slot])
+                return
+            for packet in feedback:
+                data = packet[7:15]
+                CANID = (packet[6] << 24) | (packet[5] << 16) | (packet[4] << 8) | packet[3]
+                CMD = packet[1]
+                self.__process_packet(data, CANID, CMD, now)
 
     def recv_set_param_data(self):
-        data_recv = self.serial_.read_all()
-        packets = self.__extract_packets(data_recv)
-        for packet in packets:
-            data = packet[7:15]
-            CANID = (packet[6] << 24) | (packet[5] << 16) | (packet[4] << 8) | packet[3]
-            CMD = packet[1]
-            self.__process_set_param_packet(data, CANID, CMD)
-
-    def __process_packet(self, data, CANID, CMD):
-        if CMD == 0x11:
-            if CANID != 0x00:
-                if CANID in self.motors_map:
-                    q_uint = np.uint16((np.uint16(data[1]) << 8) | data[2])
-                    dq_uint = np.uint16((np.uint16(data[3]) << 4) | (data[4] >> 4))
-                    tau_uint = np.uint16(((data[4] & 0xf) << 8) | data[5])
-                    MotorType_recv = self.motors_map[CANID].MotorType
-                    Q_MAX = self.Limit_Param[MotorType_recv][0]
-                    DQ_MAX = self.Limit_Param[MotorType_recv][1]
-                    TAU_MAX = self.Limit_Param[MotorType_recv][2]
-                    recv_q = uint_to_float(q_uint, -Q_MAX, Q_MAX, 16)
-                    recv_dq = uint_to_float(dq_uint, -DQ_MAX, DQ_MAX, 12)
-                    recv_tau = uint_to_float(tau_uint, -TAU_MAX, TAU_MAX, 12)
-                    self.motors_map[CANID].recv_data(recv_q, recv_dq, recv_tau)
-            else:
-                MasterID=data[0] & 0x0f
-                if MasterID in self.motors_map:
-                    q_uint = np.uint16((np.uint16(data[1]) << 8) | data[2])
-                    dq_uint = np.uint16((np.uint16(data[3]) << 4) | (data[4] >> 4))
-                    tau_uint = np.uint16(((data[4] & 0xf) << 8) | data[5])
-                    MotorType_recv = self.motors_map[MasterID].MotorType
-                    Q_MAX = self.Limit_Param[MotorType_recv][0]
-                    DQ_MAX = self.Limit_Param[MotorType_recv][1]
-                    TAU_MAX = self.Limit_Param[MotorType_recv][2]
-                    recv_q = uint_to_float(q_uint, -Q_MAX, Q_MAX, 16)
-                    recv_dq = uint_to_float(dq_uint, -DQ_MAX, DQ_MAX, 12)
-                    recv_tau = uint_to_float(tau_uint, -TAU_MAX, TAU_MAX, 12)
-                    self.motors_map[MasterID].recv_data(recv_q, recv_dq, recv_tau)
-
+        # parameter replies and feedback share one receive path, so neither is lost
+        self.recv()
+
+    def __is_param_reply(self, packet):
+        # parameter replies echo the motor's CAN ID in data[0:2] and 0x33 (read) / 0x55 (write) in data[2]
+        if packet[1] != 0x11 or (packet[9] != 0x33 and packet[9] != 0x55):
+            return False
+        slave_id = (packet[8] << 8) | packet[7]
+        motor = self.motors_map.get(slave_id)
+        return motor is not None and motor.SlaveID == slave_id
+
+    def __process_packet(self, data, CANID, CMD, now):
+        if CMD != 0x11:
+            return
+        # frames sent with CANID 0 carry the MasterID in the low nibble of data[0]
+        lookup_id = CANID if CANID != 0x00 else data[0] & 0x0f
+        if lookup_id >= MotorBank.MAX_CAN_ID:
+            return
+        bank = self.bank
+        slot = bank.slot_of_id[lookup_id]
+        if slot < 0:
+            return
+        # table lookups instead of per-frame float math 查表解码
+        table = bank.tables[slot]
+        bank.q[slot] = table.q_list[(data[1] << 8) | data[2]]
+        bank.dq[slot] = table.dq_list[(data[3] << 4) | (data[4] >> 4)]
+        bank.tau[slot] = table.tau_list[((data[4] & 0xf) << 8) | data[5]]
+        state = data[0] >> 4
+        bank.status[slot] = state
+        bank.enabled[slot] = state == 1
+        bank.temp_mos[slot] = data[6]
+        bank.temp_rotor[slot] = data[7]
+        bank.stamp[slot] = now
+        bank.rx_count[slot] += 1
+        bank.estimate_slot(slot, now)
+        if self.on_feedback is not None:
+            self.on_feedback(bank.motors[slot])
 
     def __process_set_param_packet(self, data, CANID, CMD):
         if CMD == 0x11 and (data[2] == 0x33 or data[2] == 0x55):
@@ -301,16 +1073,17 @@ class MotorControl:
                     masterid=slaveId
 
             RID = data[3]
+            source = "write" if data[2] == 0x55 else "read"
             # 读取参数得到的数据
             if is_in_ranges(RID):
                 #uint32类型
                 num = uint8s_to_uint32(data[4], data[5], data[6], data[7])
-                self.motors_map[masterid].temp_param_dict[RID] = num
+                self.motors_map[masterid].store_param(RID, num, source)
 
             else:
                 #float类型
                 num = uint8s_to_float(data[4], data[5], data[6], data[7])
-                self.motors_map[masterid].temp_param_dict[RID] = num
+                self.motors_map[masterid].store_param(RID, num, source)
 
 
     def addMotor(self, Motor):
@@ -321,23 +1094,61 @@ class MotorControl:
         self.motors_map[Motor.SlaveID] = Motor
         if Motor.MasterID != 0:
             self.motors_map[Motor.MasterID] = Motor
+        self.bank.add(Motor, self.Limit_Param)
         return True
 
-    def __control_cmd(self, Motor, cmd: np.uint8):
+    def __control_cmd(self, Motor, cmd: np.uint8, urgent=False):
         data_buf = np.array([0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, cmd], np.uint8)
-        self.__send_data(Motor.SlaveID, data_buf)
+        self.__send_data(Motor.SlaveID, data_buf, urgent=urgent)
 
-    def __send_data(self, motor_id, data):
+    def __send_data(self, motor_id, data, realtime=False, urgent=False):
         """
         send data to the motor 发送数据到电机
         :param motor_id:
         :param data:
+        :param realtime: control frame (may be superseded) rather than config traffic 是否为实时控制帧
+        :param urgent: write ahead of everything else queued 紧急帧优先发送
         :return:
         """
-        self.send_data_frame[13] = motor_id & 0xff
-        self.send_data_frame[14] = (motor_id >> 8)& 0xff  #id high 8 bits
-        self.send_data_frame[21:29] = data
-        self.serial_.write(bytes(self.send_data_frame.T))
+        with self._frame_lock:
+            self.send_data_frame[13] = motor_id & 0xff
+            self.send_data_frame[14] = (motor_id >> 8)& 0xff  #id high 8 bits
+            self.send_data_frame[21:29] = data
+            frame = bytes(self.send_data_frame.T)
+        if self.writer is not None:
+            self.writer.submit(motor_id, frame, realtime, urgent)
+            return
+        self.serial_.write(frame)
+        self.bus.on_tx()
+        if self.on_send is not None:
+            self.on_send(motor_id)
+
+    def __frames_written(self, motor_ids):
+        self.bus.on_tx(len(motor_ids))
+        if self.on_send is not None:
+            for motor_id in motor_ids:
+                self.on_send(motor_id)
+
+    def batch(self):
+        """
+        coalesce every frame sent inside the with-block into one serial write 合并发送
+        (no-op without async_write)
+        """
+        return self.writer.batch() if self.writer is not None else nullcontext()
+
+    def flush(self, timeout=1.0):
+        """
+        wait until all queued frames are written 等待所有排队的帧写出
+        """
+        return self.writer.flush(timeout) if self.writer is not None else True
+
+    def close(self):
+        """
+        stop the status poller and the background writer after draining it 关闭后台线程
+        """
+        self.stop_status_poller()
+        if self.writer is not None:
+            self.writer.close()
 
     def __read_RID_param(self, Motor, RID):
         can_id_l = Motor.SlaveID & 0xff #id low 8 bits
@@ -357,6 +1168,24 @@ class MotorControl:
             data_buf[4:8] = data_to_uint8s(int(data))
         self.__send_data(0x7FF, data_buf)
 
+    def __wait_param_reply(self, Motor, RID, since, max_retries, retry_interval, sleep_first=True):
+        """
+        poll the serial port until a reply for RID newer than `since` arrives 等待参数回复
+        :return: the replying Motor object, or None on timeout
+        """
+        for _ in range(max_retries):
+            if sleep_first:
+                self.clock.sleep(retry_interval)
+            self.recv_set_param_data()
+            target = self.motors_map.get(Motor.SlaveID)
+            if target is not None:
+                meta = target.param_meta.get(RID)
+                if meta is not None and meta[0] >= since:
+                    return target
+            if not sleep_first:
+                self.clock.sleep(retry_interval)
+        return None
+
     def switchControlMode(self, Motor, ControlMode):
         """
         switch the control mode of the motor 切换电机控制模式
@@ -366,21 +1195,20 @@ class MotorControl:
         max_retries = 10
         retry_interval = 0.05  #retry times
         RID = 10
+        Motor.invalidateParam(RID)
+        since = self.clock.monotonic()
         self.__write_motor_param(Motor, RID, np.uint8(ControlMode))
-        for _ in range(max_retries):
-            sleep(retry_interval)
-            self.recv_set_param_data()
-            if Motor.SlaveID in self.motors_map:
-                if RID in self.motors_map[Motor.SlaveID].temp_param_dict:
-                    if self.motors_map[Motor.SlaveID].temp_param_dict[RID] == ControlMode:
-                        return True
-                    else:
-                        return False
+        target = self.__wait_param_reply(Motor, RID, since, max_retries, retry_interval)
+        if target is not None and target.temp_param_dict[RID] == ControlMode:
+            target.NowControlMode = Control_Type(ControlMode)
+            return True
         return False
 
     def save_motor_param(self, Motor):
         """
         save the all parameter  to flash 保存所有电机参数
+        the firmware may normalise values while persisting, so cached config registers are invalidated
+        保存时固件可能修正参数值，因此清除缓存中的配置类参数
         :param Motor: Motor object 电机对象
         :return:
         """
@@ -389,7 +1217,18 @@ class MotorControl:
         data_buf = np.array([np.uint8(can_id_l), np.uint8(can_id_h), 0xAA, 0x00, 0x00, 0x00, 0x00, 0x00], np.uint8)
         self.disable(Motor)  # before save disable the motor
         self.__send_data(0x7FF, data_buf)
-        sleep(0.001)
+        Motor.invalidateParam([RID for RID in Motor.param_meta if param_class(RID) != "immutable"])
+        self.clock.sleep(0.001)
+
+    def check_bus_plan(self, control_rate, motor_count=None, max_utilization=0.8):
+        """
+        admission check for a control loop plan on this bus 控制计划的带宽准入检查
+        :param control_rate: control loop rate in Hz 控制频率
+        :param motor_count: motors commanded every cycle, default all added motors 电机数量
+        """
+        if motor_count is None:
+            motor_count = self.bank.count
+        return self.bus.plan(control_rate, motor_count, max_utilization)
 
     def change_limit_param(self, Motor_Type, PMAX, VMAX, TMAX):
         """
@@ -403,16 +1242,38 @@ class MotorControl:
         self.Limit_Param[Motor_Type][0] = PMAX
         self.Limit_Param[Motor_Type][1] = VMAX
         self.Limit_Param[Motor_Type][2] = TMAX
+        self.bank.refresh_limits(self.Limit_Param)
 
     def refresh_motor_status(self,Motor):
         """
         get the motor status 获得电机状态
         """
+        self.request_motor_status(Motor)
+        self.recv()  # receive the data from serial port
+
+    def request_motor_status(self, Motor):
+        """
+        send the 0xCC status request without waiting for the reply 只发送状态请求，不等待回复
+        """
         can_id_l = Motor.SlaveID & 0xff #id low 8 bits
         can_id_h = (Motor.SlaveID >> 8) & 0xff  #id high 8 bits
         data_buf = np.array([np.uint8(can_id_l), np.uint8(can_id_h), 0xCC, 0x00, 0x00, 0x00, 0x00, 0x00], np.uint8)
         self.__send_data(0x7FF, data_buf)
-        self.recv()  # receive the data from serial port
+
+    def start_status_poller(self, budget_fps=200.0):
+        """
+        start the background round-robin status poller 启动后台轮询刷新
+        :param budget_fps: maximum status requests per second on this bus 每秒最多请求帧数
+        :return: StatusPoller
+        """
+        if self.poller is None:
+            self.poller = StatusPoller(self, budget_fps)
+        return self.poller
+
+    def stop_status_poller(self):
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
 
     def change_motor_param(self, Motor, RID, data):
         """
@@ -425,36 +1286,59 @@ class MotorControl:
         max_retries = 20
         retry_interval = 0.05  #retry times
 
+        Motor.invalidateParam(RID)
+        since = self.clock.monotonic()
         self.__write_motor_param(Motor, RID, data)
-        for _ in range(max_retries):
-            self.recv_set_param_data()
-            if Motor.SlaveID in self.motors_map and RID in self.motors_map[Motor.SlaveID].temp_param_dict:
-                if abs(self.motors_map[Motor.SlaveID].temp_param_dict[RID] - data) < 0.1:
-                    return True
-                else:
-                    return False
-            sleep(retry_interval)
-        return False
+        target = self.__wait_param_reply(Motor, RID, since, max_retries, retry_interval, sleep_first=False)
+        if target is None:
+            return False
+        return abs(target.temp_param_dict[RID] - data) < 0.1
 
-    def read_motor_param(self, Motor, RID):
+    def read_motor_param(self, Motor, RID, max_age=None):
         """
         read only the RID of the motor 读取电机的内部信息例如 版本号等
+        a cached value is returned without bus traffic while it is fresh 缓存未过期时直接返回缓存值
         :param Motor: Motor object 电机对象
         :param RID: DM_variable 电机参数
+        :param max_age: override the register class TTL in seconds, 0 forces a bus read
         :return: 电机参数的值
         """
+        if Motor.isParamFresh(RID, max_age):
+            return Motor.temp_param_dict[RID]
         max_retries = 20
         retry_interval = 0.05  #retry times
+        since = self.clock.monotonic()
         self.__read_RID_param(Motor, RID)
-        for _ in range(max_retries):
-            sleep(retry_interval)
-            self.recv_set_param_data()
-            if Motor.SlaveID in self.motors_map:
-                if RID in self.motors_map[Motor.SlaveID].temp_param_dict:
-                    return self.motors_map[Motor.SlaveID].temp_param_dict[RID]
-                else:
-                    return None
-        return None
+        target = self.__wait_param_reply(Motor, RID, since, max_retries, retry_interval)
+        return target.temp_param_dict[RID] if target is not None else None
+
+    def prefetch_params(self, Motor, RIDs=None, background=True):
+        """
+        warm the parameter cache 预读取电机参数到缓存
+        registers that are still fresh are skipped 未过期的参数会被跳过
+        :param Motor: Motor object 电机对象
+        :param RIDs: DM_variable list, default PARAM_PREFETCH; "all" reads every register (one
+                     round trip each, a register the firmware ignores costs its full retry timeout)
+                     默认只读取 PARAM_PREFETCH，"all" 读取全部参数
+        :param background: run in a daemon thread 是否在后台线程中执行
+        :return: the thread when background, otherwise None
+        """
+        if RIDs is None:
+            RIDs = PARAM_PREFETCH
+        elif RIDs == "all":
+            RIDs = list(DM_variable)
+        RIDs = list(RIDs)
+
+        def run():
+            for RID in RIDs:
+                self.read_motor_param(Motor, RID)
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="param-prefetch", daemon=True)
+        thread.start()
+        return thread
 
     # -------------------------------------------------
     # Extract packets from the serial data
@@ -475,6 +1359,9 @@ class MotorControl:
             else:
                 i += 1
         self.data_save = data[remainder_pos:]
+        discarded = remainder_pos - len(frames) * frame_length
+        if discarded:
+            self.bus.rx_discarded += discarded
         return frames
 
 
@@ -623,3 +1510,37 @@ class Control_Type(IntEnum):
     POS_VEL = 2
     VEL = 3
     Torque_Pos = 4
+
+
+# Parameter cache classes and their TTL in seconds (None = never expires) 参数缓存分类与有效期
+PARAM_IMMUTABLE = frozenset({DM_variable.hw_ver, DM_variable.sw_ver, DM_variable.SN, DM_variable.sub_ver})
+PARAM_VOLATILE = frozenset({DM_variable.p_m, DM_variable.xout})
+PARAM_TTL = {"immutable": None, "config": 60.0, "volatile": 0.1}
+# Registers warmed at connect: the identity registers plus the ones the controller reads 连接时预读取的参数
+PARAM_PREFETCH = (DM_variable.SN, DM_variable.hw_ver, DM_variable.sw_ver, DM_variable.TIMEOUT, DM_variable.OT_Value,
+                  DM_variable.CTRL_MODE, DM_variable.PMAX, DM_variable.VMAX, DM_variable.TMAX)
+
+
+def param_class(RID):
+    """
+    classify a register as immutable, config or volatile 参数分类
+    """
+    if RID in PARAM_IMMUTABLE:
+        return "immutable"
+    if RID in PARAM_VOLATILE:
+        return "volatile"
+    return "config"
+
+
+# state nibble of feedback data[0] 反馈帧 data[0] 高四位的状态码
+DM_STATUS = {
+    0x0: "disabled",
+    0x1: "enabled",
+    0x8: "over_voltage",
+    0x9: "under_voltage",
+    0xA: "over_current",
+    0xB: "mos_over_temp",
+    0xC: "rotor_over_temp",
+    0xD: "comm_loss",
+    0xE: "overload",
+}
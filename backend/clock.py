@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Time sources for the control stack.
+
+GripperController and MotorControl never call time.monotonic() / time.sleep()
+or Event.wait() directly; they go through a clock object:
+
+    clock.monotonic()          seconds, for deadlines, stamps and intervals
+    clock.time()               epoch seconds, for records meant for humans
+    clock.sleep(seconds)
+    clock.wait(event, timeout) Event.wait() that a VirtualClock turns into a time jump
+
+SYSTEM_CLOCK is the wall clock and the default everywhere. A VirtualClock only
+moves when something sleeps on it, so a single thread that owns the clock, the
+control loop (GripperController.run_for) and the simulated motor (whose physics
+integrate lazily up to clock() on every bus access) advance in lockstep, as fast
+as the ticks compute:
+
+    clock = VirtualClock()
+    gripper = GripperController("sim://", 921600, 0x01, 0x11, 1.0, clock=clock)
+    gripper.connect()                    # no control thread under a virtual clock
+    gripper.set_mode("reciprocate")
+    gripper.run_for(600.0)               # ten simulated minutes
+"""
+import time
+
+
+class SystemClock:
+    realtime = True
+
+    def __call__(self):
+        return time.monotonic()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        return event.wait(timeout)
+
+
+class VirtualClock:
+    """
+    Simulated time for single-threaded lockstep runs. sleep() and wait() return
+    immediately after moving the clock forward; nothing else can set the event
+    meanwhile, so a wait always runs to its timeout unless the event is already set.
+    :param start: initial monotonic() reading, seconds
+    :param epoch: time() at monotonic() == 0, default the wall clock at creation
+    """
+    realtime = False
+
+    def __init__(self, start=0.0, epoch=None):
+        self.t = start
+        self.epoch = time.time() - start if epoch is None else epoch
+        self._listeners = []
+
+    def __call__(self):
+        return self.t
+
+    def monotonic(self):
+        return self.t
+
+    def time(self):
+        return self.epoch + self.t
+
+    def add_listener(self, callback):
+        """callback(t) after every advance, e.g. to sample the simulated plant once per sleep."""
+        self._listeners.append(callback)
+
+    def advance(self, seconds):
+        if seconds <= 0:
+            return
+        self.t += seconds
+        for callback in self._listeners:
+            callback(self.t)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+        if timeout is None:
+            raise RuntimeError("An untimed wait would never return under a virtual clock")
+        self.advance(timeout)
+        return event.is_set()
+
+
+SYSTEM_CLOCK = SystemClock()
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Run the GripperController (serial port + control loop) in a dedicated child process.
+
+The WebSocket server keeps talking to a GripperProcess object with the same
+set_mode / set_move_torque / get_status API as GripperController, but JSON
+encoding, client handling and garbage collection in the server no longer share
+a GIL with the real-time loop.
+
+- Commands go parent -> child over a multiprocessing Pipe (fire-and-forget, or
+  request/reply through call()).
+- Status goes child -> parent through a shared memory block guarded by a
+  sequence counter (seqlock), so get_status() never waits for the child.
+"""
+import gc
+import itertools
+import json
+import multiprocessing as mp
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+STATUS_SHM_SIZE = 64 * 1024
+# sequence (odd while a write is in progress), payload length
+_STATUS_HEADER = struct.Struct("<QI")
+
+
+class StatusBuffer:
+    """
+    Single-writer / multi-reader status block in shared memory.
+    The writer bumps the sequence to an odd value, copies the payload and then
+    bumps it to the next even value; readers retry until they see the same even
+    sequence before and after copying.
+    """
+    def __init__(self, name=None, size=STATUS_SHM_SIZE):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            _STATUS_HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.capacity = self.shm.size - _STATUS_HEADER.size
+
+    def write(self, payload: bytes):
+        if len(payload) > self.capacity:
+            raise ValueError(f"Status payload too large ({len(payload)} > {self.capacity} bytes)")
+        buf = self.shm.buf
+        seq = _STATUS_HEADER.unpack_from(buf, 0)[0]
+        struct.pack_into("<Q", buf, 0, seq + 1)
+        buf[_STATUS_HEADER.size:_STATUS_HEADER.size + len(payload)] = payload
+        _STATUS_HEADER.pack_into(buf, 0, seq + 2, len(payload))
+
+    def read(self, max_retries=100):
+        """
+        :return: (sequence, payload bytes), payload is None if nothing was written yet
+        """
+        buf = self.shm.buf
+        for _ in range(max_retries):
+            seq, length = _STATUS_HEADER.unpack_from(buf, 0)
+            if seq & 1:
+                continue
+            payload = bytes(buf[_STATUS_HEADER.size:_STATUS_HEADER.size + length])
+            if _STATUS_HEADER.unpack_from(buf, 0)[0] == seq:
+                return seq, (payload if seq else None)
+        return None, None
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+# Controller methods the server is allowed to invoke in the child
+ALLOWED_METHODS = {"set_mode", "set_move_torque", "get_status",
+                   "set_tracing", "get_latency_metrics", "mark_broadcast",
+                   "run_sequence", "get_sequence_report", "get_motor_params",
+                   "start_profile", "stop_profile", "get_profile_report", "teleop_setpoint",
+                   "get_metrics_text"}
+
+
+def tune_current_process(cpu=None, realtime_priority=None):
+    """
+    Pin the calling process to a CPU and optionally raise it to SCHED_FIFO.
+    Failures (e.g. missing CAP_SYS_NICE) are reported and otherwise ignored.
+    """
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {cpu})
+            print(f"[ControlProcess] Pinned to CPU {cpu}")
+        except OSError as e:
+            print(f"[ControlProcess] Could not pin to CPU {cpu}: {e}")
+    if realtime_priority is not None and hasattr(os, "sched_setscheduler"):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(realtime_priority))
+            print(f"[ControlProcess] Running with SCHED_FIFO priority {realtime_priority}")
+        except (OSError, PermissionError) as e:
+            print(f"[ControlProcess] Could not set real-time priority: {e}")
+
+
+def tune_gc(gc_mode):
+    """
+    - None / "default": leave the collector alone.
+    - "freeze": move everything allocated during start-up into the permanent
+      generation and raise the gen0 threshold, so collections stay short.
+    - "disabled": turn the cyclic collector off (reference counting still frees
+      the short-lived numpy scalars the control loop produces).
+    """
+    if gc_mode in (None, "default"):
+        return
+    gc.collect()
+    if gc_mode == "freeze":
+        gc.freeze()
+        gc.set_threshold(50000, 50, 100)
+    elif gc_mode == "disabled":
+        gc.disable()
+    else:
+        raise ValueError(f"Unknown gc_mode: {gc_mode}")
+
+
+def _child_main(controller_kwargs, options, conn, shm_name):
+    tune_current_process(options.get("cpu"), options.get("realtime_priority"))
+    from gripper_core import GripperController
+
+    status = StatusBuffer(shm_name)
+    controller = GripperController(**controller_kwargs)
+    if not controller.connect():
+        conn.send(("ready", False))
+        status.close()
+        return
+    tune_gc(options.get("gc_mode"))
+    conn.send(("ready", True))
+
+    stop_event = threading.Event()
+    status_period = 1.0 / options.get("status_rate", 50.0)
+
+    def publish_status():
+        while not stop_event.is_set():
+            status.write(json.dumps(controller.get_status()).encode())
+            stop_event.wait(status_period)
+
+    publisher = threading.Thread(target=publish_status, daemon=True)
+    publisher.start()
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg[0] == "shutdown":
+                break
+            req_id, method, args = msg
+            try:
+                if method not in ALLOWED_METHODS:
+                    raise AttributeError(f"Method '{method}' is not exposed by the control process")
+                result = getattr(controller, method)(*args)
+                if req_id is not None:
+                    conn.send((req_id, True, result))
+            except Exception as e:
+                print(f"[ControlProcess] '{method}' failed: {e}")
+                if req_id is not None:
+                    conn.send((req_id, False, repr(e)))
+    finally:
+        stop_event.set()
+        publisher.join(timeout=1)
+        controller.disconnect()
+        status.close()
+
+
+class GripperProcess:
+    """
+    Drop-in replacement for GripperController that runs the real controller in a
+    child process. Construction arguments are forwarded to GripperController.
+    """
+    def __init__(self, port, baud_rate, motor_can_id, motor_master_id, move_torque, cpu=None, gc_mode="freeze",
+                 realtime_priority=None, status_rate=50.0, **controller_kwargs):
+        """
+        :param controller_kwargs: further GripperController options (telemetry_dir, drive_control, ...);
+                                  they must be picklable, the child process rebuilds the controller from them
+        """
+        self.controller_kwargs = dict(controller_kwargs, port=port, baud_rate=baud_rate, motor_can_id=motor_can_id,
+                                      motor_master_id=motor_master_id, move_torque=move_torque)
+        self.options = dict(cpu=cpu, gc_mode=gc_mode, realtime_priority=realtime_priority,
+                            status_rate=status_rate)
+        self.is_connected = False
+        self._process = None
+        self._conn = None
+        self._status = None
+        self._send_lock = threading.Lock()
+        self._req_ids = itertools.count(1)
+        self._pending = {}
+        self._reader = None
+        self._status_seq = None
+        self._status_cache = {"is_connected": False}
+
+    def connect(self, timeout=15.0):
+        if self.is_connected: return True
+        ctx = mp.get_context("spawn")
+        self._status = StatusBuffer()
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_child_main, name="gripper-control",
+                                    args=(self.controller_kwargs, self.options, child_conn, self._status.name),
+                                    daemon=True)
+        self._process.start()
+        child_conn.close()
+        ok = False
+        if self._conn.poll(timeout):
+            try:
+                ok = self._conn.recv() == ("ready", True)
+            except EOFError:
+                ok = False
+        if not ok:
+            print("[ControlProcess] Child failed to connect to the hardware.")
+            self._cleanup()
+            return False
+        self.is_connected = True
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+        print(f"[ControlProcess] Control loop running in child process (pid {self._process.pid}).")
+        return True
+
+    def disconnect(self):
+        if not self.is_connected: return
+        self.is_connected = False
+        try:
+            with self._send_lock:
+                self._conn.send(("shutdown",))
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._cleanup()
+        print("[ControlProcess] Child process stopped.")
+
+    def _cleanup(self):
+        if self._conn is not None:
+            self._conn.close()
+        if self._status is not None:
+            self._status.close(unlink=True)
+            self._status = None
+
+    def _read_replies(self):
+        while True:
+            try:
+                req_id, ok, result = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            waiter = self._pending.pop(req_id, None)
+            if waiter is not None:
+                waiter[1] = (ok, result)
+                waiter[0].set()
+        for event, _ in list(self._pending.values()):
+            event.set()
+
+    def _send(self, method, *args):
+        if not self.is_connected:
+            print(f"[ControlProcess] Dropping '{method}': not connected.")
+            return
+        with self._send_lock:
+            self._conn.send((None, method, args))
+
+    def call(self, method, *args, timeout=1.0):
+        """
+        Invoke a controller method in the child and wait for its return value.
+        """
+        if not self.is_connected:
+            raise RuntimeError("Control process is not running")
+        req_id = next(self._req_ids)
+        waiter = [threading.Event(), None]
+        self._pending[req_id] = waiter
+        with self._send_lock:
+            self._conn.send((req_id, method, args))
+        if not waiter[0].wait(timeout) or waiter[1] is None:
+            self._pending.pop(req_id, None)
+            raise TimeoutError(f"No reply from control process for '{method}'")
+        ok, result = waiter[1]
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    # --- GripperController API ---
+    def set_mode(self, command, value=None, trace=None):
+        self._send("set_mode", command, value, trace)
+
+    def set_move_torque(self, new_torque):
+        self._send("set_move_torque", new_torque)
+
+    def teleop_setpoint(self, seq, t_send, position):
+        self._send("teleop_setpoint", seq, t_send, position)
+
+    def set_tracing(self, enabled):
+        self._send("set_tracing", enabled)
+
+    def get_latency_metrics(self):
+        return self.call("get_latency_metrics")
+
+    def get_metrics_text(self):
+        return self.call("get_metrics_text")
+
+    def mark_broadcast(self, t_snapshot, t_sent):
+        self._send("mark_broadcast", t_snapshot, t_sent)
+
+    def run_sequence(self, spec):
+        return self.call("run_sequence", spec)
+
+    def get_sequence_report(self):
+        return self.call("get_sequence_report")
+
+    def get_motor_params(self):
+        return self.call("get_motor_params")
+
+    def start_profile(self, duration=10.0, interval=0.005, directory="profiles"):
+        return self.call("start_profile", duration, interval, directory)
+
+    def stop_profile(self, top=20):
+        return self.call("stop_profile", top, timeout=3.0)
+
+    def get_profile_report(self, top=20):
+        return self.call("get_profile_report", top)
+
+    def get_status(self):
+        if self._status is not None:
+            seq, payload = self._status.read()
+            if payload is not None and seq != self._status_seq:
+                self._status_seq = seq
+                self._status_cache = json.loads(payload)
+        status = dict(self._status_cache)
+        if self._process is None or not self._process.is_alive():
+            status["is_connected"] = False
+        return status
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Gateway: one WebSocket endpoint in front of many gripper backends.
+
+    python gateway.py --upstream cell1=ws://10.0.0.11:8765 --upstream cell2=ws://10.0.0.12:8765
+    python gateway.py --sim 3          # three local server_ws_manual.py on simulated motors
+
+Downstream protocol (same JSON as server_ws_manual.py, plus a "gripper" tag):
+
+- status / event messages arrive as {"type": "status", "gripper": "cell1", "data": {...}}
+- commands carry the target: {"gripper": "cell1", "command": "grasp"}; replies
+  to request/reply commands (metrics, params, ...) come back tagged the same way
+- {"command": "grippers"} lists the upstream links and their state
+- {"command": "subscribe", "value": {..., "grippers": ["cell1"]}} takes the usual
+  subscription options (see subscriptions.py) plus an optional gripper filter
+
+Every upstream link reconnects on its own with exponential backoff. Each upstream
+status message is rendered and serialized once per downstream subscription group.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import deque
+
+from subscriptions import DEFAULT_SUBSCRIPTION, EVENT_FIELDS, Subscription, SubscriptionGroup
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# Upstream commands answered with exactly one message, in order, on the same connection
+REPLY_COMMANDS = frozenset({"metrics", "run_sequence", "sequence_report", "params", "profile"})
+
+
+class UpstreamLink:
+    def __init__(self, gripper_id, url, gateway, backoff_min=0.5, backoff_max=10.0):
+        self.gripper_id = gripper_id
+        self.url = url
+        self.gateway = gateway
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.ws = None
+        self.connects = 0
+        self.last_status = None
+        self.last_status_time = None
+        self.last_error = None
+        self._waiters = deque()  # downstream websockets waiting for a reply, oldest first
+        self._task = None
+
+    @property
+    def connected(self):
+        return self.ws is not None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        backoff = self.backoff_min
+        while True:
+            try:
+                async with websockets.connect(self.url, max_size=None, open_timeout=5) as ws:
+                    self.ws = ws
+                    self.connects += 1
+                    self.last_error = None
+                    backoff = self.backoff_min
+                    print(f"[Gateway] {self.gripper_id}: connected to {self.url}")
+                    async for message in ws:
+                        self._on_message(json.loads(message))
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException, ValueError) as e:
+                self.last_error = str(e) or type(e).__name__
+            finally:
+                if self.ws is not None:
+                    print(f"[Gateway] {self.gripper_id}: link lost ({self.last_error})")
+                    self.ws = None
+                    self._fail_waiters("upstream disconnected")
+                    self.gateway.dispatch(self.gripper_id, {"is_connected": False})
+            # Jittered exponential backoff, so a restarted cell isn't hit by every gateway at once
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+            backoff = min(backoff * 2, self.backoff_max)
+
+    def _on_message(self, message):
+        kind = message.get("type")
+        if kind == "status":
+            self.last_status = message["data"]
+            self.last_status_time = time.monotonic()
+            self.gateway.dispatch(self.gripper_id, self.last_status)
+        elif self._waiters:
+            waiter = self._waiters.popleft()
+            self.gateway.reply(waiter, dict(message, gripper=self.gripper_id))
+
+    def _fail_waiters(self, error):
+        while self._waiters:
+            self.gateway.reply(self._waiters.popleft(), self.gateway.error(self.gripper_id, error))
+
+    async def send(self, data, downstream):
+        """
+        Forward a command; returns an error message dict if it could not be sent.
+        """
+        ws = self.ws
+        if ws is None:
+            return self.gateway.error(self.gripper_id, "upstream not connected")
+        if data.get("command") in REPLY_COMMANDS:
+            self._waiters.append(downstream)
+        try:
+            await ws.send(json.dumps(data))
+        except websockets.exceptions.ConnectionClosed:
+            return self.gateway.error(self.gripper_id, "upstream disconnected")
+        return None
+
+    def summary(self):
+        return {
+            "url": self.url,
+            "connected": self.connected,
+            "connects": self.connects,
+            "last_error": self.last_error,
+            "status_age": time.monotonic() - self.last_status_time if self.last_status_time is not None else None,
+        }
+
+
+class Gateway:
+    def __init__(self, upstreams, host="0.0.0.0", port=8760):
+        """
+        :param upstreams: {gripper_id: ws url}
+        """
+        self.host = host
+        self.port = port
+        self.links = {gid: UpstreamLink(gid, url, self) for gid, url in upstreams.items()}
+        self.clients = {}  # websocket -> (Subscription, frozenset of gripper ids or None)
+        self.groups = {}  # (Subscription, grippers) -> set of websockets
+        self._renderers = {}  # ((Subscription, grippers), gripper_id) -> SubscriptionGroup
+        self._server = None
+
+    @staticmethod
+    def error(gripper_id, error):
+        return {"type": "error", "gripper": gripper_id, "data": {"error": error}}
+
+    def reply(self, websocket, message):
+        asyncio.ensure_future(self._send(websocket, json.dumps(message)))
+
+    @staticmethod
+    async def _send(websocket, message):
+        try:
+            await websocket.send(message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def dispatch(self, gripper_id, status):
+        """
+        Fan one upstream status out to every downstream group that wants this gripper.
+        """
+        now = time.monotonic()
+        envelope = {"gripper": gripper_id}
+        for key, members in self.groups.items():
+            subscription, grippers = key
+            if grippers is not None and gripper_id not in grippers:
+                continue
+            renderer = self._renderers.get((key, gripper_id))
+            if renderer is None:
+                renderer = self._renderers[(key, gripper_id)] = SubscriptionGroup(subscription, 0.0)
+            for _, message in renderer.render(now, status, envelope=envelope):
+                for websocket in list(members):
+                    asyncio.ensure_future(self._send(websocket, message))
+
+    def _subscribe(self, websocket, subscription, grippers):
+        self._unsubscribe(websocket)
+        key = (subscription, grippers)
+        self.clients[websocket] = key
+        self.groups.setdefault(key, set()).add(websocket)
+
+    def _unsubscribe(self, websocket):
+        key = self.clients.pop(websocket, None)
+        members = self.groups.get(key)
+        if members is not None:
+            members.discard(websocket)
+            if not members:
+                del self.groups[key]
+                for renderer_key in [k for k in self._renderers if k[0] == key]:
+                    del self._renderers[renderer_key]
+
+    async def _handle_subscribe(self, websocket, value):
+        grippers = None
+        try:
+            if isinstance(value, dict) and value.get("grippers") is not None:
+                grippers = frozenset(value["grippers"])
+                unknown = grippers - set(self.links)
+                if unknown:
+                    raise ValueError(f"unknown gripper(s): {', '.join(sorted(unknown))}")
+                value = {k: v for k, v in value.items() if k != "grippers"}
+            subscription = Subscription.from_dict(value) if value else DEFAULT_SUBSCRIPTION
+            if "metrics" in subscription.topics:
+                raise ValueError("the metrics topic is not available through the gateway")
+        except (ValueError, TypeError) as e:
+            return {"type": "error", "data": {"command": "subscribe", "error": str(e)}}
+        self._subscribe(websocket, subscription, grippers)
+        if "events" in subscription.topics:
+            # Group members only see changes, so start the client off with the current state
+            for gid, link in self.links.items():
+                if link.last_status is not None and (grippers is None or gid in grippers):
+                    events = {k: link.last_status.get(k) for k in EVENT_FIELDS}
+                    await websocket.send(json.dumps({"type": "event", "gripper": gid, "data": events}))
+        return {"type": "subscribed",
+                "data": dict(subscription.as_dict(), grippers=sorted(grippers) if grippers is not None else None)}
+
+    async def _handler(self, websocket, *args):
+        self._subscribe(websocket, DEFAULT_SUBSCRIPTION, None)
+        try:
+            # Start every client off with the latest known status of each gripper
+            for gid, link in self.links.items():
+                if link.last_status is not None and link.connected:
+                    await websocket.send(json.dumps({"type": "status", "gripper": gid, "data": link.last_status}))
+            async for message in websocket:
+                data = json.loads(message)
+                command = data.get("command")
+                if command == "subscribe":
+                    reply = await self._handle_subscribe(websocket, data.get("value"))
+                elif command == "grippers":
+                    reply = {"type": "grippers", "data": {gid: link.summary() for gid, link in self.links.items()}}
+                else:
+                    gripper_id = data.pop("gripper", None)
+                    link = self.links.get(gripper_id)
+                    if link is None:
+                        reply = self.error(gripper_id, f"unknown gripper '{gripper_id}'")
+                    else:
+                        reply = await link.send(data, websocket)
+                if reply is not None:
+                    await websocket.send(json.dumps(reply))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self._unsubscribe(websocket)
+
+    async def serve_forever(self):
+        if websockets is None:
+            raise RuntimeError("The gateway requires the 'websockets' package")
+        for link in self.links.values():
+            link.start()
+        self._server = await websockets.serve(self._handler, self.host, self.port)
+        print(f"[Gateway] Listening on ws://{self.host}:{self.port} for {len(self.links)} gripper(s)...")
+        try:
+            await asyncio.Future()
+        finally:
+            self._server.close()
+            await self._server.wait_closed()
+            for link in self.links.values():
+                await link.stop()
+
+
+def start_simulated_backends(count, base_port):
+    """Local stand-ins: server_ws_manual.py on simulated motors, WebSocket only."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    processes, upstreams = [], {}
+    for i in range(count):
+        port = base_port + i
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(here, "server_ws_manual.py"), "--port", "sim://",
+             "--ws-port", str(port), "--http-port", "0"],
+            cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT))
+        upstreams[f"sim{i + 1}"] = f"ws://127.0.0.1:{port}"
+    return processes, upstreams
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Gripper gateway")
+    parser.add_argument("--upstream", action="append", default=[], metavar="ID=URL",
+                        help="gripper backend, e.g. cell1=ws://10.0.0.11:8765 (repeatable)")
+    parser.add_argument("--sim", type=int, default=0, help="start this many local simulated backends")
+    parser.add_argument("--sim-base-port", type=int, default=8800, help="first WebSocket port for --sim backends")
+    parser.add_argument("--port", type=int, default=8760, help="downstream WebSocket port")
+    return parser.parse_args()
+
+
+async def main(args):
+    upstreams = {}
+    for spec in args.upstream:
+        gid, sep, url = spec.partition("=")
+        if not sep:
+            raise SystemExit(f"--upstream expects ID=URL, got '{spec}'")
+        upstreams[gid] = url
+    processes = []
+    if args.sim:
+        processes, sim_upstreams = start_simulated_backends(args.sim, args.sim_base_port)
+        upstreams.update(sim_upstreams)
+    if not upstreams:
+        raise SystemExit("No upstream grippers configured (use --upstream or --sim)")
+    try:
+        await Gateway(upstreams, port=args.port).serve_forever()
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        print("\nGateway stopped.")
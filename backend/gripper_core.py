@@ -0,0 +1,978 @@
+# -*- coding: utf-8 -*-
+"""
+Gripper controller core: the single owner of the serial port and the control loop.
+All servers (WebSocket, HTTP/SSE, the control process) build on this class.
+"""
+import time
+import threading
+import sys
+
+# Assume DM_CAN.py and serial are available in your environment
+try:
+    from DM_CAN import *
+    import serial
+    from clock import SYSTEM_CLOCK
+    from latency_trace import LatencyHistogram, LatencyTracer
+    from metrics import MetricsRegistry
+    from sequence import CommandSequence
+    from sampling_profiler import SamplingProfiler, check_options, profile_path
+    from telemetry_log import TelemetryRecorder
+    from teleop import TeleopChannel
+    from thermal import ThermalGovernor
+except ImportError as e:
+    print(f"Error: Missing required libraries ({e}). Please ensure pyserial is installed and DM_CAN.py exists.")
+    sys.exit(1)
+
+class GripperController:
+    MODE_MAP = {"grasp": "grasping", "release": "releasing", "reciprocate": "reciprocating", "stop": "stopped"}
+    # Columns of the per-tick telemetry log; mode is stored as its index in MODE_CODES
+    TELEMETRY_COLUMNS = ("q", "dq", "tau", "mode", "kp", "q_target", "tau_cmd")
+    MODE_CODES = ("stopped", "manual", "grasping", "releasing", "reciprocating", "teleop")
+    # Modes counted as motion cycles in the metrics; a reciprocating cycle runs from one upper reversal to the next
+    CYCLE_MODES = ("grasping", "releasing", "reciprocating")
+    CYCLE_BUCKETS = (0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+    # Command label values for the metrics; anything else is counted as "other"
+    KNOWN_COMMANDS = frozenset(MODE_MAP) | {"set_position", "set_torque", "set_min", "set_max",
+                                            "confirm_calibration", "abort_sequence", "drive_control", "estimator", "clear_fault",
+                                            "teleop_reset"}
+    # Primitives that run in the drive's own loop when drive_control is on; teleop stays host-side
+    DRIVE_PRIMITIVES = ("manual", "grasping", "releasing", "reciprocating")
+
+    # 【MODIFIED】 Initialize min/max angles to None, add calibration state
+    # Passing both min_angle and max_angle starts the controller pre-calibrated (legacy fixed-range servers)
+    def __init__(self, port, baud_rate, motor_can_id, motor_master_id, move_torque, min_angle=None, max_angle=None,
+                 telemetry_dir=None, drive_control=False, use_estimator=False, stale_action="hold", clock=SYSTEM_CLOCK,
+                 thermal_derate=True, fixed_range=False):
+        self.port = port
+        self.clock = clock  # see clock.py; a VirtualClock runs the loop on the caller's thread via run_for()
+        self.baud_rate = baud_rate
+        self.motor = Motor(DM_Motor_Type.DM4310, motor_can_id, motor_master_id)
+        
+        # --- Calibration & State ---
+        self.min_angle = min_angle
+        self.max_angle = max_angle
+        self.is_calibrated = min_angle is not None and max_angle is not None
+        # Fixed-range servers: the range above is configuration, clients cannot recalibrate it
+        self.fixed_range = fixed_range and self.is_calibrated
+        self.move_torque = move_torque
+        
+        self.serial_device = None
+        self.motor_control = None
+        self.mode = "stopped"
+        self.current_position = 0.0
+        self.current_torque = 0.0
+        self.is_connected = False
+        self.target_position = 0.0
+        self.manual_kp = 5.0
+        self.teleop = TeleopChannel(clock=self.clock)  # binary setpoint stream, see teleop.py
+        self.teleop_kp = 5.0
+        self.kd = 1.0  # MIT damping gain used in every mode
+        self._direction = 1  # reciprocating direction
+        # On-drive motion: position moves in POS_VEL, grasp/release/reciprocate in Torque_Pos (force-position),
+        # both closed by the drive itself; the host only resends setpoints and checks completion.
+        self.drive_control = drive_control
+        self.drive_velocity = 2.0  # rad/s, velocity limit of on-drive moves
+        self.drive_tolerance = 0.01  # rad, a primitive has reached its limit within this distance
+        self.drive_supervise_period = 0.05  # seconds between supervising ticks (capped by the CAN timeout)
+        self.drive_mode_switches = 0
+        self._supervising = False
+        # Host-side limit checks on the estimator's prediction (see MotorBank.estimate) instead of raw feedback
+        self.use_estimator = use_estimator
+        self.actuation_delay = 0.002  # seconds from sending a command to the drive acting on it
+
+        # --- Feedback freshness failsafe ---
+        # Feedback older than this many tick intervals (at least feedback_deadline_min) trips the failsafe
+        self.feedback_deadline_periods = 3
+        self.feedback_deadline_min = 0.005
+        self.feedback_deadline = None  # seconds, the deadline of the last check
+        self.stale_action = stale_action  # "hold" the last known position or "disable" the motor
+        self.fault = None  # latched until clear_fault with fresh feedback; reported in the status
+        self.stale_events = 0
+        self.stale_detection_latency = LatencyHistogram()  # deadline passed -> failsafe engaged
+        self.feedback_rx_rate = 0.0
+        self._rx_sample = (clock.monotonic(), 0)
+        self._last_tick_time = None
+        self._clear_fault_requested = False
+        self.drive_errors = 0  # protections the drive reported in its status nibble (OT, OC, CAN timeout...)
+
+        # --- Thermal derating (see thermal.py) ---
+        self.thermal = ThermalGovernor()
+        self.thermal.enabled = thermal_derate
+        self._thermal_derating = False
+        self._rest_until = None  # reciprocating: zero-torque rest after a cycle while derated
+        self._moving_since = None
+
+        # --- Loop timing ---
+        self.loop_period = 0.02
+        self.loop_ticks = 0
+        self.loop_jitter_mean = 0.0
+        self.loop_jitter_max = 0.0
+        self.nominal_loop_period = self.loop_period
+
+        # --- Bus admission control ---
+        self.bus_high_water = 0.85  # throttle the loop above this estimated utilization
+        self.bus_low_water = 0.6  # and restore it below this one
+        self.bus_alarm = False
+        self.bus_status = None
+        self.status_poll_rate = None  # Hz; background 0xCC refresh for when MIT replies stop (None = off)
+        self.tracer = LatencyTracer(clock=self.clock)
+        self.sequence = None
+        self.profiler = None
+        self.telemetry_dir = telemetry_dir  # per-tick q/dq/tau/command log (see telemetry_log.py), None = off
+        self.telemetry = None
+
+        # --- Idle policy: low-rate keepalive after a quiet period in 'stopped' ---
+        self.idle_after = 5.0  # seconds without commands or motion before idling (None = never)
+        self.idle_keepalive_max = 0.25  # upper bound on the keepalive period, seconds
+        self.idle_keepalive_period = self.idle_keepalive_max
+        self.idle = False
+        self.idle_entries = 0
+        self.idle_entry_latency = LatencyHistogram()  # idle deadline -> keepalive rate
+        self.idle_exit_latency = LatencyHistogram()  # command received -> first full-rate frame sent
+        self._last_activity = clock.monotonic()
+        self._idle_since = None
+        self._wake_time = None
+        self._wake_event = threading.Event()
+
+        self._init_metrics()
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._control_thread = threading.Thread(target=self._control_loop, daemon=True)
+
+    def connect(self):
+        if self.is_connected: return True
+        try:
+            print("Attempting to open serial port...")
+            if self.port.startswith("sim://"):
+                from sim_motor import open_simulated_gripper
+                self.serial_device = open_simulated_gripper(self.motor.SlaveID, self.motor.MasterID, clock=self.clock)
+            else:
+                self.serial_device = serial.Serial(self.port, self.baud_rate, timeout=0.5)
+            print("Successfully opened serial port.")
+            # The writer, poller, prefetch and control threads run on wall-clock time; under a
+            # virtual clock everything stays on the caller's thread and run_for() drives the loop
+            realtime = self.clock.realtime
+            self.motor_control = MotorControl(self.serial_device, async_write=realtime, clock=self.clock)
+            self.motor_control.addMotor(self.motor)
+            self._install_trace_hooks()
+            plan = self.motor_control.check_bus_plan(1.0 / self.nominal_loop_period)
+            if not plan["ok"]:
+                print(f"[Bus] {plan['control_rate']:.0f} Hz x {plan['motor_count']} motor(s) would load the bus to "
+                      f"{plan['peak_utilization']:.0%}, limiting the loop to {plan['max_rate']:.0f} Hz")
+                self.loop_period = self.nominal_loop_period = 1.0 / plan["max_rate"]
+            print("Switching motor to MIT control mode...")
+            if not self.motor_control.switchControlMode(self.motor, Control_Type.MIT):
+                raise RuntimeError("Failed to switch motor to MIT mode")
+            print("Enabling motor...")
+            report = self.motor_control.enable_all()
+            if not report["ok"]:
+                print(f"[Warning] Enable not confirmed by feedback within {report['elapsed'] * 1000:.0f} ms")
+            
+            initial_pos = self.motor.getPosition()
+            self.target_position = initial_pos if initial_pos is not None else 0.0
+            self.current_position = self.target_position
+            
+            print(f"Motor enabled. Initial position: {self.current_position:.2f}")
+            if self.telemetry_dir:
+                self.telemetry = TelemetryRecorder(self.telemetry_dir, self.TELEMETRY_COLUMNS, clock=self.clock)
+            self.is_connected = True
+            self._stop_event.clear()
+            if realtime:
+                self._control_thread.start()
+                print("Control loop thread has started.")
+                if self.status_poll_rate:
+                    self.motor_control.start_status_poller().register(self.motor, self.status_poll_rate)
+                # Warm the cache with the identity and control registers (PARAM_PREFETCH) off the loop thread
+                self.motor_control.prefetch_params(self.motor)
+            return True
+        except Exception as e:
+            print(f"[FATAL ERROR] Connection failed: {e}")
+            self.is_connected = False
+            return False
+
+    def disconnect(self):
+        # ... (disconnect logic remains the same)
+        if not self.is_connected: return
+        print("Disconnecting...")
+        self._stop_event.set()
+        if self._control_thread.is_alive():
+            self._control_thread.join(timeout=2)
+        if self.motor_control and self.motor.isEnable:
+            print("Disabling motor...")
+            self.motor_control.controlMIT(self.motor, 0, 1.0, 0, 0, 0)
+            self.clock.sleep(0.05)
+            report = self.motor_control.disable_all()
+            print(f"Motor disable {'confirmed' if report['ok'] else 'NOT confirmed'} in {report['elapsed'] * 1000:.1f} ms")
+        if self.telemetry is not None:
+            self.telemetry.close()
+        if self.motor_control:
+            self.motor_control.close()  # drain the background writer before the port goes away
+        if self.serial_device and self.serial_device.is_open:
+            self.serial_device.close()
+            print("Serial port closed.")
+        self.is_connected = False
+        print("Safely disconnected.")
+
+    def _control_loop(self):
+        print("Control loop started...")
+        self._run_loop()
+        print("Control loop stopped.")
+
+    def run_for(self, duration):
+        """
+        Run the control loop on the calling thread for `duration` seconds of clock time.
+        With a VirtualClock (no control thread) this returns as soon as the ticks are computed.
+        """
+        if self._control_thread.is_alive():
+            raise RuntimeError("The control loop is already running on its own thread")
+        self._run_loop(until=self.clock.monotonic() + duration)
+
+    def _run_loop(self, until=None):
+        clock = self.clock
+        last_tick = None
+        next_bus_check = clock.monotonic() + 1.0
+        while not self._stop_event.is_set():
+            loop_start_time = clock.monotonic()
+            if until is not None and loop_start_time >= until:
+                break
+            if last_tick is not None and not self.idle and not self._supervising:
+                self._record_jitter(loop_start_time - last_tick)
+            last_tick = loop_start_time
+            if loop_start_time >= next_bus_check:
+                self._check_bus()
+                self._sample_rx_rate(loop_start_time)
+                next_bus_check = loop_start_time + 1.0
+            if self._supervising:
+                self._wake_event.clear()  # a command from here on cuts the supervision wait short
+            if not self._control_tick(loop_start_time):
+                clock.sleep(0.02)
+                continue
+            self._sleep_until_next_tick(loop_start_time)
+
+    def _control_tick(self, loop_start_time):
+        """
+        One pass of the mode state machine: read feedback, apply sequence/teleop input, send the command.
+        :return: False if there is no motor feedback yet
+        """
+        pos = self.motor.getPosition()
+        tor = self.motor.getTorque()
+        if pos is None or tor is None:
+            return False
+        interval = loop_start_time - self._last_tick_time if self._last_tick_time is not None else None
+        self._last_tick_time = loop_start_time
+        self._check_feedback(loop_start_time, interval)
+        self._check_drive_error(loop_start_time)
+        thermal_scale = self._update_thermal(loop_start_time)
+
+        with self._lock:
+            self.current_position = pos
+            self.current_torque = tor
+            current_mode = self.mode
+            current_target_pos = self.target_position
+            current_move_torque = self.move_torque
+            is_calibrated = self.is_calibrated
+        self.tracer.pick_up()
+
+        # Timed sequence steps due at this tick override the snapshot above
+        sequence = self.sequence
+        if sequence is not None and sequence.active:
+            if sequence.state == "pending":
+                sequence.start(loop_start_time)
+            for step, _ in sequence.due(loop_start_time):
+                self._apply_step(step)
+            with self._lock:
+                current_mode = self.mode
+                current_target_pos = self.target_position
+                current_move_torque = self.move_torque
+
+        # Newest teleop setpoint wins; a stream that goes silent falls back to holding position
+        setpoint = self.teleop.take() if self.fault is None else None
+        if setpoint is not None:
+            self.abort_sequence("preempted by teleop")
+            self._set_target(setpoint, mode="teleop")
+        elif current_mode == "teleop" and self.teleop.expired(loop_start_time):
+            print("[Teleop] Dead-man timeout, holding position")
+            self._set_target(pos)
+        if setpoint is not None or current_mode == "teleop":
+            with self._lock:
+                current_mode = self.mode
+                current_target_pos = self.target_position
+
+        if current_mode != "stopped" or (sequence is not None and sequence.active):
+            self._last_activity = loop_start_time
+        self._update_idle(loop_start_time)
+
+        # 【MODIFIED】 If not calibrated, only 'manual', 'teleop' and 'stopped' modes are allowed
+        if not is_calibrated and current_mode not in ["manual", "teleop", "stopped"]:
+            print(f"Warning: Action '{current_mode}' denied. System not calibrated.")
+            self.abort_sequence("not calibrated")
+            self._denied_metric.labels(current_mode).inc()
+            self._switch_mode("stopped") # Force stop
+            current_mode = "stopped"
+        self._track_cycle(current_mode, loop_start_time)
+        current_move_torque *= thermal_scale
+        # Position the limit checks act on: where the joint will be when the next command takes effect
+        check_pos = pos
+        if self.use_estimator:
+            predicted = self.motor.predict(loop_start_time + self.loop_period + self.actuation_delay)
+            if predicted is not None:
+                check_pos = predicted[0]
+
+        if self.drive_control and current_mode in self.DRIVE_PRIMITIVES:
+            self._supervising = True
+            if self._drive_tick(current_mode, current_target_pos, current_move_torque, pos, tor, loop_start_time):
+                return True
+            print("[Drive] Control mode switch not confirmed, falling back to host control")
+            self.drive_control = False
+        self._supervising = False
+        self._use_control_mode(Control_Type.MIT)
+
+        tau_cmd = 0.0
+        if current_mode == "manual" or current_mode == "teleop":
+            kp = self.manual_kp if current_mode == "manual" else self.teleop_kp
+            self.motor_control.controlMIT(self.motor, kp=kp, kd=self.kd, q=current_target_pos, dq=0.0, tau=0.0)
+            if self.telemetry is not None:
+                self.telemetry.record(loop_start_time, (pos, self.motor.getVelocity(), tor,
+                                                        self.MODE_CODES.index(current_mode), kp,
+                                                        current_target_pos, 0.0))
+            return True
+
+        # These modes only run if calibrated
+        if current_mode == "grasping":
+            tau_cmd = -current_move_torque
+            if check_pos <= self.min_angle:
+                self._finish_cycle(loop_start_time)
+                self._switch_mode("stopped")
+        elif current_mode == "releasing":
+            tau_cmd = current_move_torque
+            if check_pos >= self.max_angle:
+                self._finish_cycle(loop_start_time)
+                self._switch_mode("stopped")
+        elif current_mode == "reciprocating":
+            if check_pos >= self.max_angle:
+                if self._direction == 1:
+                    self._reverse_cycle(loop_start_time)
+                self._direction = -1
+            elif check_pos <= self.min_angle: self._direction = 1
+            tau_cmd = self._direction * current_move_torque if not self._resting(loop_start_time) else 0.0
+        
+        self.motor_control.controlMIT(self.motor, kp=0.0, kd=self.kd, q=0.0, dq=0.0, tau=tau_cmd)
+        if self.telemetry is not None:
+            self.telemetry.record(loop_start_time, (pos, self.motor.getVelocity(), tor,
+                                                    self.MODE_CODES.index(current_mode), 0.0, 0.0, tau_cmd))
+        return True
+
+    def _use_control_mode(self, mode):
+        """
+        Switch the drive's control mode if it is not in `mode` already (one parameter round trip).
+        :return: False if the drive did not confirm the switch
+        """
+        if self.motor.NowControlMode == mode:
+            return True
+        if not self.motor_control.switchControlMode(self.motor, mode):
+            print(f"[Drive] Switch to {Control_Type(mode).name} not confirmed")
+            return False
+        self.drive_mode_switches += 1
+        return True
+
+    def _drive_tick(self, mode, target, move_torque, pos, tor, loop_start_time):
+        """
+        Supervising tick for an on-drive primitive: (re)send its setpoint, which also
+        keeps the CAN timeout fed, and end grasp/release once the limit is reached.
+        :return: False if the drive refused the control mode
+        """
+        tau_limit = 0.0
+        if mode == "manual":
+            if not self._use_control_mode(Control_Type.POS_VEL):
+                return False
+            goal = target
+            self.motor_control.control_Pos_Vel(self.motor, goal, self.drive_velocity)
+        else:
+            if not self._use_control_mode(Control_Type.Torque_Pos):
+                return False
+            tolerance = self.drive_tolerance
+            if mode == "grasping":
+                goal = self.min_angle
+                if pos <= goal + tolerance:
+                    self._finish_cycle(loop_start_time)
+                    self._switch_mode("stopped")
+            elif mode == "releasing":
+                goal = self.max_angle
+                if pos >= goal - tolerance:
+                    self._finish_cycle(loop_start_time)
+                    self._switch_mode("stopped")
+            else:
+                if pos >= self.max_angle - tolerance:
+                    if self._direction == 1:
+                        self._reverse_cycle(loop_start_time)
+                    self._direction = -1
+                elif pos <= self.min_angle + tolerance: self._direction = 1
+                # While resting the drive holds the upper limit
+                resting = self._resting(loop_start_time)
+                goal = self.max_angle if self._direction == 1 or resting else self.min_angle
+            # Current limit as a fraction of the drive's peak (x10000), torque taken as proportional to current
+            tau_limit = move_torque
+            tau_max = self.motor_control.Limit_Param[self.motor.MotorType][2]
+            i_des = max(0.0, min(1.0, tau_limit / tau_max)) * 10000
+            self.motor_control.control_pos_force(self.motor, goal, self.drive_velocity * 100, i_des)
+        if self.telemetry is not None:
+            self.telemetry.record(loop_start_time, (pos, self.motor.getVelocity(), tor,
+                                                    self.MODE_CODES.index(mode), 0.0, goal, tau_limit))
+        return True
+
+    def _sleep_until_next_tick(self, loop_start_time):
+        if self.idle:
+            # Keepalive rate; set_mode() wakes the loop as soon as a command arrives
+            self.clock.wait(self._wake_event, max(0, loop_start_time + self.idle_keepalive_period - self.clock.monotonic()))
+            return
+        if self._supervising:
+            # The drive closes the loop; wake up early for commands and sequence steps
+            wake_time = loop_start_time + min(self.drive_supervise_period, self._keepalive_period())
+            sequence = self.sequence
+            next_step = sequence.next_time() if sequence is not None else None
+            if next_step is not None and next_step < wake_time:
+                wake_time = next_step
+            self.clock.wait(self._wake_event, max(0, wake_time - self.clock.monotonic()))
+            return
+        if self._wake_time is not None:
+            # First full-rate frame after idling has just been sent
+            self.idle_exit_latency.record(self.clock.monotonic() - self._wake_time)
+            self._wake_time = None
+        # Wake up early if a sequence step is due before the regular tick
+        deadline = wake_time = loop_start_time + self.loop_period
+        sequence = self.sequence
+        if sequence is not None:
+            next_step = sequence.next_time()
+            if next_step is not None and next_step < wake_time:
+                wake_time = next_step
+        now = self.clock.monotonic()
+        if now > deadline:
+            self._overrun_metric.inc()
+        self.clock.sleep(wake_time - now)
+
+    def _update_idle(self, now):
+        if self.idle:
+            if self._last_activity > self._idle_since:
+                self.idle = False
+                if self._wake_time is None:
+                    self._wake_time = now
+                print(f"[Idle] Resuming full rate after {now - self._idle_since:.1f} s idle")
+        elif self.idle_after is not None and now - self._last_activity >= self.idle_after:
+            self.idle_keepalive_period = self._keepalive_period()
+            self._wake_event.clear()
+            self.idle = True
+            self._idle_since = now
+            self.idle_entries += 1
+            self.idle_entry_latency.record(now - (self._last_activity + self.idle_after))
+            print(f"[Idle] No activity for {now - self._last_activity:.1f} s, "
+                  f"keepalive every {self.idle_keepalive_period * 1000:.0f} ms")
+
+    def _keepalive_period(self):
+        # Stay well inside the drive's CAN timeout (register units of 50 us, 0 = disabled)
+        timeout = self.motor.temp_param_dict.get(DM_variable.TIMEOUT)
+        if timeout:
+            return min(self.idle_keepalive_max, max(self.nominal_loop_period, timeout * 50e-6 * 0.5))
+        return self.idle_keepalive_max
+
+    def _note_activity(self):
+        now = self.clock.monotonic()
+        self._last_activity = now
+        if self.idle:
+            if self._wake_time is None:
+                self._wake_time = now
+            self._wake_event.set()
+        elif self._supervising:
+            self._wake_event.set()
+
+    # --- Feedback freshness ---
+    def _check_feedback(self, now, interval):
+        """
+        Runs at the start of every tick, before the feedback is acted on. The deadline
+        scales with the actual tick interval, so idle keepalive and on-drive supervision
+        ticks don't trip it.
+        """
+        stamp = self.motor.last_recv_time
+        if stamp <= 0 or interval is None:
+            return
+        age = now - float(stamp)
+        deadline = self.feedback_deadline = max(self.feedback_deadline_min, self.feedback_deadline_periods * interval)
+        if self.fault is None or self.fault["type"] != "feedback_lost":
+            if age > deadline:
+                self._enter_failsafe(now, age, deadline)
+            return
+        # While faulted the loop itself may block (disable_all), so only a reply to the previous tick counts as fresh
+        fresh = stamp >= now - interval
+        if self.fault["action"] == "disable" and fresh and self.motor.isEnable:
+            # The disable sent while the link was down never arrived
+            self.motor_control.disable_all(timeout=0.05)
+        if self._clear_fault_requested:
+            self._clear_fault_requested = False
+            if fresh:
+                print(f"[Failsafe] Fault cleared after {now - self.fault['monotonic']:.1f} s")
+                if self.fault["action"] == "disable":
+                    report = self.motor_control.enable_all(timeout=0.2)
+                    print(f"[Failsafe] Motor re-enable {'confirmed' if report['ok'] else 'NOT confirmed'}")
+                self.fault = None
+            else:
+                print(f"[Failsafe] Feedback still {age * 1000:.0f} ms old, fault kept")
+
+    def _enter_failsafe(self, now, age, deadline):
+        latency = age - deadline
+        self.stale_events += 1
+        self.stale_detection_latency.record(latency)
+        self.fault = {
+            "type": "feedback_lost",
+            "action": self.stale_action,
+            "age_ms": age * 1000.0,
+            "deadline_ms": deadline * 1000.0,
+            "detection_latency_ms": latency * 1000.0,
+            "time": self.clock.time(),
+            "monotonic": now,
+        }
+        print(f"[Failsafe] No feedback for {age * 1000:.1f} ms (deadline {deadline * 1000:.1f} ms), "
+              f"{'disabling the motor' if self.stale_action == 'disable' else 'holding position'}")
+        self.abort_sequence("feedback lost")
+        if self.stale_action == "disable":
+            self._switch_mode("stopped")
+            self.motor_control.disable_all(timeout=0.05)
+        else:
+            self._set_target(self.motor.getPosition())
+
+    # --- Drive protections and thermal derating ---
+    def _check_drive_error(self, now):
+        """
+        The drive disables itself on over-temperature, over-current, bus voltage or CAN timeout
+        and reports it in the feedback status nibble; latch it as a fault so the motion stops too.
+        clear_fault re-enables the drive once it has cooled below the derating limit.
+        """
+        if self.fault is None:
+            if self.motor.isFault():
+                error = self.motor.getStatusName()
+                self.drive_errors += 1
+                self.fault = {
+                    "type": "drive_error",
+                    "action": "disable",
+                    "error": error,
+                    "temperatures": self.motor.getTemperatures(),
+                    "time": self.clock.time(),
+                    "monotonic": now,
+                }
+                print(f"[Drive] Motor reports {error}, stopping")
+                self.abort_sequence(f"drive error {error}")
+                self._switch_mode("stopped")
+            return
+        if self.fault["type"] != "drive_error" or not self._clear_fault_requested:
+            return
+        self._clear_fault_requested = False
+        temperatures = self.motor.getTemperatures()
+        if temperatures is not None and max(temperatures) >= self.thermal.limit:
+            print(f"[Drive] Motor still at {max(temperatures):.0f} C, fault kept until below {self.thermal.limit:.0f} C")
+            return
+        report = self.motor_control.enable_all(timeout=0.2)
+        if report["ok"]:
+            print(f"[Drive] {self.fault['error']} cleared after {now - self.fault['monotonic']:.1f} s, motor re-enabled")
+            self.fault = None
+        else:
+            print(f"[Drive] Re-enable not confirmed, {self.fault['error']} fault kept")
+
+    def _update_thermal(self, now):
+        thermal = self.thermal
+        scale = thermal.update(now, self.motor.getTemperatures(), self.motor.temp_param_dict.get(DM_variable.OT_Value))
+        derating = scale < 1.0
+        if derating != self._thermal_derating:
+            self._thermal_derating = derating
+            if derating:
+                print(f"[Thermal] Projected {thermal.projected:.0f} C against a {thermal.limit:.0f} C limit, "
+                      f"derating torque and duty to {scale:.0%}")
+            else:
+                print(f"[Thermal] Back to full torque after {thermal.derated_time:.0f} s derated in total")
+        return scale
+
+    def _sample_rx_rate(self, now):
+        t0, count0 = self._rx_sample
+        count = self.motor.getRxCount()
+        if now > t0:
+            self.feedback_rx_rate = (count - count0) / (now - t0)
+        self._rx_sample = (now, count)
+
+    def _check_bus(self):
+        # Throttle the loop when the bus nears saturation, restore it once the load drops
+        sample = self.motor_control.bus.sample()
+        peak = sample["peak_utilization"]
+        if peak > self.bus_high_water:
+            if not self.bus_alarm:
+                print(f"[Bus] Warning: estimated bus utilization {peak:.0%}, throttling the control loop")
+            self.bus_alarm = True
+            self.loop_period = min(self.loop_period * 1.25, self.nominal_loop_period * 4)
+        elif peak < self.bus_low_water:
+            if self.bus_alarm:
+                print(f"[Bus] Utilization back to {peak:.0%}")
+            self.bus_alarm = False
+            self.loop_period = max(self.nominal_loop_period, self.loop_period / 1.25)
+        self.bus_status = dict(sample, alarm=self.bus_alarm, loop_rate=1.0 / self.loop_period)
+
+    def _record_jitter(self, period):
+        # Deviation of the measured tick-to-tick period from the nominal one
+        jitter = abs(period - self.loop_period)
+        self.loop_ticks += 1
+        self.loop_jitter_mean += (jitter - self.loop_jitter_mean) / min(self.loop_ticks, 1000)
+        if jitter > self.loop_jitter_max:
+            self.loop_jitter_max = jitter
+
+    # --- Metrics (text exposition at GET /metrics) ---
+    def _init_metrics(self):
+        self.metrics = m = MetricsRegistry()
+        cycles = m.counter("gripper_cycles_total", "Completed motion cycles", ("mode",))
+        interrupted = m.counter("gripper_cycles_interrupted_total", "Motion cycles cut short by a mode change",
+                                ("mode",))
+        cycle_time = m.histogram("gripper_cycle_seconds", "Duration of completed motion cycles", ("mode",),
+                                 self.CYCLE_BUCKETS)
+        # Children resolved once, so the control thread only increments attributes
+        self._cycle_metrics = {mode: (cycles.labels(mode), interrupted.labels(mode), cycle_time.labels(mode))
+                               for mode in self.CYCLE_MODES}
+        self._cycle_mode = "stopped"
+        self._cycle_start = None
+        self._denied_metric = m.counter("gripper_actions_denied_total",
+                                        "Motion modes refused because the gripper is not calibrated", ("mode",))
+        self._overrun_metric = m.counter("gripper_loop_overruns_total", "Control ticks that ran past their period")
+        self._command_metric = m.counter("gripper_commands_total", "Commands received by the controller", ("command",))
+        m.callback("gripper_loop_ticks_total", "Full-rate control ticks", lambda: self.loop_ticks, "counter")
+        m.callback("gripper_loop_period_seconds", "Current control loop period", lambda: self.loop_period)
+        m.callback("gripper_loop_jitter_max_seconds", "Largest deviation from the loop period",
+                   lambda: self.loop_jitter_max)
+        m.callback("gripper_idle_entries_total", "Times the loop dropped to the keepalive rate",
+                   lambda: self.idle_entries, "counter")
+        bus = lambda: self.motor_control.bus if self.motor_control is not None else None
+        m.callback("gripper_serial_frames_total", "USB-CAN frames sent (tx) and received (rx)",
+                   lambda: [(("tx",), bus().tx_frames), (("rx",), bus().rx_frames)] if bus() else [],
+                   "counter", ("direction",))
+        m.callback("gripper_serial_rx_bytes_total", "Bytes received from the USB-CAN adapter",
+                   lambda: bus().rx_bytes if bus() else None, "counter")
+        m.callback("gripper_serial_parse_errors_total", "Received bytes discarded as unparseable",
+                   lambda: bus().rx_discarded if bus() else None, "counter")
+        m.callback("gripper_teleop_frames_total", "Teleop frames by outcome",
+                   lambda: [(("accepted",), self.teleop.accepted), (("rejected",),
+                            self.teleop.rejected_order + self.teleop.rejected_stale)],
+                   "counter", ("outcome",))
+        m.callback("gripper_feedback_stale_total", "Times the feedback failsafe tripped",
+                   lambda: self.stale_events, "counter")
+        m.callback("gripper_feedback_age_seconds", "Age of the latest motor feedback", self.motor.getDataAge)
+        m.callback("gripper_feedback_rx_rate_hz", "Feedback frames received per second", lambda: self.feedback_rx_rate)
+        m.callback("gripper_fault", "1 while a fault is latched", lambda: self.fault is not None)
+        m.callback("gripper_drive_errors_total", "Protections reported by the drive", lambda: self.drive_errors,
+                   "counter")
+        m.callback("gripper_motor_temperature_celsius", "Drive-reported temperatures",
+                   lambda: list(zip(((s,) for s in ThermalGovernor.SENSORS), self.motor.getTemperatures() or ())),
+                   "gauge", ("sensor",))
+        m.callback("gripper_thermal_scale", "Thermal derating factor of torque and duty (1 = none)",
+                   lambda: self.thermal.scale)
+        m.callback("gripper_connected", "1 while the motor is connected", lambda: self.is_connected)
+        m.callback("gripper_calibrated", "1 once the motion range is calibrated", lambda: self.is_calibrated)
+
+    def _track_cycle(self, mode, now):
+        if mode == self._cycle_mode:
+            return
+        if self._cycle_start is not None:
+            self._cycle_metrics[self._cycle_mode][1].inc()
+        self._cycle_mode = mode
+        # reciprocating cycles start at the first upper reversal
+        self._cycle_start = now if mode in ("grasping", "releasing") else None
+        self._rest_until = None
+        self._moving_since = now
+
+    def _reverse_cycle(self, now):
+        """Upper reversal while reciprocating: close the cycle and schedule the thermal rest."""
+        self._finish_cycle(now)
+        self._cycle_start = now
+        active = now - self._moving_since if self._moving_since is not None else None
+        rest = self.thermal.rest_after(active)
+        self._rest_until = now + rest if rest > 0 else None
+        self._moving_since = now + rest
+
+    def _resting(self, now):
+        if self._rest_until is None:
+            return False
+        if now < self._rest_until:
+            return True
+        self._rest_until = None
+        return False
+
+    def _finish_cycle(self, now):
+        if self._cycle_start is not None:
+            completed, _, duration = self._cycle_metrics[self._cycle_mode]
+            completed.inc()
+            duration.observe(now - self._cycle_start)
+            self._cycle_start = None
+
+    def get_metrics_text(self):
+        return self.metrics.render()
+
+    # --- Latency tracing ---
+    def _install_trace_hooks(self):
+        if self.motor_control is None: return
+        self.motor_control.on_send = self.tracer.on_send if self.tracer.enabled else None
+        self.motor_control.on_feedback = self.tracer.on_feedback if self.tracer.enabled else None
+
+    def set_tracing(self, enabled):
+        self.tracer.enabled = bool(enabled)
+        if self.tracer.enabled:
+            self.tracer.reset()
+        self._install_trace_hooks()
+        print(f"[Trace] Command latency tracing {'enabled' if self.tracer.enabled else 'disabled'}")
+
+    def get_latency_metrics(self):
+        metrics = self.tracer.metrics()
+        metrics["idle"] = {
+            "entries": self.idle_entries,
+            "entry_latency": self.idle_entry_latency.summary(),
+            "exit_latency": self.idle_exit_latency.summary(),
+        }
+        metrics["failsafe"] = {
+            "stale_events": self.stale_events,
+            "detection_latency": self.stale_detection_latency.summary(),
+            "drive_errors": self.drive_errors,
+        }
+        if self.motor_control is not None and self.motor_control.writer is not None:
+            metrics["serial_writer"] = self.motor_control.writer.stats()
+        if self.telemetry is not None:
+            metrics["telemetry"] = self.telemetry.stats()
+        return metrics
+
+    def mark_broadcast(self, t_snapshot, t_sent):
+        self.tracer.on_broadcast(t_snapshot, t_sent)
+
+    def get_motor_params(self):
+        """
+        Cached motor registers with age, source and class; never touches the bus.
+        """
+        return {RID.name: self.motor.getParamInfo(RID) for RID in DM_variable if RID in self.motor.temp_param_dict}
+
+    # --- Sampling profiler ---
+    def start_profile(self, duration=10.0, interval=0.005, directory="profiles"):
+        """
+        Sample the control loop (and serial writer) stacks for `duration` seconds.
+        The collapsed stacks are written to `directory` when sampling ends.
+        """
+        if self.profiler is not None and self.profiler.running:
+            return self.profiler.summary(0)
+        try:
+            duration, interval = check_options(duration, interval)
+        except (TypeError, ValueError) as e:
+            return {"error": str(e)}
+        if not self._control_thread.is_alive():
+            return {"error": "the control loop is not running on its own thread"}
+        targets = {"control": self._control_thread.ident}
+        if self.motor_control is not None and self.motor_control.writer is not None:
+            targets["serial_writer"] = self.motor_control.writer._thread.ident
+        self.profiler = SamplingProfiler({k: v for k, v in targets.items() if v is not None}, interval,
+                                         output=profile_path(directory, "control"))
+        self.profiler.start(duration)
+        print(f"[Profile] Sampling {', '.join(self.profiler.targets)} for {duration:.0f} s")
+        return self.profiler.summary(0)
+
+    def stop_profile(self, top=20):
+        if self.profiler is None:
+            return None
+        self.profiler.stop()
+        return self.profiler.summary(top)
+
+    def get_profile_report(self, top=20):
+        return self.profiler.summary(top) if self.profiler is not None else None
+
+    # --- Timed command sequences ---
+    def run_sequence(self, spec):
+        """
+        Upload a timed command sequence (see sequence.py) and start it on the next control tick.
+        :return: sequence summary, or {"error": ...} if the sequence was rejected
+        """
+        try:
+            sequence = CommandSequence.from_dict(spec)
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"[Sequence] Rejected: {e}")
+            return {"error": str(e)}
+        if self.fault is not None:
+            return {"error": f"{self.fault['type']} fault active, send clear_fault first"}
+        if not self.is_calibrated and any(s.command in self.MODE_MAP and s.command != "stop" for s in sequence.steps):
+            return {"error": "sequence uses torque modes but the system is not calibrated"}
+        self.abort_sequence("replaced by a new sequence")
+        self.sequence = sequence
+        self._note_activity()
+        print(f"[Sequence] Started '{sequence.name}' with {len(sequence.steps)} steps")
+        return sequence.summary()
+
+    def abort_sequence(self, reason="aborted by client"):
+        sequence = self.sequence
+        if sequence is not None and sequence.active:
+            sequence.abort(reason)
+            print(f"[Sequence] Aborted '{sequence.name}': {reason}")
+
+    def get_sequence_report(self):
+        return self.sequence.report() if self.sequence is not None else None
+
+    def _apply_step(self, step):
+        if step.command == "set_position":
+            self._set_target(step.value)
+        elif step.command == "set_torque":
+            with self._lock:
+                self.move_torque = max(0.1, min(2.0, step.value))
+        else:
+            self._switch_mode(self.MODE_MAP[step.command])
+
+    def _switch_mode(self, new_mode):
+        with self._lock: self.mode = new_mode
+
+    def _set_target(self, value, mode="manual"):
+        with self._lock:
+            self.mode = mode
+            # If calibrated, clamp to limits. If not, don't clamp.
+            min_lim = self.min_angle if self.is_calibrated else -100
+            max_lim = self.max_angle if self.is_calibrated else 100
+            self.target_position = max(min_lim, min(max_lim, value))
+
+    def teleop_setpoint(self, seq, t_send, position):
+        """
+        Offer one decoded teleop frame; applied by the control loop on its next tick.
+        """
+        if self.teleop.offer(seq, t_send, position):
+            self._note_activity()
+
+    def set_move_torque(self, new_torque):
+        with self._lock:
+            self.move_torque = max(0.1, min(2.0, new_torque))
+        print(f"[WebSocket] Drive torque has been set to: {self.move_torque:.2f} Nm")
+
+    # 【MODIFIED】 set_mode now handles calibration commands
+    def set_mode(self, command, value=None, trace=None):
+        """
+        :param trace: optional (trace_id, ws_receive_time) tuple, used when latency tracing is enabled
+        """
+        self._note_activity()
+        self._command_metric.labels(command if command in self.KNOWN_COMMANDS else "other").inc()
+        if command == "clear_fault":
+            if self.fault is not None:
+                self._clear_fault_requested = True  # checked against fresh feedback by the control loop
+            return
+        if self.fault is not None and command != "stop" and (command == "set_position" or command in self.MODE_MAP):
+            print(f"[Failsafe] '{command}' rejected while the {self.fault['type']} fault is active (send clear_fault)")
+            return
+        # --- Calibration Commands ---
+        if self.fixed_range and command in ("set_min", "set_max", "confirm_calibration"):
+            print(f"[Calibration] '{command}' rejected: the range is fixed at {self.min_angle:.2f} to {self.max_angle:.2f}")
+            return
+        if command == "set_min":
+            with self._lock:
+                self.min_angle = self.current_position
+            print(f"[Calibration] Minimum angle set to: {self.min_angle:.2f}")
+            return
+        if command == "set_max":
+            with self._lock:
+                self.max_angle = self.current_position
+            print(f"[Calibration] Maximum angle set to: {self.max_angle:.2f}")
+            return
+        if command == "confirm_calibration":
+            with self._lock:
+                if self.min_angle is not None and self.max_angle is not None:
+                    # Ensure min_angle is always less than max_angle
+                    if self.min_angle > self.max_angle:
+                        self.min_angle, self.max_angle = self.max_angle, self.min_angle
+                    self.is_calibrated = True
+                    self.mode = "stopped"
+                    print(f"Calibration confirmed! Range: {self.min_angle:.2f} to {self.max_angle:.2f}")
+                else:
+                    print("Calibration confirmation failed: Min or Max angle not set.")
+            return
+
+        # --- Operational Commands ---
+        if command == "abort_sequence":
+            self.abort_sequence()
+            return
+        if command == "teleop_reset":
+            self.teleop.reset()
+            print("[Teleop] Stream state reset, the next frame starts a new sequence")
+            return
+        if command == "estimator":
+            self.use_estimator = bool(value)
+            print(f"[Estimator] Predicted-state limit checks {'enabled' if self.use_estimator else 'disabled'}")
+            return
+        if command == "drive_control":
+            self.drive_control = bool(value)
+            print(f"[Drive] On-drive motion control {'enabled' if self.drive_control else 'disabled'}")
+            return
+        # A motion command from a client takes over from a running sequence
+        if command == "set_position" or command in self.MODE_MAP:
+            self.abort_sequence(f"preempted by '{command}'")
+        if command == "set_torque" and value is not None:
+            self.set_move_torque(float(value))
+            if trace is not None: self.tracer.queue(command, *trace)
+            return
+        if command == "set_position" and value is not None:
+            self._set_target(value)
+            if trace is not None: self.tracer.queue(command, *trace)
+            print(f"[WebSocket] Received command: 'set_position', target: {self.target_position:.2f}")
+            return
+
+        new_mode = self.MODE_MAP.get(command)
+        if new_mode:
+            print(f"[WebSocket] Received command: '{command}', setting mode to: '{new_mode}'")
+            self._switch_mode(new_mode)
+            if trace is not None: self.tracer.queue(command, *trace)
+        else:
+            print(f"[WebSocket] Received unknown command: '{command}'")
+
+    def _feedback_age_ms(self):
+        age = self.motor.getDataAge()
+        return age * 1000.0 if age is not None else None
+
+    def _estimate_status(self):
+        q, dq = self.motor.getEstimate()
+        return {"enabled": self.use_estimator, "position": q, "velocity": dq}
+
+    def get_status(self):
+        with self._lock:
+            status = {
+                "is_connected": self.is_connected,
+                "mode": self.mode,
+                "position": float(self.current_position),
+                "torque": float(self.current_torque),
+                "data_age": self.motor.getDataAge(),
+                "min_angle": float(self.min_angle) if self.min_angle is not None else None,
+                "max_angle": float(self.max_angle) if self.max_angle is not None else None,
+                "target_position": float(self.target_position),
+                "move_torque": float(self.move_torque),
+                "is_calibrated": self.is_calibrated, # 【NEW】 Broadcast calibration state
+                "fixed_range": self.fixed_range,
+                "loop": {
+                    "period_ms": self.loop_period * 1000.0,
+                    "jitter_mean_ms": self.loop_jitter_mean * 1000.0,
+                    "jitter_max_ms": self.loop_jitter_max * 1000.0,
+                },
+                "bus": self.bus_status,
+                "idle": {
+                    "active": self.idle,
+                    "keepalive_period_ms": self.idle_keepalive_period * 1000.0,
+                },
+                "sequence": self.sequence.summary() if self.sequence is not None else None,
+                "teleop": self.teleop.summary(),
+                "estimate": self._estimate_status(),
+                "fault": {k: v for k, v in self.fault.items() if k != "monotonic"} if self.fault else None,
+                "feedback": {
+                    "age_ms": self._feedback_age_ms(),
+                    "deadline_ms": self.feedback_deadline * 1000.0 if self.feedback_deadline is not None else None,
+                    "rx_rate_hz": self.feedback_rx_rate,
+                    "stale_events": self.stale_events,
+                },
+                "motor_status": self.motor.getStatusName(),
+                "thermal": self.thermal.summary(),
+                "drive_control": {
+                    "enabled": self.drive_control,
+                    "control_mode": Control_Type(self.motor.NowControlMode).name,
+                    "mode_switches": self.drive_mode_switches,
+                },
+                "trace": {
+                    "enabled": self.tracer.enabled,
+                    "awaiting_broadcast": self.tracer.awaiting_broadcast(),
+                    "snapshot": self.clock.monotonic(),
+                },
+            }
+        return status
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Per-command latency tracing from WebSocket receive to motor feedback.
+
+A traced command is stamped with the controller clock's monotonic() at each stage:
+
+    ws_receive -> queued -> tick -> serial_write -> feedback -> broadcast
+
+and the time between consecutive stages (plus the end-to-end total) is kept in
+log-spaced histograms. CLOCK_MONOTONIC is system-wide, so stamps taken in the
+server process and in the control process can be compared directly (both run
+on SYSTEM_CLOCK; a VirtualClock is only used in-process).
+"""
+import itertools
+import math
+import threading
+from collections import deque
+
+from clock import SYSTEM_CLOCK
+
+STAGES = ("ws_receive", "queued", "tick", "serial_write", "feedback", "broadcast")
+
+
+class LatencyHistogram:
+    """
+    Fixed-size histogram with log-spaced buckets, 10 us .. 10 s by default.
+    Recording is O(1) and allocation free.
+    """
+    def __init__(self, min_s=1e-5, max_s=10.0, buckets_per_decade=20):
+        self.min_s = min_s
+        self.buckets_per_decade = buckets_per_decade
+        self.n_buckets = int(math.ceil(math.log10(max_s / min_s) * buckets_per_decade)) + 2
+        self.counts = [0] * self.n_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _bucket(self, value):
+        if value <= self.min_s:
+            return 0
+        idx = int(math.log10(value / self.min_s) * self.buckets_per_decade) + 1
+        return min(idx, self.n_buckets - 1)
+
+    def _upper_bound(self, idx):
+        return self.min_s * 10 ** (idx / self.buckets_per_decade)
+
+    def record(self, value):
+        self.counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min: self.min = value
+        if value > self.max: self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        target = p / 100.0 * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self._upper_bound(idx), self.max)
+        return self.max
+
+    def summary(self):
+        """
+        :return: dict of count / mean / min / max / p50 / p90 / p99, times in ms
+        """
+        if not self.count:
+            return {"count": 0}
+        ms = lambda v: v * 1000.0
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count),
+            "min_ms": ms(self.min),
+            "max_ms": ms(self.max),
+            "p50_ms": ms(self.percentile(50)),
+            "p90_ms": ms(self.percentile(90)),
+            "p99_ms": ms(self.percentile(99)),
+        }
+
+
+class CommandTrace:
+    __slots__ = ("trace_id", "command", "stamps")
+
+    def __init__(self, trace_id, command, t_receive):
+        self.trace_id = trace_id
+        self.command = command
+        self.stamps = {"ws_receive": t_receive}
+
+    def as_dict(self):
+        t0 = self.stamps["ws_receive"]
+        return {
+            "trace_id": self.trace_id,
+            "command": self.command,
+            "stages_ms": {stage: (self.stamps[stage] - t0) * 1000.0 for stage in STAGES if stage in self.stamps},
+        }
+
+
+class LatencyTracer:
+    """
+    Tracks at most one command per pipeline slot:
+    - pending: queued by set_mode, not yet seen by the control loop
+    - in_flight: picked up by a control tick, waiting for serial write / feedback
+    - awaiting_broadcast: feedback decoded, waiting for a status broadcast
+    A command queued while another one is still pending supersedes it.
+    :param clock: the controller's clock, for the stage stamps
+    """
+    def __init__(self, enabled=False, history=50, clock=SYSTEM_CLOCK):
+        self.enabled = enabled
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = None
+        self._in_flight = None
+        self._awaiting_broadcast = []
+        self.superseded = 0
+        self.recent = deque(maxlen=history)
+        self.histograms = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._pending = None
+            self._in_flight = None
+            self._awaiting_broadcast = []
+            self.superseded = 0
+            self.recent.clear()
+            self.histograms = {f"{a}->{b}": LatencyHistogram() for a, b in zip(STAGES, STAGES[1:])}
+            self.histograms["total"] = LatencyHistogram()
+
+    def queue(self, command, trace_id=None, t_receive=None):
+        """
+        Start a trace for a command accepted by the controller.
+        """
+        if not self.enabled:
+            return
+        now = self.clock.monotonic()
+        trace = CommandTrace(trace_id if trace_id is not None else next(self._ids), command,
+                             t_receive if t_receive is not None else now)
+        trace.stamps["queued"] = now
+        with self._lock:
+            if self._pending is not None:
+                self.superseded += 1
+            self._pending = trace
+
+    def pick_up(self):
+        """
+        Called at the start of every control tick.
+        """
+        if self._pending is None:
+            return
+        with self._lock:
+            trace, self._pending = self._pending, None
+            if trace is None:
+                return
+            trace.stamps["tick"] = self.clock.monotonic()
+            if self._in_flight is not None:
+                self.superseded += 1
+            self._in_flight = trace
+
+    def on_send(self, motor_id=None):
+        trace = self._in_flight
+        if trace is not None and "serial_write" not in trace.stamps:
+            trace.stamps["serial_write"] = self.clock.monotonic()
+
+    def on_feedback(self, motor=None):
+        trace = self._in_flight
+        if trace is None or "serial_write" not in trace.stamps:
+            return
+        with self._lock:
+            if self._in_flight is trace:
+                trace.stamps["feedback"] = self.clock.monotonic()
+                self._awaiting_broadcast.append(trace)
+                self._in_flight = None
+
+    def awaiting_broadcast(self):
+        return len(self._awaiting_broadcast)
+
+    def on_broadcast(self, t_snapshot, t_sent):
+        """
+        Complete every trace whose feedback was decoded before the status
+        snapshot that has just been sent.
+        """
+        with self._lock:
+            done = [t for t in self._awaiting_broadcast if t.stamps["feedback"] <= t_snapshot]
+            if not done:
+                return
+            self._awaiting_broadcast = [t for t in self._awaiting_broadcast if t.stamps["feedback"] > t_snapshot]
+            for trace in done:
+                trace.stamps["broadcast"] = t_sent
+                self._complete(trace)
+
+    def _complete(self, trace):
+        stamps = trace.stamps
+        for a, b in zip(STAGES, STAGES[1:]):
+            if a in stamps and b in stamps:
+                self.histograms[f"{a}->{b}"].record(stamps[b] - stamps[a])
+        self.histograms["total"].record(stamps["broadcast"] - stamps["ws_receive"])
+        self.recent.append(trace.as_dict())
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "superseded": self.superseded,
+                "stages": {name: h.summary() for name, h in self.histograms.items()},
+                "recent": list(self.recent)[-10:],
+            }
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Gain sweep: run the GripperController state machine against the simulated motor
+(sim_motor.py) in virtual time, for every combination of move_torque, manual_kp,
+kd and loop rate, spread across a process pool.
+
+Each configuration runs two scenarios under a clock.VirtualClock, so the control
+loop and the simulated motor step in lockstep without real-time sleeping:
+
+- reciprocate between the calibrated limits for --duration simulated seconds:
+  cycles per minute, overshoot past the limits, peak motor torque and the number
+  and speed of hard-stop impacts
+- a manual set_position step across 60 % of the range, from 20 % to 80 %: settle
+  time (within --settle-band of the target) and overshoot
+
+Configurations over --max-peak-torque / --max-impact-speed / --max-overshoot are
+infeasible. The rest are reduced to the Pareto front over (cycles/min up,
+overshoot down, peak torque down, settle time down) and printed as a table.
+
+Example:
+    python param_sweep.py --move-torque 0.3:2.0:0.1 --kd 0.2,0.5,1,2 --manual-kp 2,5,10,20 \\
+        --loop-rate 50,100,200 --max-impact-speed 1.0 --csv sweep.csv
+"""
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from clock import VirtualClock
+from gripper_core import GripperController
+
+SLAVE_ID = 0x01
+MASTER_ID = 0x11
+# Calibrated range inside the simulated hard stops (q_min=-3.9, q_max=-2.9)
+MIN_ANGLE = -3.78
+MAX_ANGLE = -3.05
+STEP_LEAD_IN = 1.5  # virtual seconds to settle at the step's start position
+
+
+def build_controller(config, clock):
+    """
+    A calibrated controller connected to a simulated motor under `clock`, driven with run_for().
+    """
+    controller = GripperController("sim://", 921600, SLAVE_ID, MASTER_ID, config["move_torque"],
+                                   MIN_ANGLE, MAX_ANGLE, clock=clock)
+    controller.manual_kp = config["manual_kp"]
+    controller.kd = config["kd"]
+    controller.loop_period = controller.nominal_loop_period = 1.0 / config["loop_rate"]
+    controller.idle_after = None
+    if not controller.connect():
+        raise RuntimeError("Simulated motor did not come up")
+    sim = controller.serial_device
+    return controller, sim, sim.motors[SLAVE_ID]
+
+
+def run_ticks(controller, sim, clock, duration, on_tick=None):
+    """
+    Run the control loop for `duration` virtual seconds; the simulated motor follows in
+    lockstep and on_tick(t) sees its state after every sleep of the loop.
+    """
+    if on_tick is not None:
+        def sample(t):
+            sim.advance(t)
+            on_tick(t)
+        clock.add_listener(sample)
+    controller.run_for(duration)
+
+
+def reset_peaks(sim_motor):
+    sim_motor.peak_tau = 0.0
+    sim_motor.impacts = []
+
+
+def reciprocate_scenario(config, duration):
+    clock = VirtualClock()
+    controller, sim, sim_motor = build_controller(config, clock)
+    reset_peaks(sim_motor)
+    controller.set_mode("reciprocate")
+    q_lo, q_hi = sim_motor.q, sim_motor.q
+    turns = []  # virtual time of every reversal at the upper limit
+    last_direction = controller._direction
+
+    def on_tick(t):
+        nonlocal q_lo, q_hi, last_direction
+        q_lo, q_hi = min(q_lo, sim_motor.q), max(q_hi, sim_motor.q)
+        if last_direction == 1 and controller._direction == -1:
+            turns.append(t)
+        last_direction = controller._direction
+
+    run_ticks(controller, sim, clock, duration, on_tick)
+    if len(turns) >= 2:
+        cycle_time = (turns[-1] - turns[0]) / (len(turns) - 1)
+    else:
+        cycle_time = None
+    return {
+        "cycle_time": cycle_time,
+        "cycles_per_min": 60.0 / cycle_time if cycle_time else 0.0,
+        "overshoot": max(0.0, q_hi - MAX_ANGLE, MIN_ANGLE - q_lo),
+        "peak_torque": sim_motor.peak_tau,
+        "impacts": len(sim_motor.impacts),
+        "max_impact_speed": max((speed for _, speed in sim_motor.impacts), default=0.0),
+        "rotor_temp": sim_motor.temp_rotor,
+    }
+
+
+def step_scenario(config, duration, settle_band):
+    clock = VirtualClock()
+    controller, sim, sim_motor = build_controller(config, clock)
+    start = MIN_ANGLE + 0.2 * (MAX_ANGLE - MIN_ANGLE)
+    target = MIN_ANGLE + 0.8 * (MAX_ANGLE - MIN_ANGLE)
+    controller.set_mode("set_position", start)
+    controller.run_for(STEP_LEAD_IN)
+    reset_peaks(sim_motor)
+    controller.set_mode("set_position", target)
+    t0 = clock.t
+    peak = sim_motor.q
+    last_outside = t0
+
+    def on_tick(t):
+        nonlocal peak, last_outside
+        peak = max(peak, sim_motor.q)
+        if abs(sim_motor.q - target) > settle_band:
+            last_outside = t
+
+    run_ticks(controller, sim, clock, duration, on_tick)
+    settled = abs(sim_motor.q - target) <= settle_band
+    return {
+        "settle_time": last_outside - t0 if settled else None,
+        "step_overshoot": max(0.0, peak - target),
+        "step_peak_torque": sim_motor.peak_tau,
+    }
+
+
+def evaluate(config, duration=6.0, step_duration=2.0, settle_band=0.01):
+    """Worker entry point: both scenarios for one configuration."""
+    with contextlib.redirect_stdout(io.StringIO()):  # the controller logs every mode change
+        result = dict(config)
+        result.update(reciprocate_scenario(config, duration))
+        result.update(step_scenario(config, step_duration, settle_band))
+    result["peak_torque"] = max(result["peak_torque"], result.pop("step_peak_torque"))
+    result["overshoot"] = max(result["overshoot"], result["step_overshoot"])
+    return result
+
+
+def objectives(result):
+    """Minimization vector for the Pareto front."""
+    settle = result["settle_time"] if result["settle_time"] is not None else float("inf")
+    return (-result["cycles_per_min"], result["overshoot"], result["peak_torque"], settle)
+
+
+def pareto_front(results):
+    points = [(objectives(r), r) for r in results]
+    front = []
+    for i, (a, r) in enumerate(points):
+        dominated = any(all(x <= y for x, y in zip(b, a)) and b != a for j, (b, _) in enumerate(points) if j != i)
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: -r["cycles_per_min"])
+
+
+def feasible(result, args):
+    return (result["peak_torque"] <= args.max_peak_torque
+            and result["max_impact_speed"] <= args.max_impact_speed
+            and result["overshoot"] <= args.max_overshoot
+            and result["settle_time"] is not None
+            and result["cycle_time"] is not None)
+
+
+def parse_values(spec):
+    """"0.5,1,2" or a "start:stop:step" range (stop inclusive)."""
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        count = int(round((stop - start) / step)) + 1
+        return [round(start + i * step, 6) for i in range(count)]
+    return [float(x) for x in spec.split(",")]
+
+
+def print_table(results):
+    fmt = "{:>7} {:>6} {:>5} {:>6} {:>8} {:>8} {:>9} {:>8} {:>7} {:>8} {:>9}"
+    print(fmt.format("torque", "kp", "kd", "rate", "cyc/min", "cycle ms", "overshoot", "peak Nm",
+                     "impacts", "imp rad/s", "settle ms"))
+    for r in results:
+        settle = f"{r['settle_time'] * 1000:.0f}" if r["settle_time"] is not None else "-"
+        cycle = f"{r['cycle_time'] * 1000:.0f}" if r["cycle_time"] is not None else "-"
+        print(fmt.format(f"{r['move_torque']:.2f}", f"{r['manual_kp']:g}", f"{r['kd']:g}", f"{r['loop_rate']:g}",
+                         f"{r['cycles_per_min']:.1f}", cycle, f"{r['overshoot']:.4f}", f"{r['peak_torque']:.2f}",
+                         r["impacts"], f"{r['max_impact_speed']:.2f}", settle))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulated gain sweep for the gripper control loop")
+    parser.add_argument("--move-torque", default="0.2:2.0:0.2", help="values or start:stop:step, Nm")
+    parser.add_argument("--manual-kp", default="2,5,10,20", help="manual-mode MIT kp values")
+    parser.add_argument("--kd", default="0.2,0.5,1,2", help="MIT kd values")
+    parser.add_argument("--loop-rate", default="50,100,200", help="control loop rates, Hz")
+    parser.add_argument("--duration", type=float, default=6.0, help="simulated reciprocate time per config, s")
+    parser.add_argument("--step-duration", type=float, default=2.0, help="simulated step response time, s")
+    parser.add_argument("--settle-band", type=float, default=0.01, help="step settle tolerance, rad")
+    parser.add_argument("--max-peak-torque", type=float, default=3.0, help="feasibility limit, Nm")
+    parser.add_argument("--max-impact-speed", type=float, default=1.0, help="feasibility limit at the hard stops, rad/s")
+    parser.add_argument("--max-overshoot", type=float, default=0.1, help="feasibility limit past the calibrated range, rad")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    parser.add_argument("--csv", default=None, help="write every result to this CSV file")
+    parser.add_argument("--json", default=None, help="write every result to this JSON file")
+    return parser.parse_args()
+
+
+def main(args):
+    grid = [
+        {"move_torque": t, "manual_kp": kp, "kd": kd, "loop_rate": rate}
+        for t, kp, kd, rate in itertools.product(parse_values(args.move_torque), parse_values(args.manual_kp),
+                                                 parse_values(args.kd), parse_values(args.loop_rate))
+    ]
+    workers = args.workers or os.cpu_count() or 1
+    print(f"Sweeping {len(grid)} configurations on {workers} worker(s)...")
+    t0 = time.monotonic()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(evaluate, config, args.duration, args.step_duration, args.settle_band)
+                   for config in grid]
+        for i, future in enumerate(futures, 1):
+            results.append(future.result())
+            if i % max(1, len(grid) // 10) == 0:
+                print(f"  {i}/{len(grid)} done ({time.monotonic() - t0:.1f} s)")
+    elapsed = time.monotonic() - t0
+    ok = [r for r in results if feasible(r, args)]
+    front = pareto_front(ok)
+    print(f"\n{len(results)} configurations in {elapsed:.1f} s, {len(ok)} within limits, "
+          f"{len(front)} on the Pareto front:\n")
+    print_table(front)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()) + ["feasible", "pareto"])
+            writer.writeheader()
+            ok_ids, front_ids = {id(r) for r in ok}, {id(r) for r in front}
+            for r in results:
+                writer.writerow(dict(r, feasible=id(r) in ok_ids, pareto=id(r) in front_ids))
+        print(f"Results written to {args.csv}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "pareto": front}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Low-overhead sampling profiler for selected threads, started and stopped at runtime.
+
+A daemon thread wakes every `interval` seconds, grabs the current frame of each
+target thread from sys._current_frames() and counts the collapsed stack
+("outer;...;inner"). Nothing is installed in the profiled threads, so the cost
+is one stack walk per target per sample, paid by the sampler thread.
+The sampler needs the GIL, so a busy thread is sampled at its next GIL release
+or switch interval; blocking calls (select, lock waits, serial I/O) show up as
+the leaf frame of the Python function that made them.
+
+Results are written in the collapsed-stack format read by flamegraph.pl,
+speedscope and inferno:
+
+    <thread>;<frame>;<frame>;...;<frame> <count>
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+MIN_INTERVAL = 0.001  # shorter waits turn the sampler into a GIL-holding busy loop
+MAX_DURATION = 600.0
+
+
+def check_options(duration, interval):
+    """
+    Validate client-supplied sampling options.
+    :return: (duration, interval) as floats
+    :raises ValueError: if either is out of range
+    """
+    duration, interval = float(duration), float(interval)
+    if not MIN_INTERVAL <= interval <= 1.0:
+        raise ValueError(f"interval must be between {MIN_INTERVAL} and 1 s")
+    if not 0 < duration <= MAX_DURATION:
+        raise ValueError(f"duration must be between 0 and {MAX_DURATION:.0f} s")
+    return duration, interval
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, targets, interval=0.005, output=None, max_depth=64):
+        """
+        :param targets: {name: thread ident} of the threads to sample
+        :param interval: sampling period in seconds
+        :param output: collapsed-stack file written when sampling ends (None = don't write)
+        """
+        self.targets = dict(targets)
+        self.output = output
+        self.interval = max(MIN_INTERVAL, interval)
+        self.max_depth = max_depth
+        self.stacks = {name: Counter() for name in self.targets}
+        self.samples = 0
+        self.started = None
+        self.stopped = None
+        self.overhead = 0.0  # seconds spent walking stacks
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._labels = {}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=None):
+        """
+        Start sampling; stops by itself after `duration` seconds if given.
+        """
+        if self.running:
+            return
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, args=(duration,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _run(self, duration):
+        deadline = self.started + duration if duration else None
+        me = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            t0 = time.perf_counter()
+            frames = sys._current_frames()
+            for name, ident in self.targets.items():
+                frame = frames.get(ident)
+                if frame is None or ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[name][";".join(stack)] += 1
+            del frames
+            self.samples += 1
+            self.overhead += time.perf_counter() - t0
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        self.stopped = time.monotonic()
+        if self.output:
+            self.write_collapsed(self.output)
+
+    def write_collapsed(self, path):
+        """
+        Write every target's stacks to one collapsed-stack file, rooted at the thread name.
+        """
+        with open(path, "w") as f:
+            for name, stacks in self.stacks.items():
+                for stack, count in stacks.most_common():
+                    f.write(f"{name};{stack} {count}\n")
+        return path
+
+    def top(self, name, n=20):
+        """
+        :return: the n functions with the most samples on top of the stack (self)
+                 and anywhere on it (total), as [label, samples, percent]
+        """
+        stacks = self.stacks[name]
+        total_samples = sum(stacks.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in list(stacks.items()):
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+        pct = lambda c: round(100.0 * c / total_samples, 1) if total_samples else 0.0
+        return {
+            "samples": total_samples,
+            "self": [[label, c, pct(c)] for label, c in own.most_common(n)],
+            "total": [[label, c, pct(c)] for label, c in inclusive.most_common(n)],
+        }
+
+    def summary(self, n=20):
+        end = self.stopped if self.stopped is not None else time.monotonic()
+        return {
+            "running": self.running,
+            "duration_s": (end - self.started) if self.started is not None else 0.0,
+            "interval_ms": self.interval * 1000.0,
+            "samples": self.samples,
+            "overhead_ms": self.overhead * 1000.0,
+            "output": self.output,
+            "threads": {name: self.top(name, n) for name in self.targets},
+        }
+
+
+def profile_path(directory, tag):
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{tag}.folded")
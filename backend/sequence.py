@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Timed command sequences executed by the control loop against its own monotonic clock.
+
+A sequence is uploaded as:
+
+    {
+        "name": "pick",                      # optional
+        "steps": [
+            {"t": 0.0, "command": "set_position", "value": 0.4},
+            {"t": 0.5, "command": "set_position", "value": 1.2}
+        ],
+        "loop": false,                       # true = forever, or a number of iterations
+        "period": 1.0                        # iteration length when looping (default: last step time)
+    }
+
+Step times are seconds from the start of the iteration. The control loop fires a
+step on the first tick at or after its scheduled time and records the timing error.
+"""
+import math
+
+SEQUENCE_COMMANDS = {"set_position", "set_torque", "grasp", "release", "reciprocate", "stop"}
+
+
+class SequenceStep:
+    __slots__ = ("t", "command", "value", "fired", "last_error", "max_error")
+
+    def __init__(self, t, command, value=None):
+        self.t = t
+        self.command = command
+        self.value = value
+        self.fired = 0
+        self.last_error = None
+        self.max_error = 0.0
+
+    def as_dict(self):
+        return {
+            "t": self.t,
+            "command": self.command,
+            "value": self.value,
+            "fired": self.fired,
+            "last_error_ms": self.last_error * 1000.0 if self.last_error is not None else None,
+            "max_error_ms": self.max_error * 1000.0,
+        }
+
+
+class CommandSequence:
+    def __init__(self, steps, loop=False, period=None, name=None):
+        """
+        :param steps: list of SequenceStep sorted by time
+        :param loop: False (run once), True (forever) or number of iterations
+        :param period: iteration length in seconds, defaults to the last step time
+        """
+        self.steps = steps
+        self.name = name
+        if loop is True:
+            self.iterations = math.inf
+        elif loop is False or loop is None:
+            self.iterations = 1
+        else:
+            self.iterations = int(loop)
+        self.period = period if period is not None else steps[-1].t
+        self.state = "pending"  # pending / running / completed / aborted
+        self.abort_reason = None
+        self.iteration = 0
+        self.index = 0
+        self.t0 = None
+
+    @classmethod
+    def from_dict(cls, spec):
+        """
+        Validate an uploaded sequence description.
+        :raises ValueError: if the description is malformed
+        """
+        if not isinstance(spec, dict):
+            raise ValueError("sequence must be an object with a 'steps' list")
+        raw_steps = spec.get("steps")
+        if not raw_steps:
+            raise ValueError("sequence has no steps")
+        steps = []
+        last_t = 0.0
+        for i, raw in enumerate(raw_steps):
+            command = raw.get("command")
+            if command not in SEQUENCE_COMMANDS:
+                raise ValueError(f"step {i}: unsupported command '{command}'")
+            t = float(raw.get("t", last_t))
+            if not math.isfinite(t):
+                raise ValueError(f"step {i}: time must be a finite number of seconds")
+            if t < last_t:
+                raise ValueError(f"step {i}: time {t} is before the previous step ({last_t})")
+            value = raw.get("value")
+            if command in ("set_position", "set_torque"):
+                if value is None:
+                    raise ValueError(f"step {i}: '{command}' needs a value")
+                value = float(value)
+                if not math.isfinite(value):
+                    raise ValueError(f"step {i}: '{command}' value must be finite")
+            steps.append(SequenceStep(t, command, value))
+            last_t = t
+        loop = spec.get("loop", False)
+        if not (loop is None or isinstance(loop, bool) or (isinstance(loop, int) and loop >= 1)):
+            raise ValueError("loop must be true, false or a number of iterations >= 1")
+        period = spec.get("period")
+        period = float(period) if period is not None else None
+        if period is not None and not math.isfinite(period):
+            raise ValueError("period must be a finite number of seconds")
+        if period is not None and period < last_t:
+            raise ValueError(f"period {period} is shorter than the last step time {last_t}")
+        if loop not in (False, None, 1) and (period if period is not None else last_t) <= 0:
+            raise ValueError("a looping sequence needs a positive period")
+        return cls(steps, loop=loop, period=period, name=spec.get("name"))
+
+    @property
+    def active(self):
+        return self.state in ("pending", "running")
+
+    def start(self, t0):
+        self.t0 = t0
+        self.state = "running"
+
+    def next_time(self):
+        """Scheduled time of the next step, or None when finished."""
+        if self.state != "running":
+            return None
+        return self.t0 + self.iteration * self.period + self.steps[self.index].t
+
+    def due(self, now):
+        """
+        Pop every step whose scheduled time is <= now.
+        :return: list of (step, scheduled_time)
+        """
+        fired = []
+        while self.state == "running":
+            scheduled = self.next_time()
+            if scheduled > now:
+                break
+            step = self.steps[self.index]
+            error = now - scheduled
+            step.fired += 1
+            step.last_error = error
+            if error > step.max_error:
+                step.max_error = error
+            fired.append((step, scheduled))
+            self.index += 1
+            if self.index == len(self.steps):
+                self.index = 0
+                self.iteration += 1
+                if self.iteration >= self.iterations:
+                    self.state = "completed"
+        return fired
+
+    def abort(self, reason):
+        if self.active:
+            self.state = "aborted"
+            self.abort_reason = reason
+
+    def summary(self):
+        fired = [s for s in self.steps if s.fired]
+        return {
+            "name": self.name,
+            "state": self.state,
+            "abort_reason": self.abort_reason,
+            "iteration": self.iteration,
+            "iterations": None if self.iterations == math.inf else self.iterations,
+            "step": self.index,
+            "steps": len(self.steps),
+            "max_error_ms": max((s.max_error for s in fired), default=0.0) * 1000.0,
+        }
+
+    def report(self):
+        report = self.summary()
+        report["step_timing"] = [s.as_dict() for s in self.steps]
+        return report
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Unified gripper server: one controller (one serial owner, one control loop) shared
+by any number of pluggable asyncio transports (WebSocket, HTTP/SSE, ...).
+
+The status pump takes one status snapshot per tick, renders and serializes it once
+per distinct client subscription (see subscriptions.py) and hands the encoded
+message to every transport serving that subscription.
+"""
+import asyncio
+import threading
+import time
+
+from metrics import MetricsRegistry
+from sampling_profiler import SamplingProfiler, check_options, profile_path
+from subscriptions import DEFAULT_SUBSCRIPTION, MAX_RATE, SubscriptionGroup
+from teleop import decode_frame
+
+
+class Transport:
+    """
+    Base class for client-facing transports.
+    """
+    name = "transport"
+
+    async def start(self, server):
+        """Start accepting clients. `server` is the GripperServer dispatching commands."""
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+    def client_count(self):
+        """Number of clients currently interested in status updates."""
+        return 0
+
+    def subscriptions(self):
+        """Distinct subscriptions of the connected clients."""
+        return {DEFAULT_SUBSCRIPTION} if self.client_count() else set()
+
+    async def publish(self, message, subscription=DEFAULT_SUBSCRIPTION, kind="status"):
+        """
+        Deliver an already-encoded message (str) to every client with `subscription`.
+        :param kind: message type ("status", "event", "metrics")
+        """
+        pass
+
+
+class GripperServer:
+    # Request/reply commands counted by name; motion commands are counted by the controller
+    REQUEST_COMMANDS = ("metrics", "run_sequence", "sequence_report", "params", "profile", "trace")
+
+    def __init__(self, controller, transports, status_rate=10.0, profile_dir="profiles"):
+        self.controller = controller
+        self.transports = list(transports)
+        self.status_period = 1.0 / status_rate
+        self.profile_dir = profile_dir
+        self.profiler = None
+        self.bad_teleop_frames = 0
+        self.metrics = m = MetricsRegistry()
+        m.callback("gripper_clients", "Connected clients per transport",
+                   lambda: [((t.name,), t.client_count()) for t in self.transports], labelnames=("transport",))
+        self._message_metric = m.counter("gripper_messages_sent_total", "Messages published to clients, per type",
+                                         ("kind",))
+        self._request_metric = m.counter("gripper_requests_total", "Commands handled by the server", ("command",))
+        m.callback("gripper_teleop_bad_frames_total", "Binary messages that were not teleop frames",
+                   lambda: self.bad_teleop_frames, "counter")
+
+    def client_count(self):
+        return sum(t.client_count() for t in self.transports)
+
+    def get_status(self):
+        return self.controller.get_status()
+
+    async def handle_command(self, data, t_receive=None):
+        """
+        Dispatch one decoded command message ({"command": ..., "value": ...}).
+        :return: reply message dict for request/response commands, otherwise None
+        """
+        command = data.get("command")
+        value = data.get("value")
+        if command in self.REQUEST_COMMANDS:
+            self._request_metric.labels(command).inc()
+        if command == "metrics":
+            metrics = await asyncio.get_running_loop().run_in_executor(None, self.controller.get_latency_metrics)
+            return {"type": "metrics", "data": metrics}
+        if command == "run_sequence":
+            result = await asyncio.get_running_loop().run_in_executor(None, self.controller.run_sequence, value)
+            return {"type": "sequence", "data": result}
+        if command == "sequence_report":
+            report = await asyncio.get_running_loop().run_in_executor(None, self.controller.get_sequence_report)
+            return {"type": "sequence", "data": report}
+        if command == "params":
+            params = await asyncio.get_running_loop().run_in_executor(None, self.controller.get_motor_params)
+            return {"type": "params", "data": params}
+        if command == "profile":
+            return {"type": "profile", "data": await self.profile(value or {})}
+        if command == "trace":
+            self.controller.set_tracing(bool(value))
+            return None
+        if command:
+            self.controller.set_mode(command, value, trace=(data.get("trace_id"), t_receive))
+        return None
+
+    async def metrics_text(self):
+        """
+        Server and controller metrics in the Prometheus text format.
+        """
+        controller = await asyncio.get_running_loop().run_in_executor(None, self.controller.get_metrics_text)
+        return self.metrics.render() + controller
+
+    def handle_teleop(self, data):
+        """
+        Forward one binary teleop frame (see teleop.py) to the controller. No reply, no logging.
+        """
+        frame = decode_frame(data)
+        if frame is None:
+            self.bad_teleop_frames += 1
+            return
+        self.controller.teleop_setpoint(*frame)
+
+    async def profile(self, options):
+        """
+        Admin command: {"action": "start" | "stop" | "report", "duration": s, "interval": s, "top": n}.
+        The event loop thread is sampled here, the control loop by the controller
+        (in whichever process it runs), each into its own collapsed-stack file.
+        """
+        if isinstance(options, str):
+            options = {"action": options}
+        action = options.get("action", "report")
+        try:
+            top = int(options.get("top", 20))
+            if action == "start":
+                duration, interval = check_options(options.get("duration", 10.0), options.get("interval", 0.005))
+        except (TypeError, ValueError) as e:
+            return {"error": str(e)}
+        run = asyncio.get_running_loop().run_in_executor
+        if action == "start":
+            if self.profiler is None or not self.profiler.running:
+                self.profiler = SamplingProfiler({"event_loop": threading.get_ident()}, interval,
+                                                 output=profile_path(self.profile_dir, "server"))
+                self.profiler.start(duration)
+            controller = await run(None, self.controller.start_profile, duration, interval, self.profile_dir)
+            return {"event_loop": self.profiler.summary(0), "controller": controller}
+        if action == "stop":
+            if self.profiler is not None:
+                await run(None, self.profiler.stop)
+            controller = await run(None, self.controller.stop_profile, top)
+        else:
+            controller = await run(None, self.controller.get_profile_report, top)
+        return {"event_loop": self.profiler.summary(top) if self.profiler is not None else None,
+                "controller": controller}
+
+    async def status_pump(self):
+        groups = {}
+        next_tick = time.monotonic()
+        while True:
+            now = time.monotonic()
+            served = {t: t.subscriptions() for t in self.transports}
+            active = set().union(*served.values())
+            for subscription in list(groups):
+                if subscription not in active:
+                    del groups[subscription]
+            for subscription in active:
+                if subscription not in groups:
+                    groups[subscription] = SubscriptionGroup(subscription, self.status_period)
+
+            status_data = None
+            if any(g.wants_status(now) for g in groups.values()):
+                status_data = self.controller.get_status()
+            metrics = None
+            metrics_groups = [g for g in groups.values() if g.metrics_due(now)]
+            if metrics_groups:
+                metrics = await asyncio.get_running_loop().run_in_executor(None, self.controller.get_latency_metrics)
+
+            sends = []
+            sent_status = False
+            for subscription, group in groups.items():
+                messages = group.render(now, status_data, metrics if group in metrics_groups else None)
+                for kind, message in messages:
+                    sent_status |= kind == "status"
+                    self._message_metric.labels(kind).inc()
+                    sends.extend(t.publish(message, subscription, kind)
+                                 for t, subscriptions in served.items() if subscription in subscriptions)
+            if sends:
+                await asyncio.gather(*sends)
+            if sent_status:
+                trace = status_data.get("trace")
+                if trace and trace["awaiting_broadcast"]:
+                    self.controller.mark_broadcast(trace["snapshot"], time.monotonic())
+
+            # Tick at the fastest rate anyone asked for, never above MAX_RATE
+            period = min([self.status_period] + [g.period for g in groups.values()])
+            next_tick = max(next_tick + max(period, 1.0 / MAX_RATE), time.monotonic())
+            await asyncio.sleep(next_tick - time.monotonic())
+
+    async def serve_forever(self):
+        """
+        Start all transports and run the status pump until cancelled.
+        The controller must already be connected.
+        """
+        for transport in self.transports:
+            await transport.start(self)
+        try:
+            await self.status_pump()
+        finally:
+            for transport in self.transports:
+                await transport.stop()
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated DM motor behind a simulated USB-CAN adapter, for running the servers,
+load tests and tuning sweeps without hardware.
+
+SimulatedSerial is a drop-in for serial.Serial as used by MotorControl (write,
+read_all, is_open, open, close). It decodes the 30-byte USB frames, drives one
+SimulatedMotor per CAN ID and answers with 16-byte feedback / parameter frames,
+exactly like the real adapter. GripperController opens it for port "sim://".
+
+Physics are integrated lazily up to clock() on every write/read, so the model
+follows whatever clock it is given.
+"""
+import math
+import struct
+import threading
+import time
+from collections import deque
+
+from DM_CAN import Control_Type, DM_Motor_Type, DM_variable, MotorControl, float_to_uint, is_in_ranges
+
+SIM_PORT = "sim://"
+
+# Status nibble of feedback data[0]
+STATUS_DISABLED = 0x0
+STATUS_ENABLED = 0x1
+STATUS_MOS_OVER_TEMP = 0xB
+STATUS_ROTOR_OVER_TEMP = 0xC
+STATUS_COMM_LOSS = 0xD
+
+
+class SimulatedMotor:
+    """
+    Rigid joint with viscous + Coulomb friction and two stiff end stops, driven by
+    the drive's MIT / position-velocity / velocity / force-position control laws.
+    """
+    def __init__(self, slave_id, master_id, motor_type=DM_Motor_Type.DM4310, q=-3.4,
+                 inertia=0.002, damping=0.05, friction=0.03, q_min=-3.9, q_max=-2.9,
+                 stop_stiffness=200.0, stop_damping=2.0, timeout=20000):
+        self.slave_id = slave_id
+        self.master_id = master_id
+        self.limits = MotorControl.Limit_Param[motor_type]
+        self.q = q
+        self.dq = 0.0
+        self.tau = 0.0
+        self.inertia = inertia
+        self.damping = damping
+        self.friction = friction
+        self.q_min = q_min
+        self.q_max = q_max
+        self.stop_stiffness = stop_stiffness
+        self.stop_damping = stop_damping
+        self.status = STATUS_DISABLED
+        self.command = (Control_Type.MIT, (0.0, 0.0, 0.0, 0.0, 0.0))
+        self.last_command = None
+        self.zero_offset = 0.0
+        # thermal state, deg C
+        self.ambient = 25.0
+        self.temp_mos = self.ambient
+        self.temp_rotor = self.ambient
+        # statistics for tuning runs
+        self.peak_tau = 0.0
+        self.impacts = []  # (time, speed) each time an end stop is hit
+        self._in_contact = False
+        self.registers = {
+            DM_variable.MST_ID: master_id, DM_variable.ESC_ID: slave_id, DM_variable.TIMEOUT: timeout,
+            DM_variable.CTRL_MODE: int(Control_Type.MIT), DM_variable.PMAX: self.limits[0],
+            DM_variable.VMAX: self.limits[1], DM_variable.TMAX: self.limits[2], DM_variable.OT_Value: 120.0,
+            DM_variable.hw_ver: 1, DM_variable.sw_ver: 1, DM_variable.SN: 1000 + slave_id,
+            DM_variable.sub_ver: 0, DM_variable.can_br: 4, DM_variable.NPP: 14, DM_variable.Gr: 10.0,
+        }
+
+    # --- drive side ---
+    def control(self, mode, args, now):
+        if mode != self.registers[DM_variable.CTRL_MODE]:
+            return  # the drive ignores frames for a mode it is not in
+        self.command = (mode, args)
+        self.last_command = now
+
+    def set_enabled(self, enabled, now):
+        self.status = STATUS_ENABLED if enabled else STATUS_DISABLED
+        self.last_command = now
+
+    def set_zero(self):
+        self.zero_offset += self.q
+        self.q_min -= self.q
+        self.q_max -= self.q
+        self.q = 0.0
+
+    def _torque(self):
+        if self.status != STATUS_ENABLED:
+            return 0.0
+        mode, args = self.command
+        tau_max = self.limits[2]
+        if mode == Control_Type.MIT:
+            kp, kd, q, dq, tau = args
+            out = kp * (q - self.q) + kd * (dq - self.dq) + tau
+        elif mode == Control_Type.VEL:
+            out = 0.5 * (args[0] - self.dq)
+        else:
+            # POS_VEL and Torque_Pos: velocity-limited position loop inside the drive
+            p, v_max, i_max = args
+            v_target = max(-v_max, min(v_max, 20.0 * (p - self.q)))
+            out = 0.5 * (v_target - self.dq)
+            if i_max is not None:
+                tau_max = min(tau_max, i_max * self.limits[2])
+        return max(-tau_max, min(tau_max, out))
+
+    def step(self, dt, now):
+        timeout = self.registers[DM_variable.TIMEOUT] * 50e-6
+        if (self.status == STATUS_ENABLED and timeout and self.last_command is not None
+                and now - self.last_command > timeout):
+            self.status = STATUS_COMM_LOSS
+        tau = self._torque()
+        self.tau = tau
+        if abs(tau) > self.peak_tau:
+            self.peak_tau = abs(tau)
+        external = 0.0
+        contact = self.q < self.q_min or self.q > self.q_max
+        if contact:
+            edge = self.q_min if self.q < self.q_min else self.q_max
+            external = -self.stop_stiffness * (self.q - edge) - self.stop_damping * self.dq
+            if not self._in_contact and abs(self.dq) > 0.2:
+                self.impacts.append((now, abs(self.dq)))
+        self._in_contact = contact
+        friction = -math.copysign(min(self.friction, abs(tau + external)), self.dq) if self.dq else 0.0
+        ddq = (tau + external + friction - self.damping * self.dq) / self.inertia
+        self.dq += ddq * dt
+        self.q += self.dq * dt
+        # I^2 R heating of the rotor, slower MOS heating, Newtonian cooling
+        self.temp_rotor += dt * (0.8 * tau * tau - (self.temp_rotor - self.ambient) / 60.0)
+        self.temp_mos += dt * (0.2 * tau * tau - (self.temp_mos - self.ambient) / 30.0)
+        # Over-temperature protection (OT_Value) trips the drive until it is enabled again
+        if self.status == STATUS_ENABLED:
+            ot_limit = self.registers[DM_variable.OT_Value]
+            if self.temp_mos >= ot_limit:
+                self.status = STATUS_MOS_OVER_TEMP
+            elif self.temp_rotor >= ot_limit:
+                self.status = STATUS_ROTOR_OVER_TEMP
+
+    def feedback(self):
+        q_max, dq_max, tau_max = self.limits
+        q_uint = float_to_uint(max(-q_max, min(q_max, self.q)), -q_max, q_max, 16)
+        dq_uint = float_to_uint(max(-dq_max, min(dq_max, self.dq)), -dq_max, dq_max, 12)
+        tau_uint = float_to_uint(max(-tau_max, min(tau_max, self.tau)), -tau_max, tau_max, 12)
+        return bytes([
+            (self.status << 4) | (self.slave_id & 0x0f),
+            q_uint >> 8, q_uint & 0xff,
+            dq_uint >> 4, ((dq_uint & 0xf) << 4) | (tau_uint >> 8), tau_uint & 0xff,
+            min(255, int(self.temp_mos)), min(255, int(self.temp_rotor)),
+        ])
+
+    def read_register(self, rid):
+        if rid == DM_variable.p_m or rid == DM_variable.xout:
+            return self.q
+        return self.registers.get(rid, 0 if is_in_ranges(rid) else 0.0)
+
+
+class SimulatedSerial:
+    """
+    pyserial stand-in wired to simulated motors.
+    :param motors: SimulatedMotor list
+    :param clock: time source the physics follow (seconds)
+    :param reply_delay: bus + adapter latency before a reply becomes readable
+    """
+    RX_HEADER = 0xAA
+    RX_CMD = 0x11
+    RX_TAIL = 0x55
+
+    def __init__(self, motors, clock=time.monotonic, reply_delay=0.0003, dt=0.0005):
+        self.motors = {m.slave_id: m for m in motors}
+        self.clock = clock
+        self.reply_delay = reply_delay
+        self.dt = dt
+        self.port = SIM_PORT
+        self.is_open = True
+        self.frames_in = 0
+        self.frames_out = 0
+        self.link_up = True  # False drops everything in both directions, like an unplugged adapter
+        self._now = clock()
+        self._replies = deque()  # (ready time, bytes)
+        self._lock = threading.Lock()
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def advance(self, now=None):
+        """Integrate every motor up to `now` (default: clock())."""
+        now = self.clock() if now is None else now
+        with self._lock:
+            while self._now + self.dt <= now:
+                self._now += self.dt
+                for motor in self.motors.values():
+                    motor.step(self.dt, self._now)
+
+    def _reply(self, can_id, data):
+        frame = struct.pack("<BBBI", self.RX_HEADER, self.RX_CMD, 0x08, can_id) + bytes(data) + bytes([self.RX_TAIL])
+        self._replies.append((self._now + self.reply_delay, frame))
+        self.frames_out += 1
+
+    def write(self, data):
+        self.advance()
+        if not self.link_up:
+            return len(data)
+        with self._lock:
+            for i in range(0, len(data) - 29, 30):
+                frame = data[i:i + 30]
+                self.frames_in += 1
+                self._handle(frame[13] | (frame[14] << 8), bytes(frame[21:29]))
+        return len(data)
+
+    def _handle(self, can_id, d):
+        now = self._now
+        if can_id == 0x7FF:
+            motor = self.motors.get(d[0] | (d[1] << 8))
+            if motor is None:
+                return
+            if d[2] == 0xCC:
+                self._reply(motor.master_id, motor.feedback())
+            elif d[2] in (0x33, 0x55):
+                rid = d[3]
+                if d[2] == 0x55:
+                    fmt = "<I" if is_in_ranges(rid) else "<f"
+                    motor.registers[rid] = struct.unpack(fmt, d[4:8])[0]
+                value = motor.read_register(rid)
+                payload = struct.pack("<I" if is_in_ranges(rid) else "<f", value)
+                self._reply(motor.master_id, d[0:4] + payload)
+            return
+        base, slave_id = can_id & 0x700, can_id & 0xff
+        motor = self.motors.get(slave_id)
+        if motor is None:
+            return
+        if base == 0 and d[:7] == b"\xff" * 7:
+            if d[7] == 0xFC:
+                motor.set_enabled(True, now)
+            elif d[7] == 0xFD:
+                motor.set_enabled(False, now)
+            elif d[7] == 0xFE:
+                motor.set_zero()
+        elif base == 0:
+            q_max, dq_max, _ = motor.limits
+            q = _uint_to_float((d[0] << 8) | d[1], -q_max, q_max, 16)
+            dq = _uint_to_float((d[2] << 4) | (d[3] >> 4), -dq_max, dq_max, 12)
+            kp = _uint_to_float(((d[3] & 0xf) << 8) | d[4], 0, 500, 12)
+            kd = _uint_to_float((d[5] << 4) | (d[6] >> 4), 0, 5, 12)
+            tau = _uint_to_float(((d[6] & 0xf) << 8) | d[7], -motor.limits[2], motor.limits[2], 12)
+            motor.control(Control_Type.MIT, (kp, kd, q, dq, tau), now)
+        elif base == 0x100:
+            p, v = struct.unpack("<ff", d)
+            motor.control(Control_Type.POS_VEL, (p, abs(v), None), now)
+        elif base == 0x200:
+            motor.control(Control_Type.VEL, struct.unpack("<f", d[0:4]), now)
+        elif base == 0x300:
+            p, v, i = struct.unpack("<fHH", d)
+            motor.control(Control_Type.Torque_Pos, (p, v / 100.0, i / 10000.0), now)
+        else:
+            return
+        self._reply(motor.master_id, motor.feedback())
+
+    def read_all(self):
+        self.advance()
+        with self._lock:
+            out = []
+            if not self.link_up:
+                self._replies.clear()
+            while self._replies and self._replies[0][0] <= self._now:
+                out.append(self._replies.popleft()[1])
+            return b"".join(out)
+
+    @property
+    def in_waiting(self):
+        return sum(len(r[1]) for r in self._replies)
+
+
+def _uint_to_float(x, x_min, x_max, bits):
+    return float(x) / ((1 << bits) - 1) * (x_max - x_min) + x_min
+
+
+def open_simulated_gripper(slave_id, master_id, clock=time.monotonic, **motor_kwargs):
+    """One simulated DM4310 on a simulated adapter, as used for port "sim://"."""
+    return SimulatedSerial([SimulatedMotor(slave_id, master_id, **motor_kwargs)], clock=clock)
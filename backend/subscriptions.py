@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Per-client status subscriptions.
+
+A client sends
+
+    {"command": "subscribe", "value": {"topics": ["telemetry", "events"],
+                                       "fields": ["position", "mode"], "rate": 30}}
+
+- telemetry: {"type": "status"} messages with only the requested fields (all if
+  omitted), at most `rate` Hz
+- events:    {"type": "event"} messages whenever mode / calibration / connection /
+  fault state changes, carrying only the changed keys
+- metrics:   {"type": "metrics"} latency metrics, at most once per second
+
+Subscriptions are immutable and hashable, so clients asking for the same thing
+share one group: the status pump renders and serializes each distinct
+subscription once per tick and hands the same message to every member.
+A client that never subscribes gets DEFAULT_SUBSCRIPTION (full status at the
+server's status rate), which is what the frontend expects.
+"""
+import json
+
+TOPICS = ("telemetry", "events", "metrics")
+EVENT_FIELDS = ("is_connected", "mode", "is_calibrated", "min_angle", "max_angle", "fault")
+MAX_RATE = 50.0
+METRICS_RATE = 1.0
+
+
+class Subscription:
+    __slots__ = ("topics", "fields", "rate", "_key")
+
+    def __init__(self, topics=("telemetry",), fields=None, rate=None):
+        """
+        :param topics: subset of TOPICS
+        :param fields: status keys to include in telemetry, None for all
+        :param rate: telemetry rate in Hz, None for the server's status rate
+        """
+        self.topics = frozenset(topics)
+        self.fields = tuple(sorted(fields)) if fields is not None else None
+        self.rate = rate
+        self._key = (tuple(sorted(self.topics)), self.fields, self.rate)
+
+    @classmethod
+    def from_dict(cls, spec):
+        """
+        Validate a client's subscribe request.
+        :raises ValueError: if the request is malformed
+        """
+        if spec is None:
+            return DEFAULT_SUBSCRIPTION
+        if not isinstance(spec, dict):
+            raise ValueError("subscription must be an object")
+        topics = spec.get("topics", ["telemetry"])
+        if isinstance(topics, str):
+            topics = [topics]
+        unknown = set(topics) - set(TOPICS)
+        if unknown:
+            raise ValueError(f"unknown topic(s): {', '.join(sorted(unknown))}")
+        fields = spec.get("fields")
+        if fields is not None:
+            if isinstance(fields, str):
+                fields = fields.split(",")
+            if not all(isinstance(f, str) for f in fields):
+                raise ValueError("fields must be a list of status keys")
+        rate = spec.get("rate")
+        if rate is not None:
+            rate = float(rate)
+            if not 0 < rate:
+                raise ValueError("rate must be positive")
+            rate = min(rate, MAX_RATE)
+        return cls(topics, fields, rate)
+
+    def __eq__(self, other):
+        return isinstance(other, Subscription) and self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def as_dict(self):
+        return {"topics": sorted(self.topics), "fields": list(self.fields) if self.fields is not None else None,
+                "rate": self.rate}
+
+
+DEFAULT_SUBSCRIPTION = Subscription()
+
+
+class SubscriptionGroup:
+    """
+    Delivery state shared by every client with the same subscription.
+    """
+    __slots__ = ("subscription", "period", "next_telemetry", "next_metrics", "last_events")
+
+    def __init__(self, subscription, default_period):
+        self.subscription = subscription
+        self.period = 1.0 / subscription.rate if subscription.rate else default_period
+        self.next_telemetry = 0.0
+        self.next_metrics = 0.0
+        self.last_events = None
+
+    @property
+    def needs_status(self):
+        topics = self.subscription.topics
+        return "telemetry" in topics or "events" in topics
+
+    def render(self, now, status, metrics=None, envelope=None):
+        """
+        :param status: status snapshot of this tick (None if not taken)
+        :param metrics: latency metrics, only passed when metrics_due() said so
+        :param envelope: extra top-level keys for every message (e.g. {"gripper": id})
+        :return: list of (message type, encoded message) due for this group at `now`
+        """
+        topics = self.subscription.topics
+        extra = envelope or {}
+        messages = []
+        if "events" in topics and status is not None:
+            events = {k: status.get(k) for k in EVENT_FIELDS}
+            if self.last_events is None:
+                changed = events
+            else:
+                changed = {k: v for k, v in events.items() if self.last_events.get(k) != v}
+            self.last_events = events
+            if changed:
+                messages.append(("event", json.dumps({"type": "event", **extra, "data": changed})))
+        if "telemetry" in topics and status is not None and now >= self.next_telemetry:
+            self.next_telemetry += self.period
+            if self.next_telemetry <= now:
+                self.next_telemetry = now + self.period
+            fields = self.subscription.fields
+            data = status if fields is None else {k: status[k] for k in fields if k in status}
+            messages.append(("status", json.dumps({"type": "status", **extra, "data": data})))
+        if metrics is not None:
+            self.next_metrics = now + 1.0 / METRICS_RATE
+            messages.append(("metrics", json.dumps({"type": "metrics", **extra, "data": metrics})))
+        return messages
+
+    def wants_status(self, now):
+        return "events" in self.subscription.topics or self.telemetry_due(now)
+
+    def metrics_due(self, now):
+        return "metrics" in self.subscription.topics and now >= self.next_metrics
+
+    def telemetry_due(self, now):
+        return "telemetry" in self.subscription.topics and now >= self.next_telemetry
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Compact on-disk telemetry: the control loop appends one row per tick, full blocks
+are encoded and written by a background thread, files rotate by size and age.
+
+File layout (little endian):
+
+    file header   b"GTLOG1\\n", uint32 length, JSON {"columns": [...], "created": epoch}
+    block*        BLOCK_HEADER, payload
+
+    BLOCK_HEADER  uint32 rows, uint8 compression, uint32 payload bytes,
+                  float64 t_first, float64 t_last (epoch seconds)
+    payload       uint32[rows] timestamp deltas in microseconds (first = 0),
+                  float32[rows] for each column, column after column,
+                  optionally zlib / lzma compressed
+
+The block header is never compressed, so read_telemetry() skips blocks outside
+the requested time range without decoding them.
+"""
+import glob
+import json
+import lzma
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from clock import SYSTEM_CLOCK
+
+FILE_MAGIC = b"GTLOG1\n"
+BLOCK_HEADER = struct.Struct("<IBIdd")
+COMPRESSION = {None: 0, "zlib": 1, "lzma": 2}
+MAX_DELTA_US = 0xFFFFFFFF
+
+
+def _compress(payload, compression):
+    if compression == "zlib":
+        return zlib.compress(payload, 6)
+    if compression == "lzma":
+        return lzma.compress(payload, preset=1)
+    return payload
+
+
+def _decompress(payload, code):
+    if code == 1:
+        return zlib.decompress(payload)
+    if code == 2:
+        return lzma.decompress(payload)
+    return payload
+
+
+class TelemetryRecorder:
+    """
+    :param directory: where the .gtl files go
+    :param columns: names of the float32 columns passed to record()
+    :param block_rows: rows per block handed to the writer thread
+    :param flush_interval: hand over a partial block after this many seconds
+    :param compression: None, "zlib" or "lzma"
+    :param max_file_bytes: rotate once a file grows past this size
+    :param max_file_age: rotate once a file is this many seconds old
+    :param clock: the controller's clock, whose monotonic() stamps are passed to record()
+    """
+    def __init__(self, directory, columns, block_rows=1000, flush_interval=5.0, compression="zlib",
+                 max_file_bytes=64 * 1024 * 1024, max_file_age=3600.0, clock=SYSTEM_CLOCK):
+        if compression not in COMPRESSION:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.directory = directory
+        self.columns = tuple(columns)
+        self.block_rows = block_rows
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self.max_file_bytes = max_file_bytes
+        self.max_file_age = max_file_age
+        self.clock = clock
+        # monotonic -> epoch offset, so the control loop can pass its own timestamps
+        self.epoch_offset = clock.time() - clock.monotonic()
+        self.rows = 0
+        self.blocks = 0
+        self.bytes_written = 0
+        self.dropped_blocks = 0
+        self.files = []
+        self._times = np.empty(block_rows, np.float64)
+        self._values = np.empty((block_rows, len(self.columns)), np.float32)
+        self._n = 0
+        self._queue = queue.Queue(maxsize=64)
+        self._file = None
+        self._file_opened = None
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, t, row):
+        """
+        Append one sample; called from the control loop.
+        :param t: clock.monotonic() timestamp
+        :param row: sequence of len(columns) numbers
+        """
+        n = self._n
+        if n and ((t - self._times[n - 1]) * 1e6 > MAX_DELTA_US or t - self._times[0] > self.flush_interval):
+            self._hand_over()
+            n = 0
+        self._times[n] = t
+        self._values[n] = row
+        self._n = n + 1
+        self.rows += 1
+        if self._n == self.block_rows:
+            self._hand_over()
+
+    def _hand_over(self):
+        block = (self._times[:self._n] + self.epoch_offset, self._values[:self._n])
+        self._times = np.empty(self.block_rows, np.float64)
+        self._values = np.empty((self.block_rows, len(self.columns)), np.float32)
+        self._n = 0
+        try:
+            self._queue.put_nowait(block)
+        except queue.Full:
+            self.dropped_blocks += 1  # the disk can't keep up; never block the control loop
+
+    def close(self, timeout=5.0):
+        if self._n:
+            self._hand_over()
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "blocks": self.blocks,
+            "bytes_written": self.bytes_written,
+            "dropped_blocks": self.dropped_blocks,
+            "queued_blocks": self._queue.qsize(),
+            "file": self.files[-1] if self.files else None,
+        }
+
+    # --- writer thread ---
+    def _run(self):
+        try:
+            while True:
+                block = self._queue.get()
+                if block is None:
+                    break
+                try:
+                    self._write_block(*block)
+                except OSError as e:
+                    print(f"[Telemetry] Write failed: {e}")
+        finally:
+            if self._file is not None:
+                self._file.close()
+
+    def _open_file(self, t_first):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(t_first))
+        path = os.path.join(self.directory, f"telemetry-{stamp}-{len(self.files):04d}.gtl")
+        self._file = open(path, "wb")
+        meta = json.dumps({"columns": list(self.columns), "created": t_first}).encode()
+        self._file.write(FILE_MAGIC + struct.pack("<I", len(meta)) + meta)
+        self._file_opened = self.clock.monotonic()
+        self.files.append(path)
+
+    def _write_block(self, times, values):
+        if (self._file is None or self._file.tell() > self.max_file_bytes
+                or self.clock.monotonic() - self._file_opened > self.max_file_age):
+            self._open_file(times[0])
+        # deltas of the rounded offsets, so rounding errors don't accumulate along the block
+        offsets = np.round((times - times[0]) * 1e6).astype(np.int64)
+        deltas = np.diff(offsets, prepend=0).astype(np.uint32)
+        payload = _compress(deltas.tobytes() + np.ascontiguousarray(values.T).tobytes(), self.compression)
+        header = BLOCK_HEADER.pack(len(times), COMPRESSION[self.compression], len(payload), times[0], times[-1])
+        self._file.write(header + payload)
+        self._file.flush()
+        self.blocks += 1
+        self.bytes_written += len(header) + len(payload)
+
+
+def _read_file(path, t_start, t_end, columns):
+    with open(path, "rb") as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"{path} is not a telemetry file")
+        meta = json.loads(f.read(struct.unpack("<I", f.read(4))[0]))
+        names = meta["columns"]
+        wanted = [names.index(c) for c in columns] if columns is not None else list(range(len(names)))
+        chunks = []
+        while True:
+            raw = f.read(BLOCK_HEADER.size)
+            if len(raw) < BLOCK_HEADER.size:
+                break
+            rows, code, size, t_first, t_last = BLOCK_HEADER.unpack(raw)
+            if (t_end is not None and t_first > t_end) or (t_start is not None and t_last < t_start):
+                f.seek(size, os.SEEK_CUR)
+                continue
+            payload = f.read(size)
+            if len(payload) < size:
+                break  # block still being written
+            data = _decompress(payload, code)
+            times = t_first + np.cumsum(np.frombuffer(data, np.uint32, rows), dtype=np.float64) * 1e-6
+            values = np.frombuffer(data, np.float32, rows * len(names), rows * 4).reshape(len(names), rows)
+            chunks.append((times, values[wanted]))
+    return [names[i] for i in wanted], chunks
+
+
+def read_telemetry(path, t_start=None, t_end=None, columns=None):
+    """
+    Load telemetry between two epoch times into numpy arrays.
+    :param path: a .gtl file or a directory of them
+    :param columns: subset of column names, None for all
+    :return: {"t": float64 epoch seconds, <column>: float32, ...}
+    """
+    files = sorted(glob.glob(os.path.join(path, "*.gtl"))) if os.path.isdir(path) else [path]
+    names, chunks = None, []
+    for file in files:
+        file_names, file_chunks = _read_file(file, t_start, t_end, columns)
+        if names is None:
+            names = file_names
+        elif file_names != names:
+            raise ValueError(f"{file} has columns {file_names}, expected {names}")
+        chunks.extend(file_chunks)
+    if names is None:
+        return {"t": np.empty(0)}
+    times = np.concatenate([c[0] for c in chunks]) if chunks else np.empty(0)
+    values = np.concatenate([c[1] for c in chunks], axis=1) if chunks else np.empty((len(names), 0), np.float32)
+    mask = np.ones(len(times), bool)
+    if t_start is not None:
+        mask &= times >= t_start
+    if t_end is not None:
+        mask &= times <= t_end
+    result = {"t": times[mask]}
+    for i, name in enumerate(names):
+        result[name] = values[i][mask]
+    return result
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Binary teleoperation stream: continuous position setpoints at hundreds of Hz.
+
+Frame (20 bytes, little endian), sent as a WebSocket binary message or a UDP
+datagram:
+
+    2s  magic b"TP"
+    B   version (1)
+    B   flags (reserved, 0)
+    I   sequence number, +1 per frame
+    d   sender timestamp, epoch seconds (time.time())
+    f   target position, rad
+
+The control loop applies only the newest frame each tick. Frames older than the
+last accepted sequence number, or older than `max_age` on arrival, are rejected.
+If no frame arrives for `deadman_timeout` the gripper holds its position, and the
+next frame starts a new stream at whatever sequence number it carries (a
+restarted sender counts from 0 again).
+One-way latency needs the sender's clock to be synchronized with ours (same host
+or NTP/PTP).
+"""
+import struct
+import threading
+import time
+
+from clock import SYSTEM_CLOCK
+from latency_trace import LatencyHistogram
+
+FRAME = struct.Struct("<2sBBIdf")
+MAGIC = b"TP"
+VERSION = 1
+# A sequence number this far below the last one is a restarted sender, not a late frame
+SEQ_RESTART_GAP = 1 << 16
+
+
+def encode_frame(seq, position, t_send=None):
+    return FRAME.pack(MAGIC, VERSION, 0, seq & 0xFFFFFFFF, time.time() if t_send is None else t_send, position)
+
+
+def decode_frame(data):
+    """
+    :return: (seq, t_send, position), or None if `data` is not a teleop frame
+    """
+    if len(data) != FRAME.size:
+        return None
+    magic, version, _, seq, t_send, position = FRAME.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    return seq, t_send, position
+
+
+class TeleopChannel:
+    """
+    Latest-wins mailbox between the frame receiver and the control loop.
+    :param clock: the controller's clock; expired() is called with its monotonic() readings
+    """
+    def __init__(self, deadman_timeout=0.2, max_age=0.1, clock=SYSTEM_CLOCK):
+        self.clock = clock
+        self.deadman_timeout = deadman_timeout
+        self.max_age = max_age
+        self.latency = LatencyHistogram()
+        self.latency_mean = None  # EWMA, seconds
+        self._lock = threading.Lock()
+        self._latest = None  # (seq, position) not yet applied
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._latest = None
+            self.last_seq = None
+            self.last_accept = None  # monotonic
+            self.received = 0
+            self.accepted = 0
+            self.lost = 0
+            self.superseded = 0
+            self.rejected_order = 0
+            self.rejected_stale = 0
+            self.deadman_trips = 0
+            self.active = False
+            self._rate_count = 0
+            self._rate_t0 = None
+            self.rate = 0.0
+
+    def offer(self, seq, t_send, position):
+        """
+        Called by the receiver for every decoded frame.
+        :return: True if the frame was accepted
+        """
+        t_arrival = self.clock.time()
+        now = self.clock.monotonic()
+        with self._lock:
+            self.received += 1
+            if self.last_accept is not None and now - self.last_accept > self.deadman_timeout:
+                self.last_seq = None  # silent for longer than the dead-man timeout: a new stream
+            last = self.last_seq
+            if last is not None and seq <= last and last - seq < SEQ_RESTART_GAP:
+                self.rejected_order += 1
+                return False
+            age = t_arrival - t_send
+            if age > self.max_age:
+                self.rejected_stale += 1
+                return False
+            if last is not None and seq > last:
+                self.lost += seq - last - 1
+            if self._latest is not None:
+                self.superseded += 1
+            self.last_seq = seq
+            self.last_accept = now
+            self._latest = (seq, position)
+            self.accepted += 1
+            self.latency.record(max(age, 0.0))
+            self.latency_mean = age if self.latency_mean is None else self.latency_mean + 0.05 * (age - self.latency_mean)
+            if self._rate_t0 is None:
+                self._rate_t0 = now
+            self._rate_count += 1
+            if now - self._rate_t0 >= 1.0:
+                self.rate = self._rate_count / (now - self._rate_t0)
+                self._rate_t0, self._rate_count = now, 0
+        return True
+
+    def take(self):
+        """
+        Control loop side: the newest unapplied setpoint (position), or None.
+        """
+        if self._latest is None:
+            return None
+        with self._lock:
+            latest, self._latest = self._latest, None
+        if latest is None:
+            return None
+        self.active = True
+        return latest[1]
+
+    def expired(self, now):
+        """True once an active stream has been silent for longer than the dead-man timeout."""
+        if not self.active or self.last_accept is None or now - self.last_accept <= self.deadman_timeout:
+            return False
+        with self._lock:
+            self.active = False
+            self.last_seq = None
+            self._latest = None
+        self.deadman_trips += 1
+        return True
+
+    def summary(self):
+        expected = self.accepted + self.lost
+        return {
+            "active": self.active,
+            "seq": self.last_seq,
+            "rate_hz": self.rate,
+            "latency_ms": self.latency_mean * 1000.0 if self.latency_mean is not None else None,
+            "latency_p99_ms": self.latency.percentile(99) * 1000.0 if self.latency.count else None,
+            "loss": self.lost / expected if expected else 0.0,
+            "received": self.received,
+            "superseded": self.superseded,
+            "rejected_order": self.rejected_order,
+            "rejected_stale": self.rejected_stale,
+            "deadman_trips": self.deadman_trips,
+        }
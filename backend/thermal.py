@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Thermal derating from the drive's own temperature readings (feedback data[6] /
+data[7], whole deg C).
+
+The drive disables itself once the MOS or rotor temperature reaches its OT_Value
+register, which at high duty turns a reciprocating run into stop-start trips.
+ThermalGovernor keeps the hotter sensor below OT_Value - margin instead: it
+projects each temperature `horizon` seconds ahead along its smoothed rate of
+rise, and maps the projection linearly onto a scale factor
+
+    projected <= limit - band  ->  1.0   (full move_torque, no rest)
+    projected >= limit         ->  min_scale
+
+The controller multiplies move_torque by the scale and, while reciprocating,
+rests with zero torque after every cycle so that the moving fraction of the
+time is also `scale`. Heat goes roughly with torque squared times duty, so the
+loop settles at the highest throughput the motor can sustain instead of
+oscillating between full speed and an OT trip.
+"""
+
+
+class ThermalGovernor:
+    """
+    :param ot_limit: drive over-temperature trip, deg C (the OT_Value register, when known)
+    :param margin: distance kept below the trip, deg C
+    :param band: width of the derating ramp below ot_limit - margin, deg C
+    :param horizon: look-ahead for the projected temperature, seconds
+    :param min_scale: lowest torque / duty factor
+    :param sample_period: seconds between rate-of-rise samples (the readings are 1 deg C steps)
+    :param slope_time: smoothing time constant of the rate of rise, seconds
+    """
+    SENSORS = ("mos", "rotor")
+
+    def __init__(self, ot_limit=120.0, margin=15.0, band=20.0, horizon=20.0, min_scale=0.3,
+                 sample_period=1.0, slope_time=10.0):
+        self.enabled = True
+        self.ot_limit = ot_limit
+        self.margin = margin
+        self.band = band
+        self.horizon = horizon
+        self.min_scale = min_scale
+        self.sample_period = sample_period
+        self.slope_time = slope_time
+        self.reset()
+
+    def reset(self):
+        self.temperatures = None  # (mos, rotor), deg C
+        self.slopes = [0.0, 0.0]  # deg C / s, rises only
+        self.projected = None  # hotter projection, deg C
+        self.scale = 1.0
+        self.derated_time = 0.0  # seconds spent below full scale
+        self.rest_time = 0.0  # seconds of rest inserted between cycles
+        self._sample = None  # (time, temperatures) of the last rate sample
+        self._last_update = None
+
+    @property
+    def limit(self):
+        return self.ot_limit - self.margin
+
+    def update(self, now, temperatures, ot_limit=None):
+        """
+        Called every control tick with the latest feedback.
+        :param temperatures: (mos, rotor) in deg C, or None before the first feedback
+        :param ot_limit: the drive's OT_Value if it has been read, overrides the default
+        :return: the scale factor for this tick
+        """
+        if self._last_update is not None and self.scale < 1.0:
+            self.derated_time += now - self._last_update
+        self._last_update = now
+        if ot_limit:
+            self.ot_limit = ot_limit
+        if temperatures is None:
+            return self.scale
+        self.temperatures = temperatures
+        if self._sample is None:
+            self._sample = (now, temperatures)
+        elif now - self._sample[0] >= self.sample_period:
+            t0, previous = self._sample
+            dt = now - t0
+            weight = min(1.0, dt / self.slope_time)
+            for i, (t_new, t_old) in enumerate(zip(temperatures, previous)):
+                rise = max(0.0, (t_new - t_old) / dt)
+                self.slopes[i] += weight * (rise - self.slopes[i])
+            self._sample = (now, temperatures)
+        self.projected = max(t + slope * self.horizon for t, slope in zip(temperatures, self.slopes))
+        if not self.enabled:
+            self.scale = 1.0
+        else:
+            ramp = (self.limit - self.projected) / self.band
+            self.scale = max(self.min_scale, min(1.0, ramp))
+        return self.scale
+
+    def rest_after(self, active_time):
+        """
+        Zero-torque rest after a cycle that moved for `active_time` seconds, so that the
+        moving fraction of the time equals the current scale.
+        """
+        if self.scale >= 1.0 or active_time is None:
+            return 0.0
+        rest = active_time * (1.0 - self.scale) / self.scale
+        self.rest_time += rest
+        return rest
+
+    def summary(self):
+        temperatures = self.temperatures
+        return {
+            "enabled": self.enabled,
+            "mos_c": temperatures[0] if temperatures is not None else None,
+            "rotor_c": temperatures[1] if temperatures is not None else None,
+            "projected_c": self.projected,
+            "limit_c": self.limit,
+            "ot_limit_c": self.ot_limit,
+            "scale": self.scale,
+            "derated_s": self.derated_time,
+            "rest_s": self.rest_time,
+        }
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Client-facing transports for GripperServer.
+
+- WebSocketTransport: the JSON command/status protocol used by the frontend.
+- HttpTransport: REST commands, GET /status and a Server-Sent Events stream at
+  GET /status/stream, implemented on plain asyncio streams (no Flask needed).
+- TeleopUdpTransport: binary teleop frames (teleop.py) as UDP datagrams. The
+  WebSocket transport accepts the same frames as binary messages.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from server_core import Transport
+from subscriptions import DEFAULT_SUBSCRIPTION, EVENT_FIELDS, Subscription
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# Commands accepted as POST /<command> for compatibility with the old Flask server
+LEGACY_MODE_MAP = {"grasp": "grasping", "release": "releasing", "reciprocate": "reciprocating", "stop": "stopped"}
+
+
+class WebSocketTransport(Transport):
+    name = "websocket"
+
+    def __init__(self, host="0.0.0.0", port=8765):
+        self.host = host
+        self.port = port
+        self.clients = set()
+        self.groups = {}  # Subscription -> set of websockets
+        self.client_subscriptions = {}
+        self._server = None
+        self._gripper_server = None
+
+    async def start(self, server):
+        if websockets is None:
+            raise RuntimeError("WebSocketTransport requires the 'websockets' package")
+        self._gripper_server = server
+        self._server = await websockets.serve(self._handler, self.host, self.port)
+        print(f"Listening on ws://{self.host}:{self.port}...")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def client_count(self):
+        return len(self.clients)
+
+    def subscriptions(self):
+        return set(self.groups)
+
+    async def publish(self, message, subscription=DEFAULT_SUBSCRIPTION, kind="status"):
+        members = self.groups.get(subscription)
+        if members:
+            await asyncio.gather(*[client.send(message) for client in list(members)], return_exceptions=True)
+
+    def _subscribe(self, websocket, subscription):
+        self._unsubscribe(websocket)
+        self.client_subscriptions[websocket] = subscription
+        self.groups.setdefault(subscription, set()).add(websocket)
+
+    def _unsubscribe(self, websocket):
+        subscription = self.client_subscriptions.pop(websocket, None)
+        members = self.groups.get(subscription)
+        if members is not None:
+            members.discard(websocket)
+            if not members:
+                del self.groups[subscription]
+
+    async def _handle_subscribe(self, websocket, value):
+        try:
+            subscription = Subscription.from_dict(value)
+        except (ValueError, TypeError) as e:
+            return {"type": "error", "data": {"command": "subscribe", "error": str(e)}}
+        self._subscribe(websocket, subscription)
+        if "events" in subscription.topics:
+            # Group members only see changes, so start the client off with the current state
+            status = self._gripper_server.get_status()
+            await websocket.send(json.dumps({"type": "event", "data": {k: status.get(k) for k in EVENT_FIELDS}}))
+        return {"type": "subscribed", "data": subscription.as_dict()}
+
+    async def _handler(self, websocket, *args):
+        server = self._gripper_server
+        self.clients.add(websocket)
+        self._subscribe(websocket, DEFAULT_SUBSCRIPTION)
+        print(f"Client {websocket.remote_address} connected.")
+        try:
+            await websocket.send(json.dumps({"type": "status", "data": server.get_status()}))
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    server.handle_teleop(message)
+                    continue
+                t_receive = time.monotonic()
+                data = json.loads(message)
+                if data.get("command") == "subscribe":
+                    reply = await self._handle_subscribe(websocket, data.get("value"))
+                else:
+                    reply = await server.handle_command(data, t_receive)
+                if reply is not None:
+                    await websocket.send(json.dumps(reply))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.clients.discard(websocket)
+            self._unsubscribe(websocket)
+            print(f"Client {websocket.remote_address} disconnected.")
+
+
+class HttpTransport(Transport):
+    """
+    Endpoints:
+        GET  /status           current status as JSON
+        GET  /status/stream    text/event-stream of status messages; optional query
+                               ?topics=telemetry,events&fields=position,mode&rate=30
+        GET  /latency          per-stage command latency histograms
+        GET  /metrics          counters and histograms in the Prometheus text format
+        POST /command          JSON body {"command": ..., "value": ...}
+        POST /<command>        e.g. /grasp, /stop, /set_position with optional {"value": ...}
+    """
+    name = "http"
+    # Slow SSE consumers are skipped while this much output is still buffered
+    MAX_STREAM_BUFFER = 256 * 1024
+
+    def __init__(self, host="0.0.0.0", port=5000):
+        self.host = host
+        self.port = port
+        self.streams = {}  # writer -> Subscription
+        self._server = None
+        self._gripper_server = None
+
+    async def start(self, server):
+        self._gripper_server = server
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f"Listening on http://{self.host}:{self.port} (SSE: /status/stream)...")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in list(self.streams):
+            writer.close()
+
+    def client_count(self):
+        return len(self.streams)
+
+    def subscriptions(self):
+        return set(self.streams.values())
+
+    async def publish(self, message, subscription=DEFAULT_SUBSCRIPTION, kind="status"):
+        if not self.streams:
+            return
+        event = f"event: {kind}\ndata: ".encode() + message.encode() + b"\n\n"
+        for writer, stream_subscription in list(self.streams.items()):
+            if stream_subscription != subscription:
+                continue
+            if writer.is_closing():
+                self.streams.pop(writer, None)
+            elif writer.transport.get_write_buffer_size() < self.MAX_STREAM_BUFFER:
+                writer.write(event)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                t_receive = time.monotonic()
+                method, target, version = request_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, val = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = val.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+                path, _, query = target.partition("?")
+                path = path.rstrip("/") or "/"
+
+                if method == "GET" and path == "/status/stream":
+                    try:
+                        subscription = self._parse_subscription(query)
+                    except (ValueError, TypeError) as e:
+                        self._write_response(writer, 400, {"status": "error", "error": str(e)}, False)
+                        await writer.drain()
+                        break
+                    await self._stream_status(reader, writer, subscription)
+                    break
+                code, payload = await self._route(method, path, body, t_receive)
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                self._write_response(writer, code, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body, t_receive):
+        server = self._gripper_server
+        if method == "OPTIONS":
+            return 204, None
+        if method == "GET" and path == "/status":
+            return 200, server.get_status()
+        if method == "GET" and path == "/metrics":
+            return 200, await server.metrics_text()
+        if method == "GET" and path == "/latency":
+            return 200, (await server.handle_command({"command": "metrics"}))["data"]
+        if method != "POST":
+            return 404, {"status": "error", "error": f"{method} {path} not found"}
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"status": "error", "error": "invalid JSON body"}
+        if path != "/command":
+            data = dict(data, command=path.lstrip("/"))
+        if not data.get("command"):
+            return 400, {"status": "error", "error": "missing 'command'"}
+        reply = await server.handle_command(data, t_receive)
+        if reply is not None:
+            return 200, reply
+        response = {"status": "ok", "command": data["command"]}
+        if data["command"] in LEGACY_MODE_MAP:
+            response["mode"] = LEGACY_MODE_MAP[data["command"]]
+        return 200, response
+
+    def _write_response(self, writer, code, payload, keep_alive):
+        reason = {200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found"}.get(code, "")
+        if isinstance(payload, str):  # already rendered text, i.e. /metrics
+            body, content_type = payload.encode(), METRICS_CONTENT_TYPE
+        else:
+            body, content_type = (b"" if payload is None else json.dumps(payload).encode()), "application/json"
+        head = [
+            f"HTTP/1.1 {code} {reason}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            "Access-Control-Allow-Origin: *",
+            "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+            "Access-Control-Allow-Headers: Content-Type",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+
+    @staticmethod
+    def _parse_subscription(query):
+        params = {k: v[-1] for k, v in parse_qs(query).items()}
+        if not params:
+            return DEFAULT_SUBSCRIPTION
+        spec = {}
+        if "topics" in params:
+            spec["topics"] = params["topics"].split(",")
+        if "fields" in params:
+            spec["fields"] = params["fields"].split(",")
+        if "rate" in params:
+            spec["rate"] = params["rate"]
+        return Subscription.from_dict(spec)
+
+    async def _stream_status(self, reader, writer, subscription=DEFAULT_SUBSCRIPTION):
+        head = [
+            "HTTP/1.1 200 OK",
+            "Content-Type: text/event-stream",
+            "Cache-Control: no-cache",
+            "Access-Control-Allow-Origin: *",
+            "Connection: keep-alive",
+        ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        status = self._gripper_server.get_status()
+        if "telemetry" in subscription.topics:
+            fields = subscription.fields
+            data = status if fields is None else {k: status[k] for k in fields if k in status}
+            writer.write(b"event: status\ndata: " + json.dumps({"type": "status", "data": data}).encode() + b"\n\n")
+        if "events" in subscription.topics:
+            events = json.dumps({"type": "event", "data": {k: status.get(k) for k in EVENT_FIELDS}})
+            writer.write(b"event: event\ndata: " + events.encode() + b"\n\n")
+        self.streams[writer] = subscription
+        try:
+            # Nothing is expected from the client; EOF means it went away
+            while await reader.read(1024):
+                pass
+        finally:
+            self.streams.pop(writer, None)
+
+
+class TeleopUdpTransport(Transport, asyncio.DatagramProtocol):
+    """
+    Receives binary teleop frames; every datagram is one frame, nothing is sent back.
+    """
+    name = "teleop-udp"
+
+    def __init__(self, host="0.0.0.0", port=8766):
+        self.host = host
+        self.port = port
+        self._transport = None
+        self._gripper_server = None
+
+    async def start(self, server):
+        self._gripper_server = server
+        self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: self, local_addr=(self.host, self.port))
+        print(f"Listening for teleop frames on udp://{self.host}:{self.port}...")
+
+    async def stop(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    def datagram_received(self, data, addr):
+        self._gripper_server.handle_teleop(data)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+WebSocket load test: N concurrent clients against server_ws_manual.py.
+
+By default a server is started on a simulated motor (--port sim://) so the test
+needs no hardware. For every client count in --clients the harness connects that
+many clients at once, a fraction of them (--senders) sending set_position at
+--command-rate Hz and the rest only watching, and measures over --duration s:
+
+- status inter-arrival time per client (and the slowest client's status rate)
+- end-to-end command latency: set_position sent -> first status carrying that target
+- server CPU (from /proc, when the server process is known)
+
+Example:
+    python ws_loadtest.py --clients 1,10,50,100,200,500 --senders 0.1 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from latency_trace import LatencyHistogram
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+DEFAULT_STEPS = "1,2,5,10,20,50,100,200,500"
+
+
+class ClientStats:
+    __slots__ = ("statuses", "first", "last", "sent", "seen", "errors")
+
+    def __init__(self):
+        self.statuses = 0
+        self.first = None
+        self.last = None
+        self.sent = 0
+        self.seen = 0
+        self.errors = 0
+
+    def rate(self):
+        if self.statuses < 2:
+            return 0.0
+        return (self.statuses - 1) / (self.last - self.first)
+
+
+class LoadStep:
+    """One measurement at a fixed number of clients."""
+    def __init__(self, url, clients, senders, command_rate):
+        self.url = url
+        self.clients = clients
+        self.senders = senders
+        self.command_rate = command_rate
+        self.measuring = False
+        self.stats = [ClientStats() for _ in range(clients)]
+        self.inter_arrival = LatencyHistogram()
+        self.command_latency = LatencyHistogram()
+        self.connect_failures = 0
+
+    async def client(self, index, ready, stop):
+        stats = self.stats[index]
+        sending = index < self.senders
+        pending = {}
+        connected = False
+        try:
+            async with websockets.connect(self.url, max_size=None, open_timeout=30) as ws:
+                connected = True
+                ready.release()
+                sender = asyncio.ensure_future(self._send_loop(ws, index, stats, pending, stop)) if sending else None
+                try:
+                    while not stop.is_set():
+                        try:
+                            message = await asyncio.wait_for(ws.recv(), 0.5)
+                        except asyncio.TimeoutError:
+                            continue
+                        now = time.monotonic()
+                        data = json.loads(message)
+                        if data.get("type") != "status" or not self.measuring:
+                            continue
+                        if stats.last is not None:
+                            self.inter_arrival.record(now - stats.last)
+                        else:
+                            stats.first = now
+                        stats.last = now
+                        stats.statuses += 1
+                        if pending:
+                            t_send = pending.pop(data["data"].get("target_position"), None)
+                            if t_send is not None:
+                                self.command_latency.record(now - t_send)
+                                stats.seen += 1
+                finally:
+                    if sender is not None:
+                        sender.cancel()
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+            if not connected:
+                self.connect_failures += 1
+                ready.release()
+            else:
+                stats.errors += 1
+
+    async def _send_loop(self, ws, index, stats, pending, stop):
+        period = 1.0 / self.command_rate
+        seq = 0
+        next_send = time.monotonic()
+        while not stop.is_set():
+            await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+            next_send += period
+            if not self.measuring:
+                continue
+            seq += 1
+            # Unique per client and command, inside the uncalibrated +-100 rad clamp
+            value = -3.4 + index * 1e-3 + (seq % 997) * 1e-6
+            pending[value] = time.monotonic()
+            stats.sent += 1
+            await ws.send(json.dumps({"command": "set_position", "value": value}))
+
+    async def run(self, duration, warmup, cpu_probe):
+        stop = asyncio.Event()
+        ready = asyncio.Semaphore(0)
+        tasks = [asyncio.ensure_future(self.client(i, ready, stop)) for i in range(self.clients)]
+        for _ in range(self.clients):
+            await ready.acquire()
+        await asyncio.sleep(warmup)
+        cpu_start = cpu_probe()
+        t0 = time.monotonic()
+        self.measuring = True
+        await asyncio.sleep(duration)
+        self.measuring = False
+        elapsed = time.monotonic() - t0
+        cpu_end = cpu_probe()
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.report(elapsed, cpu_start, cpu_end)
+
+    def report(self, elapsed, cpu_start, cpu_end):
+        rates = [s.rate() for s in self.stats if s.statuses]
+        sent = sum(s.sent for s in self.stats)
+        seen = sum(s.seen for s in self.stats)
+        return {
+            "clients": self.clients,
+            "senders": self.senders,
+            "connected": self.clients - self.connect_failures,
+            "status_rate_mean": sum(rates) / len(rates) if rates else 0.0,
+            "status_rate_min": min(rates) if rates else 0.0,
+            "inter_arrival": self.inter_arrival.summary(),
+            "command_latency": self.command_latency.summary(),
+            "commands_sent": sent,
+            "commands_seen": seen,
+            "server_cpu": (cpu_end - cpu_start) / elapsed if cpu_start is not None and cpu_end is not None else None,
+            "errors": sum(s.errors for s in self.stats),
+        }
+
+
+def process_cpu_seconds(pid):
+    """User + system CPU time of a process from /proc (Linux), or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def start_local_server(ws_port, extra_args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, os.path.join(here, "server_ws_manual.py"), "--port", "sim://",
+           "--ws-port", str(ws_port), "--http-port", "0"] + extra_args
+    return subprocess.Popen(cmd, cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+
+async def wait_for_server(url, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with websockets.connect(url, open_timeout=2):
+                return True
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+            await asyncio.sleep(0.25)
+    return False
+
+
+def print_table(results):
+    fmt = "{:>7} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8} {:>7}"
+    print(fmt.format("clients", "senders", "Hz/mean", "Hz/min", "ia p50", "ia p99",
+                     "cmd p50", "cmd p99", "seen %", "cpu %"))
+    for r in results:
+        ia, cmd = r["inter_arrival"], r["command_latency"]
+        ms = lambda h, k: f"{h[k]:.1f}" if h.get("count") else "-"
+        seen = f"{100.0 * r['commands_seen'] / r['commands_sent']:.0f}" if r["commands_sent"] else "-"
+        cpu = f"{100.0 * r['server_cpu']:.0f}" if r["server_cpu"] is not None else "-"
+        print(fmt.format(r["clients"], r["senders"], f"{r['status_rate_mean']:.1f}", f"{r['status_rate_min']:.1f}",
+                         ms(ia, "p50_ms"), ms(ia, "p99_ms"), ms(cmd, "p50_ms"), ms(cmd, "p99_ms"), seen, cpu))
+
+
+async def main(args):
+    if websockets is None:
+        raise SystemExit("ws_loadtest requires the 'websockets' package")
+    raise_fd_limit()
+    server = None
+    pid = args.server_pid
+    url = args.url
+    if url is None:
+        server = start_local_server(args.ws_port, args.server_args)
+        pid = server.pid
+        url = f"ws://127.0.0.1:{args.ws_port}"
+    try:
+        if not await wait_for_server(url):
+            raise SystemExit(f"Server at {url} did not come up")
+        cpu_probe = (lambda: process_cpu_seconds(pid)) if pid else (lambda: None)
+        results = []
+        for clients in [int(n) for n in args.clients.split(",")]:
+            senders = min(clients, max(1 if args.senders > 0 else 0, round(clients * args.senders)))
+            step = LoadStep(url, clients, senders, args.command_rate)
+            result = await step.run(args.duration, args.warmup, cpu_probe)
+            results.append(result)
+            print_table([result])
+            await asyncio.sleep(args.pause)
+        print("\nScaling curve:")
+        print_table(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.json}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="WebSocket load test for the gripper server")
+    parser.add_argument("--url", default=None, help="existing server to test (default: start one on sim://)")
+    parser.add_argument("--server-pid", type=int, default=None, help="pid of an existing server, for CPU usage")
+    parser.add_argument("--ws-port", type=int, default=8799, help="port for the locally started server")
+    parser.add_argument("--clients", default=DEFAULT_STEPS, help="comma separated client counts")
+    parser.add_argument("--senders", type=float, default=0.1, help="fraction of clients sending set_position")
+    parser.add_argument("--command-rate", type=float, default=10.0, help="set_position rate per sender, Hz")
+    parser.add_argument("--duration", type=float, default=10.0, help="measurement window per step, s")
+    parser.add_argument("--warmup", type=float, default=1.0, help="settle time after connecting, s")
+    parser.add_argument("--pause", type=float, default=1.0, help="pause between steps, s")
+    parser.add_argument("--json", default=None, help="write the raw results to this file")
+    parser.add_argument("server_args", nargs="*", help="extra arguments for the local server (after --)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))